@@ -0,0 +1,132 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+
+from .errors import CircuitOpen, UpstreamError
+
+# Состояния предохранителя
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Предохранитель запросов к одному API.
+
+    В замкнутом состоянии запоминаются результаты последних window запросов. Если среди них не меньше
+    min_calls запросов и доля ошибок достигает failure_rate, предохранитель размыкается: следующие open_time
+    секунд запросы к API не выполняются и сразу завершаются ошибкой CircuitOpen, а не ждут таймаута.
+    Затем предохранитель переходит в полуоткрытое состояние и пропускает не больше probes пробных запросов
+    одновременно: если probes из них подряд выполнены успешно, предохранитель замыкается, а при первой
+    ошибке снова размыкается.
+
+    Ошибкой считается только UpstreamError; отмена запроса и прочие исключения на состояние не влияют.
+    """
+
+    def __init__(self, window: int, min_calls: int, failure_rate: float, open_time: float, probes: int):
+        """
+        :param window: Количество последних запросов, по которым считается доля ошибок.
+        :type window: int
+        :param min_calls: Минимальное количество запросов в окне, при котором предохранитель может разомкнуться.
+        :type min_calls: int
+        :param failure_rate: Доля ошибок, при которой предохранитель размыкается.
+        :type failure_rate: float
+        :param open_time: Время, на которое приостанавливаются запросы, секунды.
+        :type open_time: float
+        :param probes: Количество успешных пробных запросов, после которых предохранитель замыкается.
+        :type probes: int
+        """
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_time = open_time
+        self.probes = probes
+        self.state = CLOSED
+        self.opened = 0
+        self.rejected = 0
+        self.failures = 0
+        self._results = deque(maxlen=window)  # True - успешный запрос, False - ошибка
+        self._opened_at = 0.0
+        self._probing = 0
+        self._probe_successes = 0
+
+    def _open(self):
+        self.state = OPEN
+        self.opened += 1
+        self._opened_at = time.monotonic()
+        self._probing = 0
+        self._probe_successes = 0
+
+    def check(self):
+        """
+        Проверяет, что запрос к API может быть выполнен, не меняя состояния предохранителя.
+
+        Позволяет отказаться от запроса до ожидания в очереди ограничителя частоты.
+
+        :raises CircuitOpen: Если предохранитель разомкнут.
+        """
+        if self.state == OPEN and time.monotonic() < self._opened_at + self.open_time:
+            self.rejected += 1
+            raise CircuitOpen("Запросы к API временно приостановлены после ошибок")
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        Выполняет запрос к API под контролем предохранителя и записывает его результат.
+
+        :raises CircuitOpen: Если предохранитель разомкнут или все пробные запросы уже выполняются.
+        """
+        if self.state == OPEN:
+            self.check()
+            self.state = HALF_OPEN
+        # Пробный запрос относится к текущему размыканию; результаты пробных запросов прошлых размыканий
+        # не учитываются
+        probe = self.state == HALF_OPEN
+        opened = self.opened
+        if probe:
+            if self._probing >= self.probes:
+                self.rejected += 1
+                raise CircuitOpen("Выполняются пробные запросы к API после ошибок")
+            self._probing += 1
+
+        try:
+            yield
+        except UpstreamError:
+            self.failures += 1
+            if probe:
+                if self.state == HALF_OPEN and self.opened == opened:
+                    self._open()
+            elif self.state == CLOSED:
+                self._record(False)
+            raise
+        except BaseException:
+            if probe and self.state == HALF_OPEN and self.opened == opened:
+                self._probing -= 1
+            raise
+        else:
+            if probe and self.state == HALF_OPEN and self.opened == opened:
+                self._probing -= 1
+                self._probe_successes += 1
+                if self._probe_successes >= self.probes:
+                    self.state = CLOSED
+                    self._results.clear()
+            elif self.state == CLOSED:
+                self._record(True)
+
+    def _record(self, success: bool):
+        self._results.append(success)
+        failed = self._results.count(False)
+        if len(self._results) >= self.min_calls and failed >= self.failure_rate * len(self._results):
+            self._open()
+
+    def stats(self) -> dict:
+        """
+        Возвращает состояние и счётчики предохранителя.
+
+        :return: Признак разомкнутого состояния (1 - разомкнут, 0.5 - пробные запросы, 0 - замкнут),
+            количество размыканий, отклонённых запросов и ошибок.
+        :rtype: dict
+        """
+        return {"open": {CLOSED: 0, HALF_OPEN: 0.5, OPEN: 1}[self.state], "opened": self.opened,
+                "rejected": self.rejected, "failures": self.failures}
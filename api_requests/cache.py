@@ -0,0 +1,159 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Кэш ограниченного размера с вытеснением давно не использованных записей.
+
+    Ведёт счётчики попаданий, промахов и вытеснений, по которым можно оценить эффективность кэша.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: Максимальное количество записей в кэше.
+        :type max_size: int
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Возвращает значение по ключу и помечает запись как недавно использованную.
+
+        :param key: Ключ записи.
+        :type key: Hashable
+        :return: Значение или None, если записи нет.
+        :rtype: Optional[Any]
+        """
+        if key not in self._data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Сохраняет значение по ключу, вытесняя самую старую запись при переполнении.
+
+        :param key: Ключ записи.
+        :type key: Hashable
+        :param value: Сохраняемое значение.
+        :type value: Any
+        """
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """
+        Возвращает счётчики кэша.
+
+        :return: Словарь с количеством записей, попаданий, промахов и вытеснений.
+        :rtype: dict
+        """
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class TTLCache(LRUCache):
+    """
+    Кэш ограниченного размера, записи которого устаревают через заданное время.
+
+    Устаревшая запись считается промахом и удаляется при обращении к ней.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        :param max_size: Максимальное количество записей в кэше.
+        :type max_size: int
+        :param ttl: Время жизни записи, секунды.
+        :type ttl: float
+        """
+        super().__init__(max_size)
+        self.ttl = ttl
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = super().get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            # Устаревшая запись: учитываем её как промах, а не как попадание
+            self.hits -= 1
+            self.misses += 1
+            self.expirations += 1
+            del self._data[key]
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        super().set(key, (value, time.monotonic() + self.ttl))
+
+    def expires_in(self, key: Hashable) -> float:
+        """
+        Возвращает время, оставшееся до устаревания записи.
+
+        В отличие от get, не меняет счётчики и порядок вытеснения записей.
+
+        :param key: Ключ записи.
+        :type key: Hashable
+        :return: Оставшееся время жизни записи в секундах или 0, если записи нет или она устарела.
+        :rtype: float
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return 0.0
+        return max(entry[1] - time.monotonic(), 0.0)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "expirations": self.expirations}
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом в один.
+
+    Пока вызов для ключа выполняется, остальные вызывающие ждут его результата,
+    а не запускают такой же запрос повторно.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._inflight = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет func для ключа или присоединяется к уже выполняющемуся вызову.
+
+        Отмена одного из ожидающих не отменяет общий вызов для остальных.
+
+        :param key: Ключ вызова.
+        :type key: Hashable
+        :param func: Функция, возвращающая корутину с вызовом.
+        :type func: Callable[[], Awaitable[Any]]
+        :return: Результат вызова.
+        :rtype: Any
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
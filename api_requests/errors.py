@@ -0,0 +1,29 @@
+class ApiError(Exception):
+    """
+    Базовое исключение для ошибок получения данных от API Яндекса.
+    """
+
+
+class QuotaExceeded(ApiError):
+    """
+    Запрос к API Яндекса не выполнен, потому что исчерпана квота или переполнена очередь ожидания.
+    """
+
+
+class CityNotFound(ApiError):
+    """
+    Геокодер не нашёл город с указанным названием.
+    """
+
+
+class UpstreamError(ApiError):
+    """
+    API Яндекса не ответило, ответило ошибкой или вернуло ответ в неожиданном формате.
+    """
+
+
+class CircuitOpen(UpstreamError):
+    """
+    Запрос к API Яндекса не выполнен, потому что API недавно отвечало ошибками и запросы к нему временно
+    приостановлены (разомкнут предохранитель).
+    """
@@ -0,0 +1,168 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
+# Названия погодных условий API Яндекс.Погоды
+CONDITIONS = {"clear": "ясно", "partly-cloudy": "малооблачно", "cloudy": "облачно с прояснениями",
+              "overcast": "пасмурно", "drizzle": "морось", "light-rain": "небольшой дождь", "rain": "дождь",
+              "moderate-rain": "умеренный дождь", "heavy-rain": "сильный дождь",
+              "continuous-heavy-rain": "длительный сильный дождь", "showers": "ливень", "wet-snow": "дождь со снегом",
+              "light-snow": "небольшой снег", "snow": "снег", "snow-showers": "снегопад", "hail": "град",
+              "thunderstorm": "гроза", "thunderstorm-with-rain": "дождь с грозой",
+              "thunderstorm-with-hail": "гроза с градом"}
+
+# Части суток в ответе API в порядке их наступления
+PARTS = ("night", "morning", "day", "evening")
+
+
+class Weather(NamedTuple):
+    """
+    Погода в момент времени или в часть суток.
+    """
+    temp: int
+    feels_like: int
+    wind_speed: float
+    pressure_mm: int
+    humidity: Optional[int]
+    condition: str
+    prec_prob: Optional[int]
+
+    @property
+    def condition_text(self) -> str:
+        return CONDITIONS.get(self.condition, self.condition)
+
+
+class Hour(NamedTuple):
+    """
+    Прогноз на час.
+    """
+    ts: int  # начало часа, секунды с начала эпохи
+    weather: Weather
+
+
+class Day(NamedTuple):
+    """
+    Прогноз на день.
+    """
+    date: str  # местная дата в формате ГГГГ-ММ-ДД
+    temp_min: int
+    temp_max: int
+    parts: tuple[Weather, ...]  # ночь, утро, день, вечер
+
+    @property
+    def condition_text(self) -> str:
+        # Погода дня описывается дневной частью суток, а если её нет - последней из известных
+        return self.parts[min(2, len(self.parts) - 1)].condition_text if self.parts else ""
+
+
+class Forecast(NamedTuple):
+    """
+    Прогноз погоды для точки в компактном виде.
+
+    Из ответа /v2/forecast сохраняются только поля, которые показывает бот, в виде кортежей,
+    поэтому прогноз в кэше занимает заметно меньше памяти, чем разобранный JSON, а фактическая погода,
+    почасовой прогноз и прогноз на неделю получаются из одного ответа API.
+    """
+    now: int  # время ответа API, секунды с начала эпохи
+    offset: int  # смещение часового пояса точки от UTC, секунды
+    fact: Weather
+    hours: tuple[Hour, ...]
+    days: tuple[Day, ...]
+
+    def local_time(self, ts: int) -> datetime:
+        """
+        Возвращает местное время точки.
+
+        :param ts: Время, секунды с начала эпохи.
+        :type ts: int
+        :return: Местное время без часового пояса.
+        :rtype: datetime
+        """
+        return datetime.fromtimestamp(ts + self.offset, timezone.utc).replace(tzinfo=None)
+
+    def next_hours(self, count: int, now: Optional[float] = None) -> list[Hour]:
+        """
+        Возвращает прогноз на ближайшие часы, начиная с текущего.
+
+        :param count: Количество часов.
+        :type count: int
+        :param now: Текущее время, секунды с начала эпохи; по умолчанию время ответа API.
+        :type now: Optional[float]
+        :return: Прогнозы на часы по порядку; их может быть меньше count, если API не вернул прогноз дальше.
+        :rtype: list[Hour]
+        """
+        start = (now if now is not None else self.now) - 3600
+        return [hour for hour in self.hours if hour.ts > start][:count]
+
+    def day(self, days_ahead: int, now: Optional[float] = None) -> Optional[Day]:
+        """
+        Возвращает прогноз на день относительно текущей местной даты точки.
+
+        :param days_ahead: Через сколько дней: 0 - сегодня, 1 - завтра.
+        :type days_ahead: int
+        :param now: Текущее время, секунды с начала эпохи; по умолчанию время ответа API.
+        :type now: Optional[float]
+        :return: Прогноз на день или None, если API не вернул прогноз на этот день.
+        :rtype: Optional[Day]
+        """
+        date = (self.local_time(int(now if now is not None else self.now)) + timedelta(days=days_ahead)).date()
+        for day in self.days:
+            if day.date == date.isoformat():
+                return day
+        return None
+
+    def stale_note(self, max_age: float, now: float) -> str:
+        """
+        Возвращает пометку для прогноза, полученного от API больше max_age секунд назад.
+
+        Такой прогноз показывается, когда свежий прогноз получить не удалось.
+
+        :param max_age: Возраст прогноза, после которого он считается устаревшим, секунды.
+        :type max_age: float
+        :param now: Текущее время, секунды с начала эпохи.
+        :type now: float
+        :return: Пометка с местным временем получения прогноза или пустая строка, если прогноз не устарел.
+        :rtype: str
+        """
+        age = now - self.now
+        if age <= max_age:
+            return ""
+        return f"Сервис погоды недоступен, данные на {self.local_time(self.now):%H:%M} ({int(age // 60)} мин назад)"
+
+
+def _weather(data: dict) -> Weather:
+    # В частях суток вместо температуры приходит средняя температура
+    return Weather(data.get("temp", data.get("temp_avg")), data.get("feels_like"), data.get("wind_speed"),
+                   data.get("pressure_mm"), data.get("humidity"), sys.intern(data.get("condition", "")),
+                   data.get("prec_prob"))
+
+
+def _fact(data: dict) -> Weather:
+    # Фактическая погода записывается в отчёты о погоде, где эти поля обязательны, поэтому без них
+    # ответ API считается ответом в неожиданном формате
+    return Weather(data["temp"], data["feels_like"], data["wind_speed"], data["pressure_mm"], data.get("humidity"),
+                   sys.intern(data.get("condition", "")), data.get("prec_prob"))
+
+
+def parse_forecast(payload: dict) -> Forecast:
+    """
+    Разбирает ответ /v2/forecast API Яндекс.Погоды в компактный прогноз.
+
+    :param payload: Ответ API.
+    :type payload: dict
+    :return: Прогноз погоды.
+    :rtype: Forecast
+    :raises KeyError: Если в ответе нет времени ответа, часового пояса или основных полей фактической погоды.
+    """
+    hours = []
+    days = []
+    for day in payload.get("forecasts", []):
+        raw_parts = [day["parts"][part] for part in PARTS if part in day.get("parts", {})]
+        parts = tuple(_weather(part) for part in raw_parts)
+        temp_min = min((part.get("temp_min", weather.temp) for part, weather in zip(raw_parts, parts)), default=None)
+        temp_max = max((part.get("temp_max", weather.temp) for part, weather in zip(raw_parts, parts)), default=None)
+        days.append(Day(day["date"], temp_min, temp_max, parts))
+        hours.extend(Hour(hour["hour_ts"], _weather(hour)) for hour in day.get("hours", []))
+    hours.sort(key=lambda hour: hour.ts)
+    return Forecast(payload["now"], payload["info"]["tzinfo"]["offset"], _fact(payload["fact"]), tuple(hours),
+                    tuple(days))
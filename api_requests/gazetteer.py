@@ -0,0 +1,394 @@
+import argparse
+import bisect
+import mmap
+import os
+import re
+import struct
+import zlib
+from collections import Counter
+from typing import NamedTuple, Optional
+
+# Формат файла индекса: заголовок, таблица населённых пунктов, отсортированная по ключу,
+# таблица триграмм, отсортированная по коду, списки населённых пунктов для каждой триграммы и строки
+_MAGIC = b"GZT1"
+_HEADER = struct.Struct("<4sIIIII")  # метка, пункты, триграммы, смещения таблицы триграмм, списков и строк
+_RECORD = struct.Struct("<IHHddIH")  # смещение и длина ключа, длина названия, долгота, широта, население, триграммы
+_TRIGRAM = struct.Struct("<III")  # код триграммы, номер первого элемента списка, длина списка
+_POSTING = struct.Struct("<I")
+
+# Латинские буквы и сочетания, которыми записывают русские названия, от самых длинных к коротким
+_TRANSLIT = [("shch", "щ"), ("sch", "щ"), ("iy", "ий"), ("yy", "ый"), ("zh", "ж"), ("kh", "х"), ("ts", "ц"),
+             ("ch", "ч"), ("sh", "ш"), ("yu", "ю"), ("ya", "я"), ("yo", "е"), ("ye", "е"), ("a", "а"), ("b", "б"),
+             ("v", "в"), ("g", "г"), ("d", "д"), ("e", "е"), ("z", "з"), ("i", "и"), ("j", "й"), ("k", "к"),
+             ("l", "л"), ("m", "м"), ("n", "н"), ("o", "о"), ("p", "п"), ("r", "р"), ("s", "с"), ("t", "т"),
+             ("u", "у"), ("f", "ф"), ("h", "х"), ("c", "к"), ("w", "в"), ("x", "кс"), ("q", "к"), ("y", "ы")]
+_LATIN = re.compile("|".join(re.escape(latin) for latin, _ in _TRANSLIT))
+_CYRILLIC = dict(_TRANSLIT)
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def normalize_name(name: str) -> str:
+    """
+    Приводит название населённого пункта к ключу индекса.
+
+    Название переводится в нижний регистр, "ё" заменяется на "е", дефисы и знаки препинания - на пробелы,
+    а латинская транслитерация ("Moskva") - на кириллицу.
+
+    :param name: Название в том виде, в котором его ввёл пользователь.
+    :type name: str
+    :return: Ключ индекса.
+    :rtype: str
+    """
+    key = " ".join(_SEPARATORS.split(name.lower().replace("ё", "е"))).strip()
+    return _LATIN.sub(lambda match: _CYRILLIC[match.group()], key)
+
+
+def trigrams(key: str) -> set[str]:
+    """
+    Возвращает триграммы ключа. Каждое слово дополняется двумя пробелами в начале и одним в конце,
+    поэтому совпадение начала слова весит больше, чем совпадение середины.
+
+    :param key: Ключ индекса.
+    :type key: str
+    :return: Множество триграмм.
+    :rtype: set[str]
+    """
+    result = set()
+    for word in key.split():
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def _trigram_code(trigram: str) -> int:
+    return zlib.crc32(trigram.encode("utf-8"))
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    Возвращает расстояние Левенштейна между строками.
+
+    :param a: Первая строка.
+    :type a: str
+    :param b: Вторая строка.
+    :type b: str
+    :return: Минимальное количество вставок, удалений и замен символов.
+    :rtype: int
+    """
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+class Place(NamedTuple):
+    """
+    Населённый пункт из справочника.
+    """
+    name: str  # название для показа пользователю
+    key: str  # ключ индекса, по которому найден пункт: нормализованное название или другое написание
+    pos: str  # координаты в формате "долгота широта", как их возвращает геокодер
+    population: int
+
+
+def build(source: str, path: str) -> int:
+    """
+    Строит файл индекса справочника населённых пунктов из TSV-файла.
+
+    Каждая строка TSV-файла: название, долгота, широта, население и, необязательно, другие написания
+    названия через запятую ("Питер,СПб,Saint Petersburg"). Пустые строки и строки, начинающиеся с "#",
+    пропускаются. Каждое написание становится отдельным ключом индекса с тем же названием и координатами.
+    Файл сначала записывается во временный файл и затем переименовывается, поэтому процессы,
+    одновременно открывающие индекс, никогда не видят его недописанным.
+
+    :param source: Путь к TSV-файлу.
+    :type source: str
+    :param path: Путь к файлу индекса.
+    :type path: str
+    :return: Количество ключей в индексе.
+    :rtype: int
+    """
+    entries = {}  # ключ -> (название, долгота, широта, население); у одинаковых ключей остаётся самый крупный пункт
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            name, lon, lat, population = fields[0], float(fields[1]), float(fields[2]), int(fields[3])
+            aliases = fields[4].split(",") if len(fields) > 4 and fields[4] else []
+            for spelling in [name, *aliases]:
+                key = normalize_name(spelling)
+                if key and (key not in entries or entries[key][3] < population):
+                    entries[key] = (name, lon, lat, population)
+
+    keys = sorted(entries, key=lambda key: key.encode("utf-8"))
+    strings = bytearray()
+    records = bytearray()
+    postings = {}  # код триграммы -> номера ключей
+    for index, key in enumerate(keys):
+        name, lon, lat, population = entries[key]
+        key_bytes, name_bytes = key.encode("utf-8"), name.encode("utf-8")
+        key_trigrams = trigrams(key)
+        records += _RECORD.pack(len(strings), len(key_bytes), len(name_bytes), lon, lat, population,
+                                len(key_trigrams))
+        strings += key_bytes + name_bytes
+        for trigram in key_trigrams:
+            postings.setdefault(_trigram_code(trigram), []).append(index)
+
+    trigram_table = bytearray()
+    posting_list = bytearray()
+    count = 0
+    for code in sorted(postings):
+        trigram_table += _TRIGRAM.pack(code, count, len(postings[code]))
+        for index in postings[code]:
+            posting_list += _POSTING.pack(index)
+        count += len(postings[code])
+
+    trigrams_offset = _HEADER.size + len(records)
+    postings_offset = trigrams_offset + len(trigram_table)
+    strings_offset = postings_offset + len(posting_list)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(keys), len(postings), trigrams_offset, postings_offset, strings_offset))
+        f.write(records)
+        f.write(trigram_table)
+        f.write(posting_list)
+        f.write(strings)
+    os.replace(temporary, path)
+    return len(keys)
+
+
+class Gazetteer:
+    """
+    Справочник населённых пунктов для определения координат без запроса к геокодеру.
+
+    Справочник хранится в файле индекса, который отображается в память (mmap): все процессы бота
+    используют одни и те же страницы файла, а открытие справочника не требует его чтения и разбора.
+    Точное совпадение нормализованного названия ищется двоичным поиском по отсортированным ключам,
+    а похожие названия для исправления опечаток - по общим триграммам.
+    Если файла индекса нет или TSV-файл справочника новее, индекс строится при открытии.
+    """
+
+    def __init__(self, path: str, source: Optional[str] = None, min_similarity: float = 0.3,
+                 suggestions: int = 3):
+        """
+        :param path: Путь к файлу индекса.
+        :type path: str
+        :param source: Путь к TSV-файлу справочника, из которого строится индекс.
+        :type source: Optional[str]
+        :param min_similarity: Минимальная доля общих триграмм, при которой название считается похожим.
+        :type min_similarity: float
+        :param suggestions: Максимальное количество предлагаемых исправлений.
+        :type suggestions: int
+        """
+        self.path = path
+        self.source = source
+        self.min_similarity = min_similarity
+        self.suggestions = suggestions
+        self.exact_hits = 0
+        self.corrected = 0
+        self.suggested = 0
+        self.misses = 0
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._places = 0
+        self._trigrams = 0
+        self._trigrams_offset = 0
+        self._postings_offset = 0
+        self._strings_offset = 0
+
+    def open(self):
+        """
+        Отображает файл индекса в память, при необходимости построив его из TSV-файла.
+        """
+        if self._map is not None:
+            return
+        if self.source and (not os.path.exists(self.path)
+                            or os.path.getmtime(self.path) < os.path.getmtime(self.source)):
+            build(self.source, self.path)
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._places, self._trigrams, self._trigrams_offset, self._postings_offset, self._strings_offset = \
+            _HEADER.unpack_from(self._map)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} не является файлом индекса справочника")
+
+    def close(self):
+        """
+        Закрывает файл индекса.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self) -> int:
+        self.open()
+        return self._places
+
+    def _record(self, index: int) -> tuple:
+        return _RECORD.unpack_from(self._map, _HEADER.size + index * _RECORD.size)
+
+    def _key(self, index: int) -> bytes:
+        offset, key_length = self._record(index)[:2]
+        start = self._strings_offset + offset
+        return self._map[start:start + key_length]
+
+    def _place(self, index: int) -> Place:
+        offset, key_length, name_length, lon, lat, population, _ = self._record(index)
+        start = self._strings_offset + offset
+        key = self._map[start:start + key_length].decode("utf-8")
+        name = self._map[start + key_length:start + key_length + name_length].decode("utf-8")
+        return Place(name, key, f"{lon:.6f} {lat:.6f}", population)
+
+    def _postings(self, code: int) -> tuple:
+        low, high = 0, self._trigrams
+        while low < high:
+            middle = (low + high) // 2
+            middle_code, first, length = _TRIGRAM.unpack_from(self._map, self._trigrams_offset
+                                                              + middle * _TRIGRAM.size)
+            if middle_code < code:
+                low = middle + 1
+            elif middle_code > code:
+                high = middle
+            else:
+                return struct.unpack_from(f"<{length}I", self._map, self._postings_offset + first * _POSTING.size)
+        return ()
+
+    def exact(self, text: str) -> Optional[Place]:
+        """
+        Ищет населённый пункт по точному совпадению нормализованного названия.
+
+        :param text: Название в том виде, в котором его ввёл пользователь.
+        :type text: str
+        :return: Населённый пункт или None, если такого названия в справочнике нет.
+        :rtype: Optional[Place]
+        """
+        self.open()
+        key = normalize_name(text).encode("utf-8")
+        index = bisect.bisect_left(range(self._places), key, key=self._key)
+        if index < self._places and self._key(index) == key:
+            return self._place(index)
+        return None
+
+    def prefix(self, text: str, limit: int = 10, max_scan: int = 5000) -> list[Place]:
+        """
+        Ищет населённые пункты, название которых начинается с введённого текста.
+
+        Ключи с общим началом идут в индексе подряд, поэтому первый из них находится двоичным поиском,
+        а остальные читаются по порядку. Пункты с одинаковым названием, найденные по разным написаниям,
+        возвращаются один раз.
+
+        :param text: Начало названия.
+        :type text: str
+        :param limit: Максимальное количество результатов.
+        :type limit: int
+        :param max_scan: Максимальное количество просматриваемых ключей для очень коротких запросов.
+        :type max_scan: int
+        :return: Населённые пункты по убыванию населения.
+        :rtype: list[Place]
+        """
+        self.open()
+        key = normalize_name(text).encode("utf-8")
+        if not key:
+            return []
+        places = {}
+        index = bisect.bisect_left(range(self._places), key, key=self._key)
+        for index in range(index, min(index + max_scan, self._places)):
+            if not self._key(index).startswith(key):
+                break
+            place = self._place(index)
+            if place.name not in places or places[place.name].population < place.population:
+                places[place.name] = place
+        return sorted(places.values(), key=lambda place: place.population, reverse=True)[:limit]
+
+    def search(self, text: str, limit: int = 5) -> list[tuple[Place, float]]:
+        """
+        Ищет населённые пункты с похожими названиями.
+
+        Сходство - доля общих триграмм запроса и ключа (коэффициент Жаккара);
+        при равном сходстве выше оказываются более крупные пункты.
+
+        :param text: Название в том виде, в котором его ввёл пользователь.
+        :type text: str
+        :param limit: Максимальное количество результатов.
+        :type limit: int
+        :return: Пары из населённого пункта и сходства не меньше min_similarity по убыванию сходства.
+        :rtype: list[tuple[Place, float]]
+        """
+        self.open()
+        query = trigrams(normalize_name(text))
+        shared = Counter()
+        for trigram in query:
+            shared.update(self._postings(_trigram_code(trigram)))
+        scored = []
+        for index, common in shared.items():
+            # Сходство не больше common / len(query), поэтому заведомо непохожие ключи не читаются
+            if common < self.min_similarity * len(query):
+                continue
+            record = self._record(index)
+            similarity = common / (len(query) + record[6] - common)
+            if similarity >= self.min_similarity:
+                scored.append((similarity, record[5], index))
+        scored.sort(reverse=True)
+        return [(self._place(index), similarity) for similarity, _, index in scored[:limit]]
+
+    def resolve(self, text: str) -> tuple[Optional[Place], list[str]]:
+        """
+        Определяет населённый пункт по введённому пользователем названию.
+
+        Сначала ищется точное совпадение. Если его нет, среди похожих названий ищутся отличающиеся
+        от введённого одной буквой (для длинных названий - двумя): если такое название одно,
+        опечатка исправляется автоматически. Иначе похожие названия возвращаются как варианты исправления.
+
+        :param text: Название в том виде, в котором его ввёл пользователь.
+        :type text: str
+        :return: Населённый пункт или None и варианты исправления; если нет ни того, ни другого,
+            название нужно искать геокодером.
+        :rtype: tuple[Optional[Place], list[str]]
+        """
+        place = self.exact(text)
+        if place is not None:
+            self.exact_hits += 1
+            return place, []
+
+        key = normalize_name(text)
+        allowed = 2 if len(key) >= 9 else 1 if len(key) >= 5 else 0
+        candidates = self.search(text, limit=self.suggestions * 3)
+        close = [place for place, _ in candidates if edit_distance(key, place.key) <= allowed]
+        if close and len({place.name for place in close}) == 1:
+            self.corrected += 1
+            return close[0], []
+
+        names = list(dict.fromkeys(place.name for place, _ in candidates))[:self.suggestions]
+        if names:
+            self.suggested += 1
+        else:
+            self.misses += 1
+        return None, names
+
+    def stats(self) -> dict:
+        """
+        Возвращает счётчики поиска в справочнике.
+
+        :return: Количество точных совпадений, исправленных опечаток, ответов с вариантами исправления
+            и названий, не найденных в справочнике.
+        :rtype: dict
+        """
+        return {"exact": self.exact_hits, "corrected": self.corrected, "suggested": self.suggested,
+                "misses": self.misses}
+
+
+if __name__ == "__main__":
+    # Пример: python -m api_requests.gazetteer api_requests/cities.tsv gazetteer.idx
+    parser = argparse.ArgumentParser(description="Построение индекса справочника населённых пунктов")
+    parser.add_argument("source", help="TSV-файл: название, долгота, широта, население, другие написания")
+    parser.add_argument("path", help="файл индекса")
+    args = parser.parse_args()
+    print(f"{build(args.source, args.path)} ключей записано в {args.path}")
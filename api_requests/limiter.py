@@ -0,0 +1,152 @@
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import date
+from typing import Optional
+
+from .errors import QuotaExceeded
+
+# Приоритеты запросов: меньшее значение обслуживается раньше
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты запросов к API по алгоритму token bucket с дневной квотой.
+
+    Запросы, для которых нет свободного токена, ждут в очереди ограниченного размера.
+    Из очереди первыми обслуживаются запросы с более высоким приоритетом (INTERACTIVE раньше BACKGROUND).
+    Фоновым запросам недоступна доля дневной квоты reserve, оставленная для запросов пользователей.
+    """
+
+    def __init__(self, rate: float, burst: int, daily_quota: int, max_queue: int, reserve: float = 0.0):
+        """
+        :param rate: Количество запросов в секунду.
+        :type rate: float
+        :param burst: Максимальное количество запросов, которые можно выполнить подряд без ожидания.
+        :type burst: int
+        :param daily_quota: Максимальное количество запросов в сутки.
+        :type daily_quota: int
+        :param max_queue: Максимальное количество запросов, ожидающих токена.
+        :type max_queue: int
+        :param reserve: Доля дневной квоты, недоступная фоновым запросам.
+        :type reserve: float
+        """
+        self.rate = rate
+        self.burst = burst
+        self.daily_quota = daily_quota
+        self.max_queue = max_queue
+        self.reserve = reserve
+        self.consumed = 0
+        self.rejected = 0
+        self.used_today = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self._day = date.today()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    def remaining_today(self, priority: int = INTERACTIVE) -> int:
+        """
+        Возвращает количество запросов, оставшихся в дневной квоте.
+
+        :param priority: Приоритет запросов: для BACKGROUND не учитывается доля квоты, оставленная для пользователей.
+        :type priority: int
+        :return: Остаток дневной квоты.
+        :rtype: int
+        """
+        self._check_day()
+        return max(int(self._limit(priority)) - self.used_today, 0)
+
+    def _limit(self, priority: int) -> float:
+        return self.daily_quota if priority == INTERACTIVE else self.daily_quota * (1 - self.reserve)
+
+    def _check_day(self):
+        today = date.today()
+        if today != self._day:
+            self._day = today
+            self.used_today = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, waited: float):
+        self._tokens -= 1
+        self.consumed += 1
+        self.used_today += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+    async def acquire(self, priority: int = INTERACTIVE):
+        """
+        Ждёт разрешения на выполнение одного запроса.
+
+        :param priority: Приоритет запроса: INTERACTIVE или BACKGROUND.
+        :type priority: int
+        :raises QuotaExceeded: Если дневная квота исчерпана или очередь ожидания заполнена.
+        """
+        self._check_day()
+        if self.used_today + len(self._waiters) >= self._limit(priority):
+            self.rejected += 1
+            raise QuotaExceeded("Исчерпана дневная квота запросов")
+
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._take(0.0)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise QuotaExceeded("Очередь запросов переполнена")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, next(self._counter), time.monotonic(), future)
+        heapq.heappush(self._waiters, waiter)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._release())
+        try:
+            await future
+        finally:
+            if future.cancelled() and waiter in self._waiters:
+                # Отменённый запрос не должен занимать место в очереди и в дневной квоте
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+
+    async def _release(self):
+        """
+        Выдаёт токены ожидающим запросам в порядке приоритета по мере их пополнения.
+        """
+        while self._waiters:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, enqueued, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Ожидающий запрос был отменён, но ещё не убран из очереди
+                continue
+            self._take(time.monotonic() - enqueued)
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        """
+        Возвращает счётчики ограничителя.
+
+        :return: Количество выполненных и отклонённых запросов, расход дневной квоты,
+            длину очереди и время ожидания в очереди.
+        :rtype: dict
+        """
+        self._check_day()
+        return {"consumed": self.consumed, "rejected": self.rejected, "used_today": self.used_today,
+                "daily_quota": self.daily_quota, "queue": len(self), "wait_time_total": self.wait_time_total,
+                "wait_time_max": self.wait_time_max}
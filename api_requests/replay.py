@@ -0,0 +1,179 @@
+import asyncio
+import gzip
+import json
+import os
+import random
+import zlib
+from typing import Optional
+
+from .errors import UpstreamError
+
+# Параметры запроса, которые не входят в ключ записи: ключ API не должен попадать в файл
+_SECRET_PARAMS = {"apikey"}
+# Поля ответа, меняющиеся при каждом запросе; их изменение не считается изменением ответа
+_VOLATILE_FIELDS = {"now", "now_dt"}
+
+
+def _stable(body: dict) -> dict:
+    return {name: value for name, value in body.items() if name not in _VOLATILE_FIELDS}
+
+
+def request_key(endpoint: str, params: dict) -> str:
+    """
+    Возвращает ключ записи ответа: название API и параметры запроса без ключа API.
+
+    :param endpoint: Название API, например "geocoder" или "forecast".
+    :type endpoint: str
+    :param params: Параметры строки запроса.
+    :type params: dict
+    :return: Ключ записи.
+    :rtype: str
+    """
+    visible = {name: str(value) for name, value in params.items() if name not in _SECRET_PARAMS}
+    return endpoint + " " + json.dumps(visible, ensure_ascii=False, sort_keys=True)
+
+
+class Corpus:
+    """
+    Файл записанных ответов API Яндекса для воспроизводимых замеров производительности.
+
+    Файл - это JSON Lines, сжатый gzip. Каждая строка - один запрос: название API ("e"), ключ запроса ("k")
+    и время ответа в секундах ("t"). Тело ответа ("b") записывается только при первом запросе с этим ключом
+    и при его изменении, поэтому повторные запросы одних и тех же городов почти не увеличивают файл.
+
+    При воспроизведении ответ для ключа берётся из файла, а задержка выбирается случайно из времён ответов,
+    записанных для этого API, - так сохраняется исходное распределение задержек.
+    """
+
+    def __init__(self, path: str, latency: str = "recorded", seed: int = 0):
+        """
+        :param path: Путь к файлу записанных ответов.
+        :type path: str
+        :param latency: Задержка при воспроизведении: "recorded" - как при записи, "zero" - без задержки.
+        :type latency: str
+        :param seed: Начальное значение генератора случайных чисел, выбирающего задержки.
+        :type seed: int
+        """
+        self.path = path
+        self.latency = latency
+        self.recorded = 0
+        self.replayed = 0
+        self.missed = 0
+        self._random = random.Random(seed)
+        self._bodies = {}  # ключ -> тело ответа
+        self._latencies = {}  # API -> времена ответов
+        self._file = None
+
+    def load(self):
+        """
+        Загружает записанные ответы из файла.
+
+        Если запись файла была прервана, например процесс завершился во время record, недописанная последняя
+        строка и недописанный последний член gzip пропускаются.
+
+        :raises UpstreamError: Если файл не удалось прочитать или в нём есть повреждённая запись.
+        """
+        self._parse(self._read()[0])
+
+    def _read(self) -> tuple[list[str], bool]:
+        """
+        Читает строки файла и возвращает полностью записанные строки и признак того, что конец файла недописан.
+        """
+        lines, truncated = [], False
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        truncated = True
+                        break
+                    lines.append(line)
+        except EOFError:
+            # Последний член gzip записан не полностью
+            truncated = True
+        except (OSError, zlib.error, UnicodeDecodeError) as e:
+            raise UpstreamError(f"Не удалось прочитать файл записанных ответов {self.path}: {e!r}") from e
+        return lines, truncated
+
+    def _parse(self, lines: list[str]):
+        for number, line in enumerate(lines, 1):
+            try:
+                entry = json.loads(line)
+                if "b" in entry:
+                    self._bodies[entry["k"]] = entry["b"]
+                self._latencies.setdefault(entry["e"], []).append(entry["t"])
+            except (KeyError, TypeError, ValueError) as e:
+                raise UpstreamError(f"Повреждённая запись в строке {number} файла {self.path}: {e!r}") from e
+
+    def record(self, endpoint: str, params: dict, latency: float, body: dict):
+        """
+        Дописывает в файл ответ API.
+
+        :param endpoint: Название API.
+        :type endpoint: str
+        :param params: Параметры строки запроса.
+        :type params: dict
+        :param latency: Время ответа, секунды.
+        :type latency: float
+        :param body: Тело ответа.
+        :type body: dict
+        """
+        if self._file is None:
+            if os.path.exists(self.path):
+                lines, truncated = self._read()
+                self._parse(lines)
+                if truncated:
+                    # Новые записи нельзя дописывать после недописанного члена gzip: файл переписывается
+                    # без недописанного конца
+                    with gzip.open(self.path + ".tmp", "wt", encoding="utf-8") as f:
+                        f.writelines(lines)
+                    os.replace(self.path + ".tmp", self.path)
+            # Новые записи добавляются в файл отдельным членом gzip, поэтому файл можно дописывать
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+        key = request_key(endpoint, params)
+        entry = {"e": endpoint, "k": key, "t": round(latency, 4)}
+        previous = self._bodies.get(key)
+        if previous is None or _stable(previous) != _stable(body):
+            self._bodies[key] = body
+            entry["b"] = body
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.recorded += 1
+
+    async def replay(self, endpoint: str, params: dict) -> dict:
+        """
+        Возвращает записанный ответ API с записанной или нулевой задержкой.
+
+        :param endpoint: Название API.
+        :type endpoint: str
+        :param params: Параметры строки запроса.
+        :type params: dict
+        :return: Тело ответа.
+        :rtype: dict
+        :raises UpstreamError: Если ответ на такой запрос не записан.
+        """
+        body = self._bodies.get(request_key(endpoint, params))
+        if body is None:
+            self.missed += 1
+            raise UpstreamError(f"Ответ на запрос {endpoint} не записан")
+        latencies = self._latencies.get(endpoint)
+        if self.latency == "recorded" and latencies:
+            await asyncio.sleep(self._random.choice(latencies))
+        self.replayed += 1
+        return body
+
+    def close(self):
+        """
+        Закрывает файл записи.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> dict:
+        """
+        Возвращает счётчики записи и воспроизведения.
+
+        :return: Количество записанных, воспроизведённых и не найденных в файле ответов.
+        :rtype: dict
+        """
+        return {"recorded": self.recorded, "replayed": self.replayed, "missed": self.missed,
+                "keys": len(self._bodies)}
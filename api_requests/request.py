@@ -1,30 +1,421 @@
-import json
+import asyncio
+import re
+import time
+from typing import Any, Callable, Optional
 
-import requests
+import aiohttp
 
+from database import orm
+from services import metrics
 from settings import api_config
+from .breaker import CircuitBreaker
+from .cache import LRUCache, SingleFlight, TTLCache
+from .errors import ApiError, CityNotFound, UpstreamError
+from .forecast import Forecast, Weather, parse_forecast
+from .gazetteer import Gazetteer
+from .limiter import BACKGROUND, INTERACTIVE, RateLimiter
+from .replay import Corpus
 
+_session: Optional[aiohttp.ClientSession] = None
 
-def get_city_coord(city: str) -> str:
+# Записанные ответы API Яндекса в режимах записи и воспроизведения (api_config.replay_mode)
+_corpus: Optional[Corpus] = None
+
+# Справочник населённых пунктов, координаты которых определяются без геокодера
+gazetteer = Gazetteer(api_config.gazetteer_path, api_config.gazetteer_source, api_config.gazetteer_min_similarity)
+gazetteer_hits = 0
+
+# Координаты городов: в памяти процесса и в таблице CityCoords
+geo_cache = LRUCache(api_config.geo_cache_size)
+geo_db_hits = 0
+geo_db_misses = 0
+
+# Прогнозы погоды по координатам и запросы прогнозов, выполняющиеся в данный момент
+weather_cache = TTLCache(api_config.weather_cache_size, api_config.weather_cache_ttl)
+weather_flight = SingleFlight()
+
+# Последние полученные прогнозы, которые показываются, если свежий прогноз получить не удалось
+stale_forecasts = LRUCache(api_config.stale_cache_size)
+stale_served = 0
+
+# Предохранители запросов к геокодеру и API Яндекс.Погоды
+breakers = {endpoint: CircuitBreaker(api_config.breaker_window, api_config.breaker_min_calls,
+                                     api_config.breaker_failure_rate, api_config.breaker_open_time,
+                                     api_config.breaker_probes)
+            for endpoint in ("geocoder", "forecast")}
+
+# Ограничители частоты запросов к геокодеру и API Яндекс.Погоды. Каждый процесс бота считает расход сам,
+# поэтому квоты и частота делятся поровну между api_config.api_processes процессами, и общий расход
+# всех процессов не превышает квоту
+_processes = max(api_config.api_processes, 1)
+geo_limiter = RateLimiter(api_config.geo_rate / _processes, max(int(api_config.geo_rate / _processes), 1),
+                          api_config.geo_daily_quota // _processes, api_config.limiter_queue_size,
+                          api_config.interactive_reserve)
+weather_limiter = RateLimiter(api_config.weather_rate / _processes, max(int(api_config.weather_rate / _processes), 1),
+                              api_config.weather_daily_quota // _processes, api_config.limiter_queue_size,
+                              api_config.interactive_reserve)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую HTTP-сессию для запросов к API Яндекса.
+
+    Сессия создаётся при первом обращении и переиспользуется всеми запросами.
+    Она держит пул keep-alive соединений, поэтому повторные запросы не тратят время на установку TCP и TLS.
+    Для сессии заданы явные таймауты на подключение, на чтение ответа и на весь запрос.
+
+    :return: Общая сессия aiohttp.
+    :rtype: aiohttp.ClientSession
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=api_config.pool_size,
+                                         keepalive_timeout=api_config.keepalive_timeout)
+        timeout = aiohttp.ClientTimeout(total=api_config.request_timeout, sock_connect=api_config.connect_timeout,
+                                        sock_read=api_config.read_timeout)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close_session():
+    """
+    Закрывает общую HTTP-сессию и освобождает соединения пула.
+
+    Вызывается при остановке бота.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    if _corpus is not None:
+        _corpus.close()
+    gazetteer.close()
+
+
+def get_corpus() -> Optional[Corpus]:
+    """
+    Возвращает файл записанных ответов API Яндекса, если включён режим записи или воспроизведения.
+
+    В режиме воспроизведения файл загружается при первом обращении.
+
+    :return: Файл записанных ответов или None в обычном режиме работы.
+    :rtype: Optional[Corpus]
+    :raises UpstreamError: Если файл записанных ответов не удалось прочитать.
+    """
+    global _corpus
+    if api_config.replay_mode and _corpus is None:
+        corpus = Corpus(api_config.replay_path, api_config.replay_latency)
+        if api_config.replay_mode == "replay":
+            corpus.load()
+        _corpus = corpus
+    return _corpus
+
+
+def _error_label(e: BaseException) -> str:
+    """
+    Возвращает причину ошибки запроса для метрик: код ответа API или тип исходного исключения.
+    """
+    cause = e.__cause__ or e
+    if isinstance(cause, aiohttp.ClientResponseError):
+        return str(cause.status)
+    return type(cause).__name__
+
+
+async def _get_json(endpoint: str, url: str, params: dict, headers: Optional[dict] = None,
+                    parse: Callable[[dict], Any] = lambda body: body) -> Any:
+    """
+    Выполняет GET-запрос через общую сессию и возвращает разобранное тело ответа.
+
+    Запрос выполняется под контролем предохранителя API (breakers[endpoint]). Ошибки соединения, таймауты,
+    ответы с кодом ошибки и ответы в неожиданном формате превращаются в UpstreamError
+    и учитываются предохранителем.
+    Время выполнения запроса и ошибки записываются в метрики с меткой endpoint.
+    В режиме записи (api_config.replay_mode = "record") ответ и время ответа дописываются в файл
+    api_config.replay_path, а в режиме воспроизведения ("replay") ответ берётся из этого файла без запроса к API;
+    отсутствие записанного ответа и ошибки чтения файла тоже превращаются в UpstreamError.
+
+    :param endpoint: Название API для метрик, например "geocoder" или "forecast".
+    :type endpoint: str
+    :param url: Адрес запроса.
+    :type url: str
+    :param params: Параметры строки запроса.
+    :type params: dict
+    :param headers: Дополнительные заголовки запроса.
+    :type headers: Optional[dict]
+    :param parse: Функция, извлекающая из тела ответа нужные данные; KeyError, IndexError, TypeError
+        и ValueError в ней означают ответ в неожиданном формате.
+    :type parse: Callable[[dict], Any]
+    :return: Результат parse для тела ответа.
+    :rtype: Any
+    :raises UpstreamError: Если API не ответило, ответило ошибкой или вернуло ответ в неожиданном формате.
+    :raises CircuitOpen: Если запросы к API приостановлены предохранителем.
+    """
+    start = time.perf_counter()
+    try:
+        corpus = get_corpus()
+        if api_config.replay_mode == "replay":
+            body = await corpus.replay(endpoint, params)
+            try:
+                return parse(body)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                raise UpstreamError(f"Записанный ответ API {endpoint} в неожиданном формате: {e!r}") from e
+        with breakers[endpoint].guard():
+            try:
+                async with get_session().get(url, params=params, headers=headers) as r:
+                    r.raise_for_status()
+                    body = await r.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                raise UpstreamError(f"Не удалось получить ответ API {endpoint}: {e!r}") from e
+            try:
+                result = parse(body)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                raise UpstreamError(f"Ответ API {endpoint} в неожиданном формате: {e!r}") from e
+        if api_config.replay_mode == "record":
+            corpus.record(endpoint, params, time.perf_counter() - start, body)
+        return result
+    except Exception as e:
+        metrics.api_errors.inc(endpoint, _error_label(e))
+        raise
+    finally:
+        metrics.api_latency.observe(time.perf_counter() - start, endpoint)
+
+
+def _parse_geocoder(body: dict) -> Optional[str]:
+    """
+    Возвращает координаты первого найденного геокодером объекта или None, если ничего не найдено.
+    """
+    members = body["response"]["GeoObjectCollection"]["featureMember"]
+    if not members:
+        return None
+    return members[0]["GeoObject"]["Point"]["pos"]
+
+
+def normalize_city(city: str) -> str:
+    """
+    Приводит название города к виду, используемому в качестве ключа кэша.
+
+    :param city: Название города в том виде, в котором его ввёл пользователь.
+    :type city: str
+    :return: Название в нижнем регистре, без лишних пробелов и с заменой "ё" на "е".
+    :rtype: str
+    """
+    return " ".join(city.lower().replace("ё", "е").split())
+
+
+def geo_cache_stats() -> dict:
+    """
+    Возвращает счётчики кэша координат.
+
+    :return: Счётчики кэша в памяти, количество попаданий и промахов в базе данных
+        и количество городов, найденных в справочнике.
+    :rtype: dict
+    """
+    return {**geo_cache.stats(), "db_hits": geo_db_hits, "db_misses": geo_db_misses,
+            "gazetteer_hits": gazetteer_hits}
+
+
+def snap_location(lat: float, lon: float) -> tuple[float, float]:
+    """
+    Привязывает геопозицию к ближайшему узлу сетки с шагом api_config.location_grid градусов.
+
+    Пользователи, находящиеся рядом друг с другом, попадают в один узел и получают прогноз из одной записи кэша.
+
+    :param lat: Широта.
+    :type lat: float
+    :param lon: Долгота.
+    :type lon: float
+    :return: Широта и долгота узла сетки.
+    :rtype: tuple[float, float]
+    """
+    step = api_config.location_grid
+    return round(round(lat / step) * step, 6), round(round(lon / step) * step, 6)
+
+
+def location_name(lat: float, lon: float) -> str:
+    """
+    Возвращает название места для узла сетки, которое хранится в отчёте о погоде вместо названия города.
+
+    :param lat: Широта узла сетки.
+    :type lat: float
+    :param lon: Долгота узла сетки.
+    :type lon: float
+    :return: Широта и долгота через запятую с точностью шага сетки, например "55.75, 37.60".
+    :rtype: str
+    """
+    # Количество знаков после запятой в шаге сетки
+    decimals = len(f"{api_config.location_grid:f}".rstrip("0").partition(".")[2])
+    return f"{lat:.{decimals}f}, {lon:.{decimals}f}"
+
+
+# Название места, погода в котором запрошена по геопозиции: широта и долгота узла сетки через запятую
+_LOCATION_NAME = re.compile(r"(-?\d+(?:\.\d+)?), (-?\d+(?:\.\d+)?)")
+
+
+def location_pos(name: str) -> Optional[str]:
+    """
+    Возвращает координаты места, если его название получено из геопозиции функцией location_name.
+
+    :param name: Название города или места.
+    :type name: str
+    :return: Координаты в формате "долгота широта" или None, если это название города.
+    :rtype: Optional[str]
+    """
+    match = _LOCATION_NAME.fullmatch(name)
+    if match is None:
+        return None
+    lat, lon = float(match[1]), float(match[2])
+    if abs(lat) > 90 or abs(lon) > 180:
+        return None
+    return f"{lon:.6f} {lat:.6f}"
+
+
+async def get_city_coord(city: str, priority: int = INTERACTIVE) -> str:
     """
     Возвращает координаты указанного города.
 
-    Функция отправляет запрос к сервису геокодирования Яндекса JavaScript API и HTTP Геокодер для получения координат.
-    В ответе на запрос содержатся данные о координатах города.
+    Координаты места, погода в котором запрошена по геопозиции, берутся из его названия.
+    Координаты города ищутся в справочнике населённых пунктов, затем в кэше в памяти и в таблице CityCoords.
+    Только если города нет в справочнике и он ещё ни разу не запрашивался, функция отправляет запрос
+    к сервису геокодирования Яндекса JavaScript API и HTTP Геокодер и сохраняет полученные координаты в оба уровня кэша.
+    Запрос к геокодеру выполняется только после разрешения ограничителя geo_limiter.
     Функция возвращает строку широты и долготы, разделённую пробелом.
 
-    :param city: Название города, координаты которого необходимо получить.
+    :param city: Название города или места, координаты которого необходимо получить.
     :type city: str
+    :param priority: Приоритет запроса к геокодеру: INTERACTIVE для запросов пользователей,
+        BACKGROUND для фоновых задач.
+    :type priority: int
     :return: Строка, содержащая широту и долготу в формате "широта долгота".
     :rtype: str
+    :raises CityNotFound: Если геокодер не нашёл город.
+    """
+    global geo_db_hits, geo_db_misses, gazetteer_hits
+    pos = location_pos(city)
+    if pos is not None:
+        return pos
+
+    place = gazetteer.exact(city)
+    if place is not None:
+        gazetteer_hits += 1
+        return place.pos
+
+    key = normalize_city(city)
+    pos = geo_cache.get(key)
+    if pos is not None:
+        return pos
+
+    pos = await orm.get_city_pos(key)
+    if pos is not None:
+        geo_db_hits += 1
+    else:
+        geo_db_misses += 1
+        breakers["geocoder"].check()
+        await geo_limiter.acquire(priority)
+        payload = {"geocode": city, "apikey": api_config.geo_key, "format": "json"}
+        pos = await _get_json("geocoder", api_config.geo_url, payload, parse=_parse_geocoder)
+        if pos is None:
+            raise CityNotFound(f"Город {city!r} не найден")
+        await orm.save_city_pos(key, pos)
+
+    geo_cache.set(key, pos)
+    return pos
+
+
+def weather_cache_stats() -> dict:
+    """
+    Возвращает счётчики кэша прогнозов погоды.
+
+    :return: Счётчики кэша, количество запросов, объединённых с уже выполняющимися,
+        и количество устаревших прогнозов, показанных вместо недоступных свежих.
+    :rtype: dict
     """
-    payload = {"geocode": city, "apikey": api_config.geo_key, "format": "json"}
-    r = requests.get("https://geocode-maps.yandex.ru/1.x", params=payload)
-    geo = json.loads(r.text)
-    return geo["response"]["GeoObjectCollection"]["featureMember"][0]["GeoObject"]["Point"]["pos"]
+    return {**weather_cache.stats(), "coalesced": weather_flight.coalesced, "inflight": len(weather_flight),
+            "stale_served": stale_served, "stale_size": len(stale_forecasts)}
 
 
-def get_weather(city: str) -> dict:
+def limiter_stats() -> dict:
+    """
+    Возвращает счётчики ограничителей частоты запросов к API Яндекса.
+
+    :return: Словарь со счётчиками ограничителей геокодера ("geo") и API Яндекс.Погоды ("weather").
+    :rtype: dict
+    """
+    return {"geo": geo_limiter.stats(), "weather": weather_limiter.stats()}
+
+
+async def _fetch_forecast(pos: str, priority: int) -> Forecast:
+    """
+    Запрашивает прогноз погоды для координат у API Яндекс.Погоды и сохраняет его в кэш в компактном виде
+    и в stale_forecasts на случай недоступности API.
+
+    :param pos: Координаты в формате "долгота широта".
+    :type pos: str
+    :param priority: Приоритет запроса для ограничителя weather_limiter.
+    :type priority: int
+    :return: Прогноз погоды.
+    :rtype: Forecast
+    """
+    breakers["forecast"].check()
+    await weather_limiter.acquire(priority)
+    coords = pos.split()
+    payload = {"lon": coords[0], "lat": coords[1], "lang": "ru_RU"}
+    forecast = await _get_json("forecast", api_config.weather_url, payload, api_config.weather_key,
+                               parse=parse_forecast)
+    weather_cache.set(pos, forecast)
+    stale_forecasts.set(pos, forecast)
+    return forecast
+
+
+async def get_forecast(pos: str, priority: int = INTERACTIVE) -> Forecast:
+    """
+    Возвращает прогноз погоды для указанных координат.
+
+    Прогноз берётся из кэша, если он был получен не раньше, чем weather_cache_ttl секунд назад.
+    Одновременные запросы одних и тех же координат объединяются в один запрос к API.
+    Один прогноз содержит и фактическую погоду, и почасовой прогноз, и прогноз на неделю,
+    поэтому все виды прогноза для точки обходятся одним запросом к API.
+    Если свежий прогноз получить не удалось, возвращается последний полученный прогноз для точки:
+    насколько он устарел, видно по Forecast.now.
+
+    :param pos: Координаты в формате "долгота широта".
+    :type pos: str
+    :param priority: Приоритет запроса: INTERACTIVE для запросов пользователей, BACKGROUND для фоновых задач.
+    :type priority: int
+    :return: Прогноз погоды.
+    :rtype: Forecast
+    :raises ApiError: Если свежий прогноз получить не удалось, а прежнего прогноза для точки нет.
+    """
+    global stale_served
+    forecast = weather_cache.get(pos)
+    if forecast is None:
+        try:
+            forecast = await weather_flight.do(pos, lambda: _fetch_forecast(pos, priority))
+        except ApiError:
+            forecast = stale_forecasts.get(pos)
+            if forecast is None:
+                raise
+            stale_served += 1
+    return forecast
+
+
+async def refresh_forecast(pos: str) -> Forecast:
+    """
+    Запрашивает у API свежий прогноз погоды для координат и сохраняет его в кэш,
+    даже если в кэше есть актуальный прогноз.
+
+    Используется для прогрева кэша перед ожидаемыми запросами пользователей,
+    поэтому запрос к API выполняется с приоритетом BACKGROUND.
+
+    :param pos: Координаты в формате "долгота широта".
+    :type pos: str
+    :return: Прогноз погоды.
+    :rtype: Forecast
+    :raises QuotaExceeded: Если запрос к API не укладывается в квоту.
+    """
+    return await weather_flight.do(pos, lambda: _fetch_forecast(pos, BACKGROUND))
+
+
+async def get_weather(city: str, priority: int = INTERACTIVE) -> Weather:
     """
     Получает данные о погоде для указанного города.
 
@@ -34,11 +425,11 @@ def get_weather(city: str) -> dict:
 
     :param city: Координаты города, для которого необходимо получить данные о погоде.
     :type city: str
-    :return: Словарь с данными о текущей погоде для указанного города.
-    :rtype: dict
+    :param priority: Приоритет запросов: INTERACTIVE для запросов пользователей, BACKGROUND для фоновых задач.
+    :type priority: int
+    :return: Текущая погода для указанного города.
+    :rtype: Weather
+    :raises QuotaExceeded: Если запрос к API не укладывается в квоту.
     """
-    coords = get_city_coord(city).split()
-    payload = {"lon": coords[0], "lat": coords[1], "lang": "ru_RU"}
-    r = requests.get("https://api.weather.yandex.ru/v2/forecast", params=payload, headers=api_config.weather_key)
-    weather_data = json.loads(r.text)
-    return weather_data["fact"]
+    forecast = await get_forecast(await get_city_coord(city, priority), priority)
+    return forecast.fact
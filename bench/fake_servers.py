@@ -0,0 +1,153 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+import zlib
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+
+def city_pos(name: str) -> str:
+    """
+    Возвращает постоянные для названия города координаты в пределах России.
+
+    :param name: Название города.
+    :type name: str
+    :return: Координаты в формате "долгота широта".
+    :rtype: str
+    """
+    h = zlib.crc32(name.lower().encode())
+    lon = 30 + (h % 10000) / 10000 * 100
+    lat = 45 + (h // 10000 % 10000) / 10000 * 25
+    return f"{lon:.6f} {lat:.6f}"
+
+
+def forecast_payload(lon: float, lat: float) -> dict:
+    """
+    Возвращает ответ в формате /v2/forecast API Яндекс.Погоды со значениями, постоянными для координат.
+
+    :param lon: Долгота.
+    :type lon: float
+    :param lat: Широта.
+    :type lat: float
+    :return: Ответ API с фактической погодой, часовым поясом и прогнозом на 7 дней по частям суток и часам.
+    :rtype: dict
+    """
+    rnd = random.Random(f"{lon:.3f} {lat:.3f}")
+    now = int(time.time())
+    offset = 3600 * rnd.randint(2, 12)
+
+    def weather(base: int) -> dict:
+        temp = base + rnd.randint(-3, 3)
+        return {"temp": temp, "feels_like": temp - rnd.randint(0, 5), "wind_speed": round(rnd.uniform(0, 12), 1),
+                "pressure_mm": rnd.randint(735, 775), "humidity": rnd.randint(30, 95),
+                "condition": rnd.choice(["clear", "cloudy", "overcast", "light-rain", "snow"]),
+                "prec_prob": rnd.choice([0, 10, 20, 40, 60, 80])}
+
+    base = rnd.randint(-20, 30)
+    forecasts = []
+    for day in range(7):
+        local = time.gmtime(now + offset + day * 86400)
+        parts = {}
+        for part in ("night", "morning", "day", "evening"):
+            parts[part] = {**weather(base), "temp_min": base - 4, "temp_max": base + 4}
+        forecasts.append({
+            "date": time.strftime("%Y-%m-%d", local),
+            "parts": parts,
+            "hours": [{"hour": str(hour), "hour_ts": now - now % 3600 + day * 86400 + hour * 3600, **weather(base)}
+                      for hour in range(24)],
+        })
+    return {
+        "now": now,
+        "info": {"lat": lat, "lon": lon, "tzinfo": {"offset": offset}},
+        "fact": weather(base),
+        "forecasts": forecasts,
+    }
+
+
+class FakeServers:
+    """
+    Локальная замена API Яндекса и Bot API Telegram для нагрузочного тестирования.
+
+    Геокодер (/1.x) и API Яндекс.Погоды (/v2/forecast) отвечают с задержкой latency ± jitter секунд
+    и постоянными для города данными. Методы Bot API (/bot<токен>/<метод>) сразу отвечают успехом,
+    а последнее сообщение каждого чата запоминается, чтобы нагрузочный тест мог нажимать его кнопки.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, tg_latency: float = 0.0):
+        """
+        :param latency: Средняя задержка ответов API Яндекса, секунды.
+        :type latency: float
+        :param jitter: Доля, на которую задержка ответа API Яндекса случайно отклоняется от средней.
+        :type jitter: float
+        :param tg_latency: Задержка ответов Bot API, секунды.
+        :type tg_latency: float
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.tg_latency = tg_latency
+        self.calls = Counter()
+        self.messages = {}  # чат -> последнее отправленное или изменённое сообщение
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.app = web.Application()
+        self.app.router.add_get("/1.x", self.geocoder)
+        self.app.router.add_get("/v2/forecast", self.forecast)
+        self.app.router.add_post("/bot{token}/{method}", self.telegram)
+
+    async def start(self, host: str, port: int):
+        """
+        Запускает HTTP-сервер.
+
+        :param host: Адрес, на котором слушает сервер.
+        :type host: str
+        :param port: Порт сервера.
+        :type port: int
+        """
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        """
+        Останавливает HTTP-сервер.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(max(self.latency * (1 + random.uniform(-self.jitter, self.jitter)), 0))
+
+    async def geocoder(self, request: web.Request) -> web.Response:
+        self.calls["geocoder"] += 1
+        await self._delay()
+        pos = city_pos(request.query.get("geocode", ""))
+        body = {"response": {"GeoObjectCollection": {"featureMember": [{"GeoObject": {"Point": {"pos": pos}}}]}}}
+        return web.json_response(body)
+
+    async def forecast(self, request: web.Request) -> web.Response:
+        self.calls["forecast"] += 1
+        await self._delay()
+        return web.json_response(forecast_payload(float(request.query["lon"]), float(request.query["lat"])))
+
+    async def telegram(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[f"telegram.{method}"] += 1
+        if self.tg_latency:
+            await asyncio.sleep(self.tg_latency)
+        fields = dict(await request.post())
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(fields["chat_id"])
+            message_id = int(fields["message_id"]) if "message_id" in fields else next(self._message_ids)
+            message = {"message_id": message_id, "date": int(time.time()),
+                       "chat": {"id": chat_id, "type": "private"}, "text": fields.get("text", "")}
+            if "reply_markup" in fields:
+                message["reply_markup"] = json.loads(fields["reply_markup"])
+            self.messages[chat_id] = message
+            return web.json_response({"ok": True, "result": message})
+        return web.json_response({"ok": True, "result": True})
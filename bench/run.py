@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import statistics
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Optional
+
+from aiogram import types
+from sqlalchemy import event
+
+from settings import api_config, bot_config, db_config
+from .fake_servers import FakeServers
+
+# Города, в которых "живут" и погоду которых запрашивают синтетические пользователи
+CITIES = ["Москва", "Санкт-Петербург", "Новосибирск", "Екатеринбург", "Казань", "Нижний Новгород", "Челябинск",
+          "Самара", "Омск", "Ростов-на-Дону", "Уфа", "Красноярск", "Воронеж", "Пермь", "Волгоград", "Краснодар",
+          "Саратов", "Тюмень", "Тольятти", "Ижевск"]
+
+# Центры городов (широта, долгота), вокруг которых находятся синтетические пользователи, отправляющие геопозицию
+LOCATION_CENTERS = [(55.7558, 37.6176), (59.9343, 30.3351), (55.0084, 82.9346), (56.8389, 60.6057)]
+
+# Идентификатор первого синтетического пользователя и администратора
+FIRST_USER_ID = 10_000_000
+ADMIN_ID = 9_999_999
+
+_update_ids = itertools.count(1)
+
+
+def message_update(user_id: int, text: str) -> dict:
+    """
+    Возвращает обновление Telegram с текстовым сообщением пользователя.
+
+    :param user_id: Идентификатор пользователя.
+    :type user_id: int
+    :param text: Текст сообщения.
+    :type text: str
+    :return: Обновление в виде словаря.
+    :rtype: dict
+    """
+    update_id = next(_update_ids)
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private", "first_name": "Bench"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+    }}
+
+
+def location_update(user_id: int, lat: float, lon: float) -> dict:
+    """
+    Возвращает обновление Telegram с геопозицией пользователя.
+
+    :param user_id: Идентификатор пользователя.
+    :type user_id: int
+    :param lat: Широта.
+    :type lat: float
+    :param lon: Долгота.
+    :type lon: float
+    :return: Обновление в виде словаря.
+    :rtype: dict
+    """
+    update = message_update(user_id, "")
+    del update["message"]["text"]
+    update["message"]["location"] = {"latitude": lat, "longitude": lon}
+    return update
+
+
+def inline_update(user_id: int, text: str) -> dict:
+    """
+    Возвращает обновление Telegram со встроенным запросом пользователя.
+
+    :param user_id: Идентификатор пользователя.
+    :type user_id: int
+    :param text: Текст запроса.
+    :type text: str
+    :return: Обновление в виде словаря.
+    :rtype: dict
+    """
+    update_id = next(_update_ids)
+    return {"update_id": update_id, "inline_query": {
+        "id": str(update_id), "query": text, "offset": "",
+        "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+    }}
+
+
+def callback_update(user_id: int, data: str, message: dict) -> dict:
+    """
+    Возвращает обновление Telegram с нажатием встроенной кнопки сообщения бота.
+
+    :param user_id: Идентификатор пользователя.
+    :type user_id: int
+    :param data: Данные обратного вызова кнопки.
+    :type data: str
+    :param message: Сообщение бота, кнопка которого нажата.
+    :type message: dict
+    :return: Обновление в виде словаря.
+    :rtype: dict
+    """
+    update_id = next(_update_ids)
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": "bench", "data": data,
+        "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+        "message": {"message_id": message["message_id"], "date": message["date"], "text": message["text"],
+                    "chat": {"id": user_id, "type": "private"}},
+    }}
+
+
+def find_button(message: Optional[dict], prefix: str) -> Optional[str]:
+    """
+    Возвращает данные первой встроенной кнопки сообщения, начинающиеся с prefix.
+
+    :param message: Сообщение бота.
+    :type message: Optional[dict]
+    :param prefix: Начало данных обратного вызова.
+    :type prefix: str
+    :return: Данные обратного вызова или None, если такой кнопки нет.
+    :rtype: Optional[str]
+    """
+    if message is None:
+        return None
+    for row in message.get("reply_markup", {}).get("inline_keyboard", []):
+        for button in row:
+            if button.get("callback_data", "").startswith(prefix):
+                return button["callback_data"]
+    return None
+
+
+class Bench:
+    """
+    Нагрузочный тест бота: синтетические обновления проходят через настоящий Dispatcher бота,
+    настоящую базу данных и локальные замены API Яндекса и Bot API.
+
+    Каждый сценарий выполняется для всех пользователей с ограниченным количеством одновременных сценариев,
+    и для него считаются пропускная способность, перцентили времени выполнения и количество
+    SQL-запросов и запросов к API на один сценарий.
+    """
+
+    def __init__(self, bot_module, servers: FakeServers, users: int, concurrency: int):
+        self.bot = bot_module
+        self.servers = servers
+        self.users = [FIRST_USER_ID + i for i in range(users)]
+        self.concurrency = concurrency
+        self.db_queries = 0
+        self.results = {}
+
+    def _count_query(self, *args):
+        self.db_queries += 1
+
+    async def send(self, update: dict):
+        await self.bot.dp.process_updates([types.Update(**update)])
+
+    async def press(self, user_id: int, prefix: str) -> bool:
+        """
+        Нажимает кнопку последнего сообщения бота в чате пользователя.
+
+        :return: True, если кнопка найдена и нажата.
+        :rtype: bool
+        """
+        message = self.servers.messages.get(user_id)
+        data = find_button(message, prefix)
+        if data is None:
+            return False
+        await self.send(callback_update(user_id, data, message))
+        return True
+
+    # Сценарии: каждый принимает номер и идентификатор пользователя
+
+    async def flow_start(self, index: int, user_id: int):
+        await self.send(message_update(user_id, "/start"))
+
+    async def flow_set_city(self, index: int, user_id: int):
+        await self.send(message_update(user_id, "Установить свой город"))
+        await self.send(message_update(user_id, CITIES[index % len(CITIES)]))
+
+    async def flow_my_city(self, index: int, user_id: int):
+        await self.send(message_update(user_id, "Погода в моём городе"))
+
+    async def flow_forecast_views(self, index: int, user_id: int):
+        await self.send(message_update(user_id, "Погода в моём городе"))
+        for view in ("hours", "day", "week"):
+            await self.press(user_id, f"forecast_{view}_")
+
+    async def flow_other_city(self, index: int, user_id: int):
+        await self.send(message_update(user_id, "Погода в другом месте"))
+        await self.send(message_update(user_id, CITIES[(index * 7 + 3) % len(CITIES)]))
+
+    async def flow_location(self, index: int, user_id: int):
+        # Пользователи находятся в пределах десятка километров от центра города
+        rnd = random.Random(user_id)
+        lat, lon = LOCATION_CENTERS[index % len(LOCATION_CENTERS)]
+        await self.send(location_update(user_id, lat + rnd.uniform(-0.1, 0.1), lon + rnd.uniform(-0.1, 0.1)))
+
+    async def flow_inline(self, index: int, user_id: int):
+        # Пользователь набирает название города, и Telegram присылает запрос после каждой буквы
+        city = CITIES[index % len(CITIES)]
+        typing = []
+        for length in range(1, min(len(city), 6) + 1):
+            typing.append(asyncio.create_task(self.send(inline_update(user_id, city[:length]))))
+            await asyncio.sleep(0.05)
+        await asyncio.gather(*typing)
+
+    async def flow_history(self, index: int, user_id: int):
+        await self.send(message_update(user_id, "История"))
+        await self.press(user_id, "next_")
+
+    async def flow_delete_report(self, index: int, user_id: int):
+        await self.send(message_update(user_id, "История"))
+        if await self.press(user_id, "report_"):
+            await self.press(user_id, "delete_report_")
+
+    async def flow_export(self, index: int, user_id: int):
+        await self.send(message_update(user_id, "/export"))
+
+    async def flow_admin(self, index: int, user_id: int):
+        await self.send(message_update(ADMIN_ID, "Администратор"))
+        await self.send(message_update(ADMIN_ID, "Список пользователей"))
+        await self.press(ADMIN_ID, "next_users_")
+
+    async def run_flow(self, name: str, flow: Callable[[int, int], Awaitable[None]], users: list[int]):
+        """
+        Выполняет сценарий для всех пользователей и записывает его результаты.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies = []
+        errors = 0
+
+        async def one(index: int, user_id: int):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await flow(index, user_id)
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        db_before, api_before = self.db_queries, Counter(self.servers.calls)
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index, user_id) for index, user_id in enumerate(users)))
+        # Отчёты о погоде записываются в фоне; их запись тоже относится к сценарию
+        await self.bot.report_writer.stop()
+        self.bot.report_writer.start()
+        elapsed = time.perf_counter() - started
+
+        calls = Counter(self.servers.calls)
+        calls.subtract(api_before)
+        count = len(latencies)
+        if count > 1:
+            quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        else:
+            quantiles = (latencies or [0.0]) * 99
+        self.results[name] = {
+            "count": count,
+            "errors": errors,
+            "throughput": count / elapsed if elapsed else 0.0,
+            "p50_ms": quantiles[49] * 1000,
+            "p95_ms": quantiles[94] * 1000,
+            "p99_ms": quantiles[98] * 1000,
+            "db_per_flow": (self.db_queries - db_before) / max(count, 1),
+            "api_per_flow": {key: value / max(count, 1) for key, value in calls.items() if value},
+        }
+
+    async def run(self, flows: list[str]):
+        """
+        Выполняет сценарии в указанном порядке.
+
+        :param flows: Названия сценариев.
+        :type flows: list[str]
+        """
+        event.listen(self.bot.orm.engine.sync_engine, "before_cursor_execute", self._count_query)
+        try:
+            for name in flows:
+                users = [ADMIN_ID] * min(len(self.users), 50) if name == "admin" else self.users
+                await self.run_flow(name, getattr(self, f"flow_{name}"), users)
+        finally:
+            event.remove(self.bot.orm.engine.sync_engine, "before_cursor_execute", self._count_query)
+
+
+FLOWS = ["start", "set_city", "my_city", "forecast_views", "other_city", "location", "inline", "history", "delete_report", "export", "admin"]
+
+
+def print_results(results: dict):
+    print(f"{'flow':<14}{'count':>7}{'err':>5}{'flows/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db/flow':>9}"
+          "  api/flow")
+    for name, r in results.items():
+        api = ", ".join(f"{key}={value:.2f}" for key, value in sorted(r["api_per_flow"].items()))
+        print(f"{name:<14}{r['count']:>7}{r['errors']:>5}{r['throughput']:>10.1f}{r['p50_ms']:>9.1f}"
+              f"{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['db_per_flow']:>9.2f}  {api}")
+
+
+async def main(args: argparse.Namespace):
+    servers = FakeServers(args.api_latency, args.jitter, args.tg_latency)
+    await servers.start("127.0.0.1", args.port)
+
+    # Бот импортируется после настройки, чтобы он работал с локальными серверами и базой данных теста
+    import bot
+    from aiogram import Bot, Dispatcher
+
+    Bot.set_current(bot.bot)
+    Dispatcher.set_current(bot.dp)
+    await bot.on_startup(bot.dp)
+    # Прогрев кэша не относится к измеряемым сценариям
+    await bot.prefetcher.stop()
+    try:
+        bench = Bench(bot, servers, args.users, args.concurrency)
+        await bench.run(args.flows.split(","))
+    finally:
+        await bot.on_shutdown(bot.dp)
+        await (await bot.bot.get_session()).close()
+        await servers.stop()
+
+    print_results(bench.results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": bench.results}, f, ensure_ascii=False, indent=2)
+
+
+def configure(args: argparse.Namespace):
+    """
+    Направляет бота на локальные серверы и базу данных теста и снимает ограничения частоты,
+    которые в тесте только мешали бы измерять собственные накладные расходы бота.
+    """
+    base = f"http://127.0.0.1:{args.port}"
+    bot_config.bot_token = "123456:bench"
+    bot_config.api_server = base
+    bot_config.mode = "polling"
+    bot_config.tg_bot_admin = [ADMIN_ID]
+    bot_config.send_rate = 1_000_000
+    bot_config.chat_send_interval = 0
+    bot_config.metrics_port = 0
+    bot_config.background_jobs = False
+    api_config.geo_url = f"{base}/1.x"
+    api_config.weather_url = f"{base}/v2/forecast"
+    api_config.geo_rate = api_config.weather_rate = 1_000_000
+    api_config.geo_daily_quota = api_config.weather_daily_quota = 1_000_000_000
+    api_config.limiter_queue_size = 1_000_000
+    db_config.url = args.db
+    db_config.echo = False
+    if args.record:
+        api_config.replay_mode, api_config.replay_path = "record", args.record
+    elif args.replay:
+        api_config.replay_mode, api_config.replay_path = "replay", args.replay
+        api_config.replay_latency = args.replay_latency
+
+
+if __name__ == "__main__":
+    # Пример: python -m bench.run --users 500 --concurrency 50 --api-latency 0.05 --json before.json
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с локальными заменами API Яндекса и Telegram")
+    parser.add_argument("--users", type=int, default=200, help="количество синтетических пользователей")
+    parser.add_argument("--concurrency", type=int, default=50, help="количество одновременно выполняемых сценариев")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="средняя задержка ответов API Яндекса, с")
+    parser.add_argument("--jitter", type=float, default=0.2, help="доля случайного отклонения задержки API Яндекса")
+    parser.add_argument("--tg-latency", type=float, default=0.0, help="задержка ответов Bot API, с")
+    parser.add_argument("--port", type=int, default=8765, help="порт локальных серверов API")
+    parser.add_argument("--db", default=db_config.url, help="адрес тестовой базы данных")
+    parser.add_argument("--flows", default=",".join(FLOWS), help="сценарии через запятую")
+    parser.add_argument("--record", help="файл, в который записываются ответы API Яндекса")
+    parser.add_argument("--replay", help="файл записанных ответов API Яндекса, из которого бот получает ответы")
+    parser.add_argument("--replay-latency", choices=["recorded", "zero"], default="recorded",
+                        help="задержка воспроизводимых ответов: как при записи или нулевая")
+    parser.add_argument("--json", help="файл для сохранения результатов, чтобы сравнивать их между коммитами")
+    args = parser.parse_args()
+    configure(args)
+    asyncio.run(main(args))
@@ -1,17 +1,127 @@
+import asyncio
 import math
+from datetime import datetime
+from functools import partial
+from typing import AsyncIterator, Optional
 
 from aiogram import Bot, Dispatcher, types, executor
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 
 from api_requests import request
+from api_requests.errors import ApiError, CityNotFound
+from api_requests.forecast import Forecast
+from api_requests.limiter import INTERACTIVE
 from database import orm
-from settings import bot_config
-
-bot = Bot(token=bot_config.bot_token)
-storage = MemoryStorage()
+from database.fsm_storage import SQLStorage
+from database.writer import ReportWriter
+from services import export, metrics
+from services.broadcast import DailyForecast, minute_of_day
+from services.compaction import ReportCompactor
+from services.inline import InlineSearch
+from services.prefetch import Prefetcher
+from services.sender import SendQueue
+from settings import api_config, bot_config, db_config
+import webhook
+
+server = TelegramAPIServer.from_base(bot_config.api_server) if bot_config.api_server else TELEGRAM_PRODUCTION
+bot = Bot(token=bot_config.bot_token, server=server)
+# Кэш состояний в памяти допустим, только если все обновления пользователя обрабатывает один процесс:
+# при long polling, в том числе в рабочих процессах supervisor.py. Экземпляры бота в режиме вебхука
+# за балансировщиком читают и записывают состояния сразу в базе данных.
+storage = SQLStorage(db_config.fsm_ttl, db_config.fsm_flush_interval, db_config.fsm_purge_interval,
+                     db_config.fsm_cache_size, cached=bot_config.mode == "polling")
 dp = Dispatcher(bot, storage=storage)
+sender = SendQueue(bot, bot_config.send_rate, bot_config.chat_send_interval, bot_config.send_retries,
+                   bot_config.send_processes)
+report_writer = ReportWriter(db_config.writer_queue_size, db_config.writer_batch_size, db_config.writer_flush_interval,
+                             db_config.writer_user_cache_size)
+daily_forecast = DailyForecast(sender, bot_config.broadcast_chunk_size, bot_config.broadcast_max_pending)
+prefetcher = Prefetcher(api_config.prefetch_top_k, api_config.prefetch_lead, api_config.prefetch_interval,
+                        api_config.prefetch_history_days, api_config.prefetch_budget_share)
+compactor = ReportCompactor(db_config.report_retention_days, db_config.compaction_batch_size,
+                            db_config.compaction_interval, db_config.compaction_pause)
+
+# Метрики бота, отдаваемые сервером метрик по запросу /metrics
+dp.middleware.setup(metrics.MetricsMiddleware())
+metrics.instrument_engine(orm.engine)
+metrics.registry.register(metrics.Collected(
+    "bot_cache_hit_ratio", "Доля попаданий в кэш",
+    lambda: {("geo",): metrics.cache_hit_ratio(request.geo_cache_stats()),
+             ("weather",): metrics.cache_hit_ratio(request.weather_cache_stats())}, ("cache",)))
+metrics.collect_stats("bot_geo_cache", "Счётчики кэша координат городов", request.geo_cache_stats)
+metrics.collect_stats("bot_weather_cache", "Счётчики кэша прогнозов погоды", request.weather_cache_stats)
+metrics.collect_stats("bot_gazetteer", "Счётчики поиска в справочнике населённых пунктов", request.gazetteer.stats)
+metrics.collect_stats("bot_geo_limiter", "Счётчики ограничителя запросов к геокодеру", request.geo_limiter.stats)
+metrics.collect_stats("bot_geocoder_breaker", "Состояние предохранителя запросов к геокодеру",
+                      request.breakers["geocoder"].stats)
+metrics.collect_stats("bot_forecast_breaker", "Состояние предохранителя запросов к API Яндекс.Погоды",
+                      request.breakers["forecast"].stats)
+metrics.collect_stats("bot_weather_limiter", "Счётчики ограничителя запросов к API Яндекс.Погоды",
+                      request.weather_limiter.stats)
+metrics.registry.register(metrics.Collected("bot_fsm_states", "Количество состояний FSM в памяти",
+                                            lambda: len(storage)))
+metrics.collect_stats("bot_sender", "Счётчики очереди исходящих сообщений", sender.stats)
+metrics.collect_stats("bot_report_writer", "Счётчики записи отчётов о погоде", report_writer.stats)
+metrics.collect_stats("bot_daily_forecast", "Счётчики рассылки ежедневного прогноза", daily_forecast.stats)
+metrics.collect_stats("bot_prefetcher", "Счётчики прогрева кэша прогнозов", prefetcher.stats)
+metrics.collect_stats("bot_compactor", "Счётчики сворачивания старых отчётов", compactor.stats)
+metrics.collect_stats("bot_inline", "Счётчики встроенных запросов", lambda: inline_search.stats())
+metrics_server = None
+
+# Количество отчётов на одной странице истории запросов
+REPORTS_PER_PAGE = 4
+# Количество пользователей на одной странице списка пользователей в админ-панели
+USERS_PER_PAGE = 4
+# Максимальный размер файла, который бот может отправить в Telegram, байты
+EXPORT_MAX_SIZE = 50 * 1024 * 1024
+# Ограничение количества одновременных выгрузок
+export_semaphore = asyncio.Semaphore(bot_config.export_concurrency)
+
+
+def main_menu_markup() -> types.ReplyKeyboardMarkup:
+    """
+    Создаёт клавиатуру главного меню бота.
+
+    :return: Клавиатура с опциями главного меню.
+    :rtype: types.ReplyKeyboardMarkup
+    """
+    markup = types.reply_keyboard.ReplyKeyboardMarkup(row_width=2)
+    btn1 = types.KeyboardButton("Погода в моём городе")
+    btn2 = types.KeyboardButton("Погода в другом месте")
+    btn3 = types.KeyboardButton("История")
+    btn4 = types.KeyboardButton("Установить свой город")
+    btn5 = types.KeyboardButton("Ежедневный прогноз")
+    markup.add(btn1, btn2, btn3, btn4, btn5)
+    return markup
+
+
+async def resolve_city_name(message: types.Message) -> Optional[str]:
+    """
+    Определяет город по введённому пользователем названию с помощью справочника населённых пунктов.
+
+    Если название есть в справочнике в любом написании ("москва", "Moskva") или опечатка в нём
+    исправляется однозначно, возвращает название из справочника, поэтому все написания одного города
+    используют одни координаты и один ключ кэша прогнозов.
+    Если в справочнике есть только похожие названия, отправляет пользователю кнопки с вариантами
+    исправления и возвращает None. Если похожих названий нет, возвращает название как есть:
+    его координаты определит геокодер.
+
+    :param message: Объект, содержащий информацию о сообщении пользователя.
+    :type message: types.Message
+    :return: Название города или None, если пользователю предложены варианты исправления.
+    :rtype: Optional[str]
+    """
+    place, suggestions = request.gazetteer.resolve(message.text)
+    if place is not None:
+        return place.name
+    if suggestions:
+        markup = types.reply_keyboard.ReplyKeyboardMarkup(row_width=1, resize_keyboard=True)
+        markup.add(*(types.KeyboardButton(name) for name in suggestions))
+        await sender.answer(message, "Такого города я не знаю. Возможно, вы имели в виду:", reply_markup=markup)
+        return None
+    return message.text.strip()
 
 
 class ChoiceCityWeather(StatesGroup):
@@ -22,6 +132,10 @@ class SetUserCity(StatesGroup):
     waiting_user_city = State()
 
 
+class SubscribeForecast(StatesGroup):
+    waiting_time = State()
+
+
 @dp.message_handler(commands=["start"])
 async def start_message(message: types.Message):
     """
@@ -34,19 +148,14 @@ async def start_message(message: types.Message):
     :type message: types.Message
     """
     # Добавление идентификатора в базу данных
-    orm.add_user(message.from_user.id)
+    await orm.add_user(message.from_user.id)
 
     # Создание клавиатуры с опциями
-    markup = types.reply_keyboard.ReplyKeyboardMarkup(row_width=2)
-    btn1 = types.KeyboardButton("Погода в моём городе")
-    btn2 = types.KeyboardButton("Погода в другом месте")
-    btn3 = types.KeyboardButton("История")
-    btn4 = types.KeyboardButton("Установить свой город")
-    markup.add(btn1, btn2, btn3, btn4)
+    markup = main_menu_markup()
 
     # Формирование и отправка приветственного сообщения с клавиатурой пользователю
     text = f"Привет {message.from_user.first_name}, я бот, который расскажет тебе о погоде на сегодня"
-    await message.answer(text, reply_markup=markup)
+    await sender.answer(message, text, reply_markup=markup)
 
 
 @dp.message_handler(regexp="Меню")
@@ -60,16 +169,11 @@ async def start_message(message: types.Message):
     :type message: types.Message
     """
     # Создание клавиатуры с опциями
-    markup = types.reply_keyboard.ReplyKeyboardMarkup(row_width=2)
-    btn1 = types.KeyboardButton("Погода в моём городе")
-    btn2 = types.KeyboardButton("Погода в другом месте")
-    btn3 = types.KeyboardButton("История")
-    btn4 = types.KeyboardButton("Установить свой город")
-    markup.add(btn1, btn2, btn3, btn4)
+    markup = main_menu_markup()
 
     # Формирование и отправка приветственного сообщения с клавиатурой пользователю
     text = f"Привет {message.from_user.first_name}, я бот, который расскажет тебе о погоде на сегодня"
-    await message.answer(text, reply_markup=markup)
+    await sender.answer(message, text, reply_markup=markup)
 
 
 @dp.message_handler(regexp="Погода в моём городе")
@@ -79,8 +183,10 @@ async def get_user_city_weather(message: types.Message):
 
     При вызове функции, она получает город проживания пользователя из базы данных.
     Если город не установлен, отправляет пользователю предложение установить его.
-    Иначе, получает данные о погоде для данного города с помощью функции get_weather.
-    Создаёт отчёт о погоде и отправляет его пользователю.
+    Иначе, получает прогноз погоды для данного города с помощью функции get_forecast.
+    Создаёт отчёт о погоде и отправляет его пользователю с кнопками почасового прогноза,
+    прогноза на завтра и на неделю.
+    Если сервис погоды недоступен, показывает последний полученный прогноз с пометкой о его времени.
 
     :param message: Объект, содержащий информацию о сообщении пользователя.
     :type message: types.Message
@@ -91,7 +197,7 @@ async def get_user_city_weather(message: types.Message):
     markup.add(btn1)
 
     # Получение города пользователя из базы данных
-    city = orm.get_user_city(message.from_user.id)
+    city = await orm.get_user_city(message.from_user.id)
 
     # Если город не установлен, предложить пользователю установить его
     if city is None:
@@ -99,19 +205,25 @@ async def get_user_city_weather(message: types.Message):
         markup = types.reply_keyboard.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
         btn1 = types.KeyboardButton("Установить свой город")
         markup.add(btn1)
-        await message.answer(text, reply_markup=markup)
+        await sender.answer(message, text, reply_markup=markup)
         return
 
-    # Получение данных о погоде для данного города
-    data = request.get_weather(city)
+    # Получение прогноза погоды для данного города
+    try:
+        forecast = await request.get_forecast(await request.get_city_coord(city))
+    except CityNotFound:
+        await sender.answer(message, "Не нашёл такой город, установите город проживания заново", reply_markup=markup)
+        return
+    except ApiError:
+        await sender.answer(message, "Сервис погоды сейчас перегружен, попробуйте позже", reply_markup=markup)
+        return
 
-    # Создание отчёта о погоде и сохранение его в базе данных
-    orm.create_report(message.from_user.id, data["temp"], data["feels_like"], data["wind_speed"], data["pressure_mm"],
-                      city)
+    # Создание отчёта о погоде и постановка его в очередь на запись в базу данных
+    data = forecast.fact
+    await report_writer.put(message.from_user.id, data.temp, data.feels_like, data.wind_speed, data.pressure_mm, city)
 
-    # Формирование и отправка приветственного сообщения с клавиатурой пользователю
-    text = f"Погода в {city}\nТемпература: {data['temp']} C\nОщущается как: {data['feels_like']} C\nСкорость ветра: {data['wind_speed']} м/с\nДавление: {data['pressure_mm']} мм"
-    await message.answer(text, reply_markup=markup)
+    # Формирование и отправка сообщения с данными о погоде и кнопками других видов прогноза пользователю
+    await sender.answer(message, forecast_text(city, forecast, "now"), reply_markup=forecast_markup(city) or markup)
 
 
 @dp.message_handler(regexp="Погода в другом месте")
@@ -120,7 +232,7 @@ async def city_start(message: types.Message):
     Обработчик команды "Погода в другом месте"
 
     При вызове функции, она создаёт клавиатуру "Меню" для возврата обратно,
-    отправляет пользователю запрос на ввод названия города и переводит пользователя
+    отправляет пользователю запрос на ввод названия города или геопозиции и переводит пользователя
     в состояние ожидания ввода названия города (ChoiceCityWeather).
 
     :param message: Объект, содержащий информацию о сообщении пользователя.
@@ -129,11 +241,12 @@ async def city_start(message: types.Message):
     # Создание клавиатуры "Меню" для возврата обратно
     markup = types.reply_keyboard.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
     btn1 = types.KeyboardButton("Меню")
-    markup.add(btn1)
+    btn2 = types.KeyboardButton("Отправить геопозицию", request_location=True)
+    markup.add(btn1, btn2)
 
-    # Отправка запроса на ввод названия города пользователю с клавиатурой "Меню"
-    text = "Введите название города"
-    await message.answer(text, reply_markup=markup)
+    # Отправка запроса на ввод названия города или геопозиции пользователю с клавиатурой "Меню"
+    text = "Введите название города или отправьте геопозицию"
+    await sender.answer(message, text, reply_markup=markup)
 
     # Переход пользователя в состояние ожидания ввода названия города
     await ChoiceCityWeather.waiting_city.set()
@@ -144,8 +257,8 @@ async def city_chosen(message: types.Message, state: FSMContext):
     """
     Обработчик ввода названия города пользователем для выбора погоды в другом месте.
 
-    При вызове функции, она проверяет правильность ввода названия города.
-    Если название города написано с маленькой буквы, отправляет сообщение об ошибке.
+    При вызове функции, она определяет город по справочнику населённых пунктов (resolve_city_name).
+    Если в названии опечатка, которую нельзя исправить однозначно, предлагает варианты исправления.
     Иначе, обновляет данные состояния (FSMContext) с введённым названием города.
     Получает данные о погоде и отправляет его пользователю.
     Завершает состояние и переводит пользователя в исходное состояние.
@@ -155,38 +268,81 @@ async def city_chosen(message: types.Message, state: FSMContext):
     :param state: Объект состояния для управления текущим состоянием разговора с пользователем.
     :type state: FSMContext
     """
-    # Проверка, написано ли название города с большой буквы
-    if message.text[0].islower():
-        await message.answer("Названия городов пишутся с большой буквы )")
+    # Определение города по справочнику населённых пунктов
+    city_name = await resolve_city_name(message)
+    if city_name is None:
         return
 
     # Обновление данных состояния с введённым названием города
-    await state.update_data(waiting_city=message.text)
+    await state.update_data(waiting_city=city_name)
 
     # Создание клавиатуры "Меню" для возврата обратно
-    markup = types.reply_keyboard.ReplyKeyboardMarkup(row_width=2)
-    btn1 = types.KeyboardButton("Погода в моём городе")
-    btn2 = types.KeyboardButton("Погода в другом месте")
-    btn3 = types.KeyboardButton("История")
-    btn4 = types.KeyboardButton("Установить свой город")
-    markup.add(btn1, btn2, btn3, btn4)
+    markup = main_menu_markup()
 
-    # Получение данных о погоде для данного города
+    # Получение прогноза погоды для данного города
     city = await state.get_data()
-    data = request.get_weather(city.get("waiting_city"))
+    try:
+        forecast = await request.get_forecast(await request.get_city_coord(city.get("waiting_city")))
+    except CityNotFound:
+        # Состояние не завершается: пользователь может ввести название ещё раз
+        await sender.answer(message, "Не нашёл такой город, попробуйте ввести название ещё раз")
+        return
+    except ApiError:
+        await sender.answer(message, "Сервис погоды сейчас перегружен, попробуйте позже", reply_markup=markup)
+        await state.finish()
+        return
 
-    # Создание отчёта о погоде и сохранение его в базе данных
-    orm.create_report(message.from_user.id, data["temp"], data["feels_like"], data["wind_speed"], data["pressure_mm"],
-                      city.get("waiting_city"))
+    # Создание отчёта о погоде и постановка его в очередь на запись в базу данных
+    data = forecast.fact
+    await report_writer.put(message.from_user.id, data.temp, data.feels_like, data.wind_speed, data.pressure_mm,
+                            city.get("waiting_city"))
 
     # Формирование и отправка сообщения с данными о погоде пользователю
-    text = f"Погода в {city.get('waiting_city')}\nТемпература: {data['temp']} C\nОщущается как: {data['feels_like']} C\nСкорость ветра: {data['wind_speed']} м/с\nДавление: {data['pressure_mm']} мм"
-    await message.answer(text, reply_markup=markup)
+    await sender.answer(message, forecast_text(city.get("waiting_city"), forecast, "now"), reply_markup=markup)
 
     # Завершение состояния и переход пользователя в исходное состояние
     await state.finish()
 
 
+@dp.message_handler(content_types=types.ContentType.LOCATION, state=[None, ChoiceCityWeather.waiting_city])
+async def location_weather(message: types.Message, state: FSMContext):
+    """
+    Обработчик геопозиции, отправленной пользователем.
+
+    При вызове функции, она привязывает геопозицию к ближайшему узлу сетки и получает прогноз погоды
+    для узла без запроса к геокодеру. Пользователи, находящиеся рядом, получают прогноз из одной записи кэша.
+    Создаёт отчёт о погоде с координатами узла и отправляет его пользователю с кнопками других видов прогноза.
+    Если пользователь находился в состоянии ожидания названия города, завершает состояние.
+
+    :param message: Объект, содержащий информацию о сообщении пользователя.
+    :type message: types.Message
+    :param state: Объект состояния для управления текущим состоянием разговора с пользователем.
+    :type state: FSMContext
+    """
+    await state.finish()
+
+    # Привязка геопозиции к узлу сетки
+    lat, lon = request.snap_location(message.location.latitude, message.location.longitude)
+    place = request.location_name(lat, lon)
+
+    # Получение прогноза погоды для узла сетки
+    try:
+        forecast = await request.get_forecast(await request.get_city_coord(place))
+    except ApiError:
+        await sender.answer(message, "Сервис погоды сейчас перегружен, попробуйте позже",
+                            reply_markup=main_menu_markup())
+        return
+
+    # Создание отчёта о погоде и постановка его в очередь на запись в базу данных
+    data = forecast.fact
+    await report_writer.put(message.from_user.id, data.temp, data.feels_like, data.wind_speed, data.pressure_mm,
+                            place, lat, lon)
+
+    # Формирование и отправка сообщения с данными о погоде и кнопками других видов прогноза пользователю
+    await sender.answer(message, forecast_text(place, forecast, "now"),
+                        reply_markup=forecast_markup(place) or main_menu_markup())
+
+
 @dp.message_handler(regexp="Установить свой город")
 async def set_user_city_start(message: types.Message):
     """
@@ -206,7 +362,7 @@ async def set_user_city_start(message: types.Message):
 
     # Отправка запроса на ввод названия города пользователю с клавиатурой "Меню"
     text = "В каком городе проживаете?"
-    await message.answer(text, reply_markup=markup)
+    await sender.answer(message, text, reply_markup=markup)
 
     # Переход пользователя в состояние ожидания ввода названия города
     await SetUserCity.waiting_user_city.set()
@@ -217,8 +373,8 @@ async def user_city_chosen(message: types.Message, state: FSMContext):
     """
     Обработчик ввода города проживания пользователем для установки своего города.
 
-    При вызове функции, она проверяет правильность ввода названия города.
-    Если название города написано с маленькой буквы, отправляет сообщение об ошибке.
+    При вызове функции, она определяет город по справочнику населённых пунктов (resolve_city_name).
+    Если в названии опечатка, которую нельзя исправить однозначно, предлагает варианты исправления.
     Иначе, обновляет данные состояния (FSMContext) с введённым названием города.
     Записывает в базу данных город проживания пользователя.
     Создаёт клавиатуру "Меню" для возврата обратно и отправляет сообщение об успешной установке города.
@@ -229,77 +385,371 @@ async def user_city_chosen(message: types.Message, state: FSMContext):
     :param state: Объект состояния для управления текущим состоянием разговора с пользователем.
     :type state: FSMContext
     """
-    # Проверка, написано ли название города с большой буквы
-    if message.text[0].islower():
-        await message.answer("Названия городов пишутся с большой буквы )")
+    # Определение города по справочнику населённых пунктов
+    city_name = await resolve_city_name(message)
+    if city_name is None:
         return
 
     # Обновление данных состояния с введённым названием города
-    await state.update_data(waiting_user_city=message.text)
+    await state.update_data(waiting_user_city=city_name)
 
     # Получение данных о городе проживания пользователя
     user_data = await state.get_data()
 
     # Запись города проживания пользователя в базу данных
-    orm.set_user_city(message.from_user.id, user_data.get("waiting_user_city"))
+    await orm.set_user_city(message.from_user.id, user_data.get("waiting_user_city"))
 
     # Создание клавиатуры "Меню" для возврата обратно
-    markup = types.reply_keyboard.ReplyKeyboardMarkup(row_width=2)
-    btn1 = types.KeyboardButton("Погода в моём городе")
-    btn2 = types.KeyboardButton("Погода в другом месте")
-    btn3 = types.KeyboardButton("История")
-    btn4 = types.KeyboardButton("Установить свой город")
-    markup.add(btn1, btn2, btn3, btn4)
+    markup = main_menu_markup()
 
     # Формирование и отправка сообщения об успешной установке города пользователю
     text = f"Запомнил, {user_data.get('waiting_user_city')} - ваш город"
-    await message.answer(text, reply_markup=markup)
+    await sender.answer(message, text, reply_markup=markup)
 
     # Завершение состояния и переход пользователя в исходное состояние
     await state.finish()
 
 
-@dp.message_handler(regexp="История")
-async def get_reports(message: types.Message):
+@dp.message_handler(regexp="Ежедневный прогноз")
+async def subscribe_start(message: types.Message):
     """
-    Обработчик команды "История"
+    Обработчик команды "Ежедневный прогноз"
+
+    При вызове функции, она проверяет, установлен ли у пользователя город проживания.
+    Если город не установлен, отправляет пользователю предложение установить его.
+    Иначе, отправляет пользователю запрос на ввод времени ежедневного прогноза и переводит пользователя
+    в состояние ожидания ввода времени (SubscribeForecast).
+
+    :param message: Объект, содержащий информацию о сообщении пользователя.
+    :type message: types.Message
+    """
+    # Если город не установлен, предложить пользователю установить его
+    if await orm.get_user_city(message.from_user.id) is None:
+        text = "Пожалуйста, установите город проживания"
+        markup = types.reply_keyboard.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
+        btn1 = types.KeyboardButton("Установить свой город")
+        markup.add(btn1)
+        await sender.answer(message, text, reply_markup=markup)
+        return
+
+    # Создание клавиатуры с кнопкой отписки и кнопкой "Меню" для возврата обратно
+    markup = types.reply_keyboard.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
+    btn1 = types.KeyboardButton("Отписаться от прогноза")
+    btn2 = types.KeyboardButton("Меню")
+    markup.add(btn1, btn2)
+
+    # Отправка запроса на ввод времени прогноза пользователю
+    text = "Во сколько присылать прогноз? Введите время вашего города в формате ЧЧ:ММ, например 08:00"
+    await sender.answer(message, text, reply_markup=markup)
+
+    # Переход пользователя в состояние ожидания ввода времени
+    await SubscribeForecast.waiting_time.set()
 
-    При вызове функции, она получает список отчётов пользователя из базы данных.
-    Рассчитывает общее количество страниц и отображает историю запросов с кнопками навигации.
-    Каждый отчёт отображается с датой запроса и городом.
-    При нажатии на кнопку с отчётом пользователем, срабатывает соответствующий callback.
+
+@dp.message_handler(state=SubscribeForecast.waiting_time)
+async def subscribe_time_chosen(message: types.Message, state: FSMContext):
+    """
+    Обработчик ввода времени ежедневного прогноза.
+
+    При вызове функции, она отписывает пользователя от прогноза, если выбрана кнопка "Отписаться от прогноза".
+    Иначе, проверяет формат введённого времени, переводит местное время города пользователя в UTC
+    по часовому поясу из ответа API погоды и записывает его в базу данных.
+    Завершает состояние и переводит пользователя в исходное состояние.
 
     :param message: Объект, содержащий информацию о сообщении пользователя.
     :type message: types.Message
+    :param state: Объект состояния для управления текущим состоянием разговора с пользователем.
+    :type state: FSMContext
+    """
+    # Создание клавиатуры с опциями
+    markup = main_menu_markup()
+
+    if message.text == "Меню":
+        await state.finish()
+        await sender.answer(message, "Главное меню", reply_markup=markup)
+        return
+
+    if message.text == "Отписаться от прогноза":
+        await orm.set_user_notify(message.from_user.id, None)
+        await state.finish()
+        await sender.answer(message, "Вы отписались от ежедневного прогноза", reply_markup=markup)
+        return
+
+    # Проверка формата времени
+    try:
+        notify_time = datetime.strptime(message.text.strip(), "%H:%M")
+    except ValueError:
+        await sender.answer(message, "Введите время в формате ЧЧ:ММ, например 08:00")
+        return
+
+    # Получение часового пояса города пользователя
+    city = await orm.get_user_city(message.from_user.id)
+    try:
+        pos = await request.get_city_coord(city)
+        forecast = await request.get_forecast(pos)
+    except ApiError:
+        await sender.answer(message, "Сервис погоды сейчас перегружен, попробуйте позже", reply_markup=markup)
+        await state.finish()
+        return
+
+    # Запись времени прогноза в базу данных
+    await orm.set_user_notify(message.from_user.id,
+                              minute_of_day(notify_time.hour, notify_time.minute, forecast.offset))
+
+    # Формирование и отправка сообщения об успешной подписке пользователю
+    text = f"Буду присылать прогноз для {city} каждый день в {notify_time:%H:%M}"
+    await sender.answer(message, text, reply_markup=markup)
+
+    # Завершение состояния и переход пользователя в исходное состояние
+    await state.finish()
+
+
+# Виды прогноза, которые можно выбрать кнопками под сообщением о погоде
+FORECAST_VIEWS = {"now": "Сейчас", "hours": "12 часов", "day": "Завтра", "week": "Неделя"}
+# Названия дней недели
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+# Названия частей суток
+PART_NAMES = ("Ночь", "Утро", "День", "Вечер")
+
+
+def forecast_markup(city: str) -> Optional[types.InlineKeyboardMarkup]:
     """
-    current_page = 1
+    Создаёт встроенную клавиатуру для выбора вида прогноза погоды в городе.
+
+    :param city: Название города.
+    :type city: str
+    :return: Встроенная клавиатура или None, если название города не помещается в данные обратного вызова.
+    :rtype: Optional[types.InlineKeyboardMarkup]
+    """
+    # Данные обратного вызова ограничены 64 байтами
+    if max(len(f"forecast_{view}_{city}".encode("utf-8")) for view in FORECAST_VIEWS) > 64:
+        return None
+    inline_markup = types.InlineKeyboardMarkup(row_width=4)
+    inline_markup.add(*(types.InlineKeyboardButton(text=title, callback_data=f"forecast_{view}_{city}")
+                        for view, title in FORECAST_VIEWS.items()))
+    return inline_markup
 
-    # Получение списка отчётов пользователя из базы данных и расчёт общего количества страниц
-    reports = orm.get_reports(message.from_user.id)
-    total_pages = math.ceil(len(reports) / 4)
 
-    # Формирование текста сообщения и создание встроенной клавиатуры для кнопок с отчётами
-    text = "История запросов:"
+def forecast_text(city: str, forecast: Forecast, view: str) -> str:
+    """
+    Формирует текст прогноза погоды выбранного вида.
+
+    Все виды формируются из одного прогноза для точки, поэтому переключение между ними
+    не требует запросов к API Яндекс.Погоды.
+    К устаревшему прогнозу, показанному из-за недоступности сервиса погоды, добавляется пометка о его времени.
+
+    :param city: Название города.
+    :type city: str
+    :param forecast: Прогноз погоды для координат города.
+    :type forecast: Forecast
+    :param view: Вид прогноза: "now" - сейчас, "hours" - на 12 часов, "day" - на завтра, "week" - на неделю.
+    :type view: str
+    :return: Текст сообщения.
+    :rtype: str
+    """
+    now = datetime.now().timestamp()
+    # Место, погода в котором запрошена по геопозиции, называется по координатам
+    if request.location_pos(city) is not None:
+        city = f"точке {city}"
+    note = forecast.stale_note(api_config.weather_cache_ttl, now)
+    note = f"\n\n{note}" if note else ""
+    if view == "hours":
+        lines = [f"{forecast.local_time(hour.ts):%H:%M}  {hour.weather.temp} C, {hour.weather.condition_text}"
+                 for hour in forecast.next_hours(12, now)]
+        if not lines:
+            return "Почасовой прогноз недоступен"
+        return "\n".join([f"Погода в {city} на 12 часов", *lines]) + note
+    if view == "day":
+        day = forecast.day(1, now)
+        if day is None:
+            return "Прогноз на завтра недоступен"
+        lines = [f"{name}: {part.temp} C, {part.condition_text}, ветер {part.wind_speed} м/с"
+                 for name, part in zip(PART_NAMES, day.parts)]
+        date = datetime.fromisoformat(day.date)
+        return "\n".join([f"Погода в {city} завтра, {date:%d.%m}", *lines]) + note
+    if view == "week":
+        lines = []
+        for day in forecast.days[:7]:
+            date = datetime.fromisoformat(day.date)
+            lines.append(f"{WEEKDAYS[date.weekday()]} {date:%d.%m}: от {day.temp_min} до {day.temp_max} C, "
+                         f"{day.condition_text}")
+        return "\n".join([f"Погода в {city} на неделю", *lines]) + note
+    data = forecast.fact
+    return f"Погода в {city}\nТемпература: {data.temp} C\nОщущается как: {data.feels_like} C\nСкорость ветра: {data.wind_speed} м/с\nДавление: {data.pressure_mm} мм" + note
+
+
+def reports_markup(reports: list, page: int, total: int) -> types.InlineKeyboardMarkup:
+    """
+    Создаёт встроенную клавиатуру со страницей истории запросов.
+
+    Каждый отчёт отображается кнопкой с городом и датой запроса.
+    В кнопки навигации записываются дата и идентификатор крайнего отчёта страницы,
+    по которым база данных находит соседнюю страницу.
+
+    :param reports: Отчёты текущей страницы.
+    :type reports: list
+    :param page: Номер текущей страницы.
+    :type page: int
+    :param total: Общее количество отчётов пользователя.
+    :type total: int
+    :return: Клавиатура с отчётами и кнопками навигации.
+    :rtype: types.InlineKeyboardMarkup
+    """
+    total_pages = max(math.ceil(total / REPORTS_PER_PAGE), 1)
     inline_markup = types.InlineKeyboardMarkup()
 
-    # Отображение первых 4 отчётов на текущей странице
-    for report in reports[:current_page * 4]:
-        # Создание кнопки для каждого отчёта с названием города и датой запроса
+    # Создание кнопки для каждого отчёта с названием города и датой запроса
+    for report in reports:
         inline_markup.add(types.InlineKeyboardButton(
             text=f"{report.city} {report.date.day}.{report.date.month}.{report.date.year}",
             callback_data=f"report_{report.id}"
         ))
 
-    current_page += 1
+    # Добавление кнопок навигации: "Назад", "<текущая страница>/<общее количество страниц>" и "Вперёд"
+    buttons = []
+    if page > 1 and reports:
+        first = reports[0]
+        buttons.append(types.InlineKeyboardButton(
+            text="Назад", callback_data=f"prev_{page - 1}_{first.date.isoformat()}_{first.id}"
+        ))
+    buttons.append(types.InlineKeyboardButton(text=f"{page}/{total_pages}", callback_data="None"))
+    if page < total_pages and reports:
+        last = reports[-1]
+        buttons.append(types.InlineKeyboardButton(
+            text="Вперёд", callback_data=f"next_{page + 1}_{last.date.isoformat()}_{last.id}"
+        ))
+    inline_markup.row(*buttons)
+    return inline_markup
+
+
+@dp.message_handler(regexp="История")
+async def get_reports(message: types.Message):
+    """
+    Обработчик команды "История"
+
+    При вызове функции, она получает первую страницу отчётов пользователя и их общее количество из базы данных.
+    Рассчитывает общее количество страниц и отображает историю запросов с кнопками навигации.
+    Каждый отчёт отображается с датой запроса и городом.
+    При нажатии на кнопку с отчётом пользователем, срабатывает соответствующий callback.
 
-    # Добавление кнопок навигации: "<текущая страница>/<общее количество страниц>" и "Вперёд"
-    inline_markup.row(
-        types.InlineKeyboardButton(text=f"{current_page - 1}/{total_pages}", callback_data="None"),
-        types.InlineKeyboardButton(text="Вперёд", callback_data=f"next_{current_page}")
-    )
+    :param message: Объект, содержащий информацию о сообщении пользователя.
+    :type message: types.Message
+    """
+    # Получение первой страницы отчётов пользователя и общего количества отчётов из базы данных
+    reports, total = await orm.get_reports_page(message.from_user.id, REPORTS_PER_PAGE)
 
     # Отправка сообщения с историей запросов пользователю с встроенной клавиатурой
-    await message.answer(text, reply_markup=inline_markup)
+    await sender.answer(message, "История запросов:", reply_markup=reports_markup(reports, 1, total))
+
+
+async def send_export(message: types.Message, rows: AsyncIterator, fmt: str, name: str):
+    """
+    Формирует файл выгрузки из строк базы данных и отправляет его пользователю документом.
+
+    :param message: Сообщение, в ответ на которое отправляется выгрузка.
+    :type message: types.Message
+    :param rows: Асинхронный итератор строк выгрузки.
+    :type rows: AsyncIterator
+    :param fmt: Формат выгрузки: "csv" или "jsonl".
+    :type fmt: str
+    :param name: Имя файла без расширения.
+    :type name: str
+    """
+    if export_semaphore.locked():
+        await sender.answer(message, "Выгрузка начнётся, когда завершатся выгрузки других пользователей")
+
+    async with export_semaphore:
+        file, count = await export.export_rows(rows, fmt, db_config.export_spool_size)
+        with file:
+            if not count:
+                await sender.answer(message, "Выгружать нечего: история запросов пуста")
+                return
+            if export.file_size(file) > EXPORT_MAX_SIZE:
+                await sender.answer(message, "Выгрузка получилась больше 50 МБ, Telegram не позволяет её отправить")
+                return
+            filename = f"{name}.{export.FORMATS[fmt]}"
+
+            async def send_document(**kwargs) -> types.Message:
+                # Каждая попытка отправки, в том числе повтор после RetryAfter, читает файл с начала
+                return await bot.send_document(document=types.InputFile(export.Upload(file), filename=filename),
+                                               **kwargs)
+
+            await sender.submit(message.chat.id, send_document, priority=INTERACTIVE, chat_id=message.chat.id)
+
+
+def export_format(message: types.Message) -> str:
+    """
+    Возвращает формат выгрузки из аргумента команды: "csv" (по умолчанию) или "jsonl".
+
+    :param message: Сообщение с командой.
+    :type message: types.Message
+    :return: Формат выгрузки.
+    :rtype: str
+    """
+    fmt = (message.get_args() or "").strip().lower()
+    return fmt if fmt in export.FORMATS else "csv"
+
+
+@dp.message_handler(commands=["export"])
+async def export_reports(message: types.Message):
+    """
+    Обработчик команды "/export"
+
+    При вызове функции, она выгружает всю историю запросов пользователя в файл CSV
+    или, если указано "/export jsonl", в сжатый файл JSON Lines и отправляет его пользователю.
+
+    :param message: Объект, содержащий информацию о сообщении пользователя.
+    :type message: types.Message
+    """
+    rows = orm.stream_user_reports(message.from_user.id, db_config.export_chunk_size)
+    await send_export(message, rows, export_format(message), "history")
+
+
+# Ответы на встроенные запросы; создаются после forecast_text, которой формируется текст результатов
+inline_search = InlineSearch(partial(forecast_text, view="now"), bot_config.inline_debounce, bot_config.inline_results,
+                             bot_config.inline_fetch, bot_config.inline_cache_time)
+
+
+@dp.inline_handler()
+async def inline_city_search(query: types.InlineQuery):
+    """
+    Обработчик встроенных запросов "@бот <начало названия города>".
+
+    Отвечает списком городов, названия которых начинаются с введённого текста, с текущей погодой в каждом.
+    Выбранный результат отправляется в чат сообщением с погодой. Запросы, которые пользователь успел
+    дополнить за время ожидания, остаются без ответа (InlineSearch).
+
+    :param query: Объект, содержащий информацию о встроенном запросе пользователя.
+    :type query: types.InlineQuery
+    """
+    await inline_search.answer(query)
+
+
+@dp.callback_query_handler(lambda call: call.data.startswith("forecast_"))
+async def forecast_view(call: types.CallbackQuery):
+    """
+    Обработчик кнопок выбора вида прогноза погоды под сообщением о погоде.
+
+    Изменяет сообщение на прогноз выбранного вида. Прогноз берётся из того же кэша, что и текущая погода,
+    поэтому переключение видов обычно не требует запросов к API Яндекс.Погоды.
+
+    :param call: Объект, содержащий информацию о callback-запросе от пользователя.
+    :type call: types.CallbackQuery
+    """
+    # Чтение вида прогноза и названия города из данных обратного вызова
+    _, view, city = call.data.split("_", 2)
+
+    # Получение прогноза погоды для города
+    try:
+        forecast = await request.get_forecast(await request.get_city_coord(city))
+    except ApiError:
+        await call.answer("Сервис погоды сейчас перегружен, попробуйте позже")
+        return
+
+    await call.answer()
+    text = forecast_text(city, forecast, view)
+    if text != call.message.text:
+        await sender.edit_text(call.message, text, reply_markup=forecast_markup(city))
 
 
 @dp.callback_query_handler(lambda call: "users" not in call.data)
@@ -309,6 +759,8 @@ async def callback_query(call: types.CallbackQuery, state: FSMContext):
 
     При вызове функции, она обрабатывает различные типы callback-запросов,
     такие, как "delete_report", "next", "prev", "report" и "reports".
+    Для "next" и "prev" в данных обратного вызова передаются номер страницы,
+    дата и идентификатор крайнего отчёта соседней страницы.
 
     :param call: Объект, содержащий информацию о callback-запросе от пользователя.
     :type call: types.CallbackQuery
@@ -321,172 +773,63 @@ async def callback_query(call: types.CallbackQuery, state: FSMContext):
     if query_type == "delete" and call.data.split("_")[1] == "report":
         # Удаление отчёта по его идентификатору
         report_id = int(call.data.split("_")[2])
-        orm.delete_user_report(report_id)
+        await orm.delete_user_report(call.from_user.id, report_id)
 
-        current_page = 1
+        # Получение первой страницы отчётов пользователя после удаления
+        reports, total = await orm.get_reports_page(call.from_user.id, REPORTS_PER_PAGE)
 
-        # Получение списка отчётов пользователя после удаления и расчёт общего количества страниц
-        reports = orm.get_reports(call.from_user.id)
-        total_pages = math.ceil(len(reports) / 4)
+        # Обновление сообщения с историей запросов после удаления отчёта
+        await sender.edit_text(call.message, "История запросов:", reply_markup=reports_markup(reports, 1, total))
+        return
 
-        # Создание встроенной клавиатуры для кнопок с отчётами
-        inline_markup = types.InlineKeyboardMarkup()
+    if query_type in ("next", "prev"):
+        # Обработка перехода к соседней странице по дате и идентификатору крайнего отчёта
+        _, page, date, report_id = call.data.split("_")
+        page = int(page)
+        cursor = (datetime.fromisoformat(date), int(report_id))
+        if query_type == "next":
+            reports, total = await orm.get_reports_page(call.from_user.id, REPORTS_PER_PAGE, after=cursor)
+        else:
+            reports, total = await orm.get_reports_page(call.from_user.id, REPORTS_PER_PAGE, before=cursor)
 
-        # Отображение первых 4 отчётов на текущей странице
-        for report in reports[:current_page * 4]:
-            inline_markup.add(types.InlineKeyboardButton(
-                text=f"{report.city} {report.date.day}.{report.date.month}.{report.date.year}",
-                callback_data=f"report_{report.id}"
-            ))
+        # Если отчёты соседней страницы были удалены, показываем первую страницу
+        if not reports:
+            page = 1
+            reports, total = await orm.get_reports_page(call.from_user.id, REPORTS_PER_PAGE)
 
-        current_page += 1
+        await state.update_data(current_page=page)
 
-        # Добавление кнопок навигации: "<текущая страница>/<общее количество страниц>" и "Вперёд"
-        inline_markup.row(
-            types.InlineKeyboardButton(text=f"{current_page - 1}/{total_pages}", callback_data="None"),
-            types.InlineKeyboardButton(text="Вперёд", callback_data=f"next_{current_page}")
-        )
+        # Обновление сообщения с историей запросов при переходе к соседней странице
+        await sender.edit_text(call.message, "История запросов:", reply_markup=reports_markup(reports, page, total))
 
-        # Обновление сообщения с историей запросов после удаления отчёта
-        await call.message.edit_text(text="История запросов:", reply_markup=inline_markup)
-        return
+    if query_type == "report":
+        # Обработка запроса для показа подробностей отдельного отчёта
+        report_id = int(call.data.split("_")[1])
+        report = await orm.get_report(call.from_user.id, report_id)
+        if report is None:
+            await call.answer("Запрос не найден")
+            return
 
-    # Если тип запроса "next" или "prev", обрабатываем навигацию по страницам с отчётами
-    async with state.proxy() as data:
-        data["current_page"] = int(call.data.split("_")[1])
-        await state.update_data(current_page=data["current_page"])
+        # Создание встроенной клавиатуры для кнопок "Назад" и "Удалить запрос"
+        inline_markup = types.InlineKeyboardMarkup()
+        inline_markup.add(
+            types.InlineKeyboardButton(text="Назад", callback_data="reports_1"),
+            types.InlineKeyboardButton(text="Удалить запрос", callback_data=f"delete_report_{report_id}")
+        )
 
-        if query_type == "next":
-            # Обработка перехода к следующей странице
-            reports = orm.get_reports(call.from_user.id)
-            total_pages = math.ceil(len(reports) / 4)
-            inline_markup = types.InlineKeyboardMarkup()
-
-            # Если текущая страница содержит меньше 4 отчётов, добавляем только имеющиеся
-            if data["current_page"] * 4 >= len(reports):
-                for report in reports[data["current_page"] * 4 - 4:len(reports) + 1]:
-                    inline_markup.add(types.InlineKeyboardButton(
-                        text=f"{report.city} {report.date.day}.{report.date.month}.{report.date.year}",
-                        callback_data=f"report_{report.id}"
-                    ))
-
-                data["current_page"] -= 1
-
-                # Добавление кнопок навигации: "Назад" и "<текущая страница>/<общее количество страниц>"
-                inline_markup.row(
-                    types.InlineKeyboardButton(text="Назад", callback_data=f"prev_{data['current_page']}"),
-                    types.InlineKeyboardButton(text=f"{data['current_page'] + 1}/{total_pages}", callback_data="None")
-                )
-
-                # Обновление сообщения с историей запросов при переходе к следующей странице
-                await call.message.edit_text(text="История запросов:", reply_markup=inline_markup)
-                return
+        # Отправка сообщения с подробностями отчёта
+        await sender.edit_text(
+            call.message,
+            f"Данные по запросу\nГород: {report.city}\nТемпература: {report.temp}\nОщущается как: {report.feels_like}\nСкорость ветра: {report.wind_speed}\nДавление: {report.pressure_mm}",
+            reply_markup=inline_markup)
 
-            for report in reports[data["current_page"] * 4 - 4:data["current_page"] * 4]:
-                inline_markup.add(types.InlineKeyboardButton(
-                    text=f"{report.city} {report.date.day}.{report.date.month}.{report.date.year}",
-                    callback_data=f"report_{report.id}"
-                ))
-
-            data["current_page"] += 1
-
-            # Добавление кнопок навигации: "Назад", "<текущая страница>/<общее количество страниц>" и "Вперёд"
-            inline_markup.row(
-                types.InlineKeyboardButton(text="Назад", callback_data=f"prev_{data['current_page'] - 2}"),
-                types.InlineKeyboardButton(text=f"{data['current_page'] + 1}/{total_pages}", callback_data="None"),
-                types.InlineKeyboardButton(text="Вперёд", callback_data=f"next_{data['current_page']}")
-            )
-
-            # Обновление сообщения с историей запросов при переходе к следующей странице
-            await call.message.edit_text(text="История запросов:", reply_markup=inline_markup)
-
-        if query_type == "prev":
-            # Обработка перехода к предыдущей странице
-            reports = orm.get_reports(call.from_user.id)
-            total_pages = math.ceil(len(reports) / 4)
-            inline_markup = types.InlineKeyboardMarkup()
-
-            if data["current_page"] == 1:
-                for report in reports[0:data["current_page"] * 4]:
-                    inline_markup.add(types.InlineKeyboardButton(
-                        text=f"{report.city} {report.date.day}.{report.date.month}.{report.date.year}",
-                        callback_data=f"report_{report.id}"
-                    ))
-
-                data["current_page"] += 1
-
-                # Добавление кнопок навигации: "<текущая страница>/<общее количество страниц>" и "Вперёд"
-                inline_markup.row(
-                    types.InlineKeyboardButton(text=f"{data['current_page'] - 1}/{total_pages}", callback_data="None"),
-                    types.InlineKeyboardButton(text="Вперёд", callback_data=f"next_{data['current_page']}")
-                )
-
-                # Обновление сообщения с историей запросов при переходе к предыдущей странице
-                await call.message.edit_text(text="История запросов:", reply_markup=inline_markup)
-                return
+    if query_type == "reports":
+        # Обработка запроса для показа первой страницы с отчётами
+        reports, total = await orm.get_reports_page(call.from_user.id, REPORTS_PER_PAGE)
+        await state.update_data(current_page=1)
 
-            for report in reports[data["current_page"] * 4 - 4:data["current_page"] * 4]:
-                inline_markup.add(types.InlineKeyboardButton(
-                    text=f"{report.city} {report.date.day}.{report.date.month}.{report.date.year}",
-                    callback_data=f"report_{report.id}"
-                ))
-
-            data["current_page"] -= 1
-
-            # Добавление кнопок навигации: "Назад", "<текущая страница>/<общее количество страниц>" и "Вперёд"
-            inline_markup.row(
-                types.InlineKeyboardButton(text="Назад", callback_data=f"prev_{data['current_page'] - 2}"),
-                types.InlineKeyboardButton(text=f"{data['current_page'] + 1}/{total_pages}", callback_data="None"),
-                types.InlineKeyboardButton(text="Вперёд", callback_data=f"next_{data['current_page']}")
-            )
-
-            # Обновление сообщения с историей запросов при переходе к предыдущей странице
-            await call.message.edit_text(text="История запросов:", reply_markup=inline_markup)
-
-        if query_type == "report":
-            # Обработка запроса для показа подробностей отдельного отчёта
-            reports = orm.get_reports(call.from_user.id)
-            report_id = call.data.split("_")[1]
-            inline_markup = types.InlineKeyboardMarkup()
-
-            for report in reports:
-                if report.id == int(report_id):
-                    # Создание встроенной клавиатуры для кнопок "Назад" и "Удалить запрос"
-                    inline_markup.add(
-                        types.InlineKeyboardButton(text="Назад", callback_data=f"reports_{data['current_page']}"),
-                        types.InlineKeyboardButton(text="Удалить запрос", callback_data=f"delete_report_{report_id}")
-                    )
-
-                    # Отправка сообщения с подробностями отчёта
-                    await call.message.edit_text(
-                        text=f"Данные по запросу\nГород: {report.city}\nТемпература: {report.temp}\nОщущается как: {report.feels_like}\nСкорость ветра: {report.wind_speed}\nДавление: {report.pressure_mm}",
-                        reply_markup=inline_markup)
-                    break
-
-        if query_type == "reports":
-            # Обработка запроса для показа первой страницы с отчётами
-            reports = orm.get_reports(call.from_user.id)
-            total_pages = math.ceil(len(reports) / 4)
-            inline_markup = types.InlineKeyboardMarkup()
-            data["current_page"] = 1
-
-            # Отображение первых 4 отчётов на текущей странице
-            for report in reports[:data["current_page"] * 4]:
-                inline_markup.add(types.InlineKeyboardButton(
-                    text=f"{report.city} {report.date.day}.{report.date.month}.{report.date.year}",
-                    callback_data=f"report_{report.id}"
-                ))
-
-            data["current_page"] += 1
-
-            # Добавление кнопок навигации: "<текущая страница>/<общее количество страниц>" и "Вперёд"
-            inline_markup.row(
-                types.InlineKeyboardButton(text=f"{data['current_page'] - 1}/{total_pages}", callback_data="None"),
-                types.InlineKeyboardButton(text="Вперёд", callback_data=f"next_{data['current_page']}")
-            )
-
-            # Обновление сообщения с историей запросов при переходе к первой странице
-            await call.message.edit_text(text="История запросов:", reply_markup=inline_markup)
+        # Обновление сообщения с историей запросов при переходе к первой странице
+        await sender.edit_text(call.message, "История запросов:", reply_markup=reports_markup(reports, 1, total))
 
 
 @dp.message_handler(lambda message: message.from_user.id in bot_config.tg_bot_admin and message.text == "Администратор")
@@ -501,14 +844,52 @@ async def admin_panel(message: types.Message):
     :param message: Объект, содержащий информацию о сообщении от пользователя.
     :type message: types.Message
     """
-    # Создание клавиатуры с кнопкой "Список пользователей"
+    # Создание клавиатуры с кнопками "Список пользователей" и "Выгрузить всё"
     markup = types.reply_keyboard.ReplyKeyboardMarkup(resize_keyboard=True)
     btn1 = types.KeyboardButton("Список пользователей")
-    markup.add(btn1)
+    btn2 = types.KeyboardButton("Выгрузить всё")
+    markup.add(btn1, btn2)
 
-    # Отправка сообщения с административной панелью и кнопкой "Список пользователей"
+    # Отправка сообщения с административной панелью и кнопками
     text = "Админ-панель"
-    await message.answer(text, reply_markup=markup)
+    await sender.answer(message, text, reply_markup=markup)
+
+
+def users_markup(users: list, page: int, total: int) -> types.InlineKeyboardMarkup:
+    """
+    Создаёт встроенную клавиатуру со страницей списка пользователей для админ-панели.
+
+    В кнопки навигации записывается идентификатор крайнего пользователя страницы,
+    по которому база данных находит соседнюю страницу.
+
+    :param users: Строки с данными пользователей текущей страницы.
+    :type users: list
+    :param page: Номер текущей страницы.
+    :type page: int
+    :param total: Общее количество пользователей.
+    :type total: int
+    :return: Клавиатура с пользователями и кнопками навигации.
+    :rtype: types.InlineKeyboardMarkup
+    """
+    total_pages = max(math.ceil(total / USERS_PER_PAGE), 1)
+    inline_markup = types.InlineKeyboardMarkup()
+
+    # Создание кнопки для каждого пользователя с датой подключения и количеством отчётов
+    for user in users:
+        inline_markup.add(types.InlineKeyboardButton(
+            text=f"{user.id}) id: {user.tg_id} Подключился: {user.connection_date.day}.{user.connection_date.month}.{user.connection_date.year} Отчётов: {user.reports_count}",
+            callback_data="None"
+        ))
+
+    # Добавление кнопок навигации: "Назад", "<текущая страница>/<общее количество страниц>" и "Вперёд"
+    buttons = []
+    if page > 1 and users:
+        buttons.append(types.InlineKeyboardButton(text="Назад", callback_data=f"prev_users_{page - 1}_{users[0].id}"))
+    buttons.append(types.InlineKeyboardButton(text=f"{page}/{total_pages}", callback_data="None"))
+    if page < total_pages and users:
+        buttons.append(types.InlineKeyboardButton(text="Вперёд", callback_data=f"next_users_{page + 1}_{users[-1].id}"))
+    inline_markup.row(*buttons)
+    return inline_markup
 
 
 @dp.message_handler(
@@ -519,39 +900,17 @@ async def admin_panel(message: types.Message):
 
     При вызове функции, она проверяет, является ли пользователь администратором,
     сравнивая его идентификатор с идентификаторами администраторов, указанными в конфигурационном файле.
-    Если пользователь является администратором, то отображается список всех пользователей с информацией о каждом из них.
+    Если пользователь является администратором, то отображается первая страница списка пользователей
+    с информацией о каждом из них.
 
     :param message: Объект, содержащий информацию о сообщении от пользователя.
     :type message: types.Message
     """
-    # Получение списка всех пользователей из базы данных
-    users = orm.get_all_users()
-
-    # Расчёт общего количества страниц
-    current_page = 1
-    total_pages = math.ceil(len(users) / 4)
+    # Получение первой страницы пользователей и общего количества пользователей из базы данных
+    users, total = await orm.get_users_page(USERS_PER_PAGE)
 
-    # Формирование текста сообщения и создание встроенной клавиатуры для кнопок с пользователями
-    text = "Все пользователи:"
-    inline_markup = types.InlineKeyboardMarkup()
-
-    # Отображение первых 4 пользователей на текущей странице
-    for user in users[:current_page * 4]:
-        inline_markup.add(types.InlineKeyboardButton(
-            text=f"{user.id}) id: {user.tg_id} Подключился: {user.connection_date.day}.{user.connection_date.month}.{user.connection_date.year} Отчётов: {len(user.reports)}",
-            callback_data="None"
-        ))
-
-    current_page += 1
-
-    # Добавление кнопок навигации: "<текущая страница>/<общее количество страниц>" и "Вперёд"
-    inline_markup.row(
-        types.InlineKeyboardButton(text=f"{current_page - 1}/{total_pages}", callback_data="None"),
-        types.InlineKeyboardButton(text="Вперёд", callback_data=f"next_users_{current_page}")
-    )
-
-    # Отправка сообщения со списком всех пользователей и клавиатурой с кнопками навигации
-    await message.answer(text, reply_markup=inline_markup)
+    # Отправка сообщения со списком пользователей и клавиатурой с кнопками навигации
+    await sender.answer(message, "Все пользователи:", reply_markup=users_markup(users, 1, total))
 
 
 @dp.callback_query_handler(lambda call: "users" in call.data)
@@ -562,100 +921,106 @@ async def callback_query(call: types.CallbackQuery, state: FSMContext):
     При вызове функции обрабатывается запрос пользователя через встроенные кнопки.
     Функция позволяет администратору просматривать список всех пользователей с информацией о каждом пользователе.
     Администратор может использовать кнопки "Вперёд" и "Назад" для перехода по страницам с пользователями.
+    В данных обратного вызова передаются номер страницы и идентификатор крайнего пользователя соседней страницы.
 
     :param call: Объект, содержащий информацию о запросе пользователя через встроенные кнопки.
     :type call: types.CallbackQuery
     :param state: Объект, представляющий состояние конечного автомата, используемый в боте.
     :type state: FSMContext
     """
-    # Чтение типа запроса из данных обратного вызова
-    query_type = call.data.split("_")[0]
+    # Чтение типа запроса, номера страницы и идентификатора крайнего пользователя из данных обратного вызова
+    query_type, _, page, user_id = call.data.split("_")
+    page = int(page)
 
-    # Получение текущей страницы из хранилища состояний
-    async with state.proxy() as data:
-        data["current_page"] = int(call.data.split("_")[2])
-        await state.update_data(current_page=data["current_page"])
+    # Определение действия в зависимости от типа запроса
+    if query_type == "next":
+        users, total = await orm.get_users_page(USERS_PER_PAGE, after=int(user_id))
+    else:
+        users, total = await orm.get_users_page(USERS_PER_PAGE, before=int(user_id))
 
-        # Определение действия в зависимости от типа запроса
-        if query_type == "next":
-            users = orm.get_all_users()
-            total_pages = math.ceil(len(users) / 4)
-            inline_markup = types.InlineKeyboardMarkup()
-
-            # Если текущая страница слишком большая, чтобы отобразить пользователей, показываем последних
-            if data["current_page"] * 4 >= len(users):
-                for user in users[data["current_page"] * 4 - 4:len(users) + 1]:
-                    inline_markup.add(types.InlineKeyboardButton(
-                        text=f"{user.id}) id: {user.tg_id} Подключился: {user.connection_date.day}.{user.connection_date.month}.{user.connection_date.year} Отчётов: {len(user.reports)}",
-                        callback_data="None"
-                    ))
-                data["current_page"] -= 1
-                inline_markup.row(
-                    types.InlineKeyboardButton(text="Назад", callback_data=f"prev_users_{data['current_page']}"),
-                    types.InlineKeyboardButton(text=f"{data['current_page'] + 1}/{total_pages}", callback_data="None")
-                )
-                await call.message.edit_text(text="Все пользователи:", reply_markup=inline_markup)
-                return
+    # Если пользователей соседней страницы не осталось, показываем первую страницу
+    if not users:
+        page = 1
+        users, total = await orm.get_users_page(USERS_PER_PAGE)
 
-            # Выводим пользователей на текущей странице
-            for user in users[data["current_page"] * 4 - 4:data["current_page"] * 4]:
-                inline_markup.add(types.InlineKeyboardButton(
-                    text=f"{user.id}) id: {user.tg_id} Подключился: {user.connection_date.day}.{user.connection_date.month}.{user.connection_date.year} Отчётов: {len(user.reports)}",
-                    callback_data="None"
-                ))
-
-            data["current_page"] += 1
-
-            # Добавление кнопок навигации: "Назад", "<текущая страница>/<общее количество страниц>" и "Вперёд"
-            inline_markup.row(
-                types.InlineKeyboardButton(text="Назад", callback_data=f"prev_users_{data['current_page'] - 2}"),
-                types.InlineKeyboardButton(text=f"{data['current_page'] - 1}/{total_pages}", callback_data="None"),
-                types.InlineKeyboardButton(text=f"Вперёд", callback_data=f"next_users_{data['current_page']}")
-            )
-
-            # Отправка сообщения со списком всех пользователей и клавиатурой с кнопками навигации
-            await call.message.edit_text(text="Все пользователи:", reply_markup=inline_markup)
-
-        if query_type == "prev":
-            users = orm.get_all_users()
-            total_pages = math.ceil(len(users) / 4)
-            inline_markup = types.InlineKeyboardMarkup()
-
-            # Если текущая страница - первая, показываем первых пользователей
-            if data["current_page"] == 1:
-                for user in users[0:data["current_page"] * 4]:
-                    inline_markup.add(types.InlineKeyboardButton(
-                        text=f"{user.id}) id: {user.tg_id} Подключился: {user.connection_date.day}.{user.connection_date.month}.{user.connection_date.year} Отчётов: {len(user.reports)}",
-                        callback_data="None"
-                    ))
-                data["current_page"] += 1
-                inline_markup.row(
-                    types.InlineKeyboardButton(text=f"{data['current_page'] - 1}/{total_pages}", callback_data="None"),
-                    types.InlineKeyboardButton(text="Вперёд", callback_data=f"next_users_{data['current_page']}")
-                )
-                await call.message.edit_text(text="Все пользователи:", reply_markup=inline_markup)
-                return
+    await state.update_data(current_page=page)
+
+    # Отправка сообщения со списком пользователей и клавиатурой с кнопками навигации
+    await sender.edit_text(call.message, "Все пользователи:", reply_markup=users_markup(users, page, total))
 
-            # Выводим пользователей на текущей странице
-            for user in users[data["current_page"] * 4 - 4:data["current_page"] * 4]:
-                inline_markup.add(types.InlineKeyboardButton(
-                    text=f"{user.id}) id: {user.tg_id} Подключился: {user.connection_date.day}.{user.connection_date.month}.{user.connection_date.year} Отчётов: {len(user.reports)}",
-                    callback_data="None"
-                ))
 
-            data["current_page"] -= 1
+@dp.message_handler(lambda message: message.from_user.id in bot_config.tg_bot_admin and message.text == "Выгрузить всё")
+@dp.message_handler(lambda message: message.from_user.id in bot_config.tg_bot_admin, commands=["export_all"])
+async def export_all(message: types.Message):
+    """
+    Обработчик команды "Выгрузить всё" и "/export_all" в админ-панели.
+
+    При вызове функции, она выгружает всех пользователей и все их отчёты о погоде в файл CSV
+    или, если указано "/export_all jsonl", в сжатый файл JSON Lines и отправляет его администратору.
+
+    :param message: Объект, содержащий информацию о сообщении от пользователя.
+    :type message: types.Message
+    """
+    rows = orm.stream_all_reports(db_config.export_chunk_size)
+    await send_export(message, rows, export_format(message), "users")
+
 
-            # Добавление кнопок навигации: "Назад", "<текущая страница>/<общее количество страниц>" и "Вперёд"
-            inline_markup.row(
-                types.InlineKeyboardButton(text="Назад", callback_data=f"prev_users_{data['current_page']}"),
-                types.InlineKeyboardButton(text=f"{data['current_page'] + 1}/{total_pages}", callback_data="None"),
-                types.InlineKeyboardButton(text=f"Вперёд", callback_data=f"next_users_{data['current_page']}")
-            )
+async def on_startup(dispatcher: Dispatcher):
+    """
+    Подготавливает ресурсы при запуске бота.
+
+    Применяет миграции базы данных, открывает справочник населённых пунктов, запускает сервер метрик,
+    очередь исходящих сообщений, фоновую запись отчётов о погоде и состояний диалогов,
+    прогрев кэша прогнозов для популярных городов и, если разрешено, рассылку ежедневного прогноза
+    и сворачивание старых отчётов.
+    В режиме вебхука регистрирует вебхук в Telegram.
 
-            # Отправка сообщения со списком всех пользователей и клавиатурой с кнопками навигации
-            await call.message.edit_text(text="Все пользователи:", reply_markup=inline_markup)
+    :param dispatcher: Диспетчер бота.
+    :type dispatcher: Dispatcher
+    """
+    global metrics_server
+    await orm.init_db()
+    request.gazetteer.open()
+    metrics_server = await metrics.start_server(bot_config.metrics_host, bot_config.metrics_port)
+    report_writer.start()
+    storage.start()
+    sender.start()
+    if bot_config.background_jobs:
+        daily_forecast.start()
+        compactor.start()
+    # Кэш прогнозов у каждого процесса свой, поэтому прогрев выполняется в каждом процессе,
+    # но каждый расходует только бюджет от своей доли квоты API (api_config.api_processes)
+    prefetcher.start()
+    if bot_config.mode == "webhook":
+        await webhook.register_webhook(dispatcher)
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """
+    Освобождает ресурсы при остановке бота.
+
+    Останавливает фоновые задания, отправляет оставшиеся в очереди сообщения,
+    записывает оставшиеся в очереди отчёты о погоде и состояния диалогов,
+    закрывает общую HTTP-сессию для запросов к API Яндекса, соединения с базой данных и сервер метрик.
+
+    :param dispatcher: Диспетчер бота.
+    :type dispatcher: Dispatcher
+    """
+    await daily_forecast.stop()
+    await compactor.stop()
+    await prefetcher.stop()
+    await sender.stop()
+    await report_writer.stop()
+    await storage.close()
+    await request.close_session()
+    await orm.close_db()
+    if metrics_server is not None:
+        await metrics_server.cleanup()
 
 
 # Запуск бота
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=True)
+    if bot_config.mode == "webhook":
+        webhook.start_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
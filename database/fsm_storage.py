@@ -0,0 +1,221 @@
+import asyncio
+import copy
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Union
+
+from aiogram.dispatcher.storage import BaseStorage
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from api_requests.cache import LRUCache
+from .models import FSMRecord
+from .orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+def _empty() -> dict:
+    return {"state": None, "data": {}, "bucket": {}, "updated_at": None}
+
+
+class SQLStorage(BaseStorage):
+    """
+    Хранилище состояний конечного автомата (FSM) в таблице FSMStates базы данных бота.
+
+    Состояния переживают перезапуск бота и доступны всем процессам, работающим с одной базой данных.
+    Состояния, не менявшиеся дольше ttl секунд, считаются сброшенными и периодически удаляются из таблицы.
+
+    С cached=True изменения копятся в памяти и записываются в базу пачкой раз в flush_interval секунд,
+    а недавно прочитанные состояния хранятся в кэше ограниченного размера и читаются без обращения к базе.
+    Другие процессы не видят ещё не записанных изменений и не сбрасывают кэш, поэтому этот режим допустим,
+    только если все обновления пользователя обрабатывает один процесс: при long polling, в том числе
+    в рабочих процессах supervisor.py. Экземпляры бота за балансировщиком (режим вебхука) должны использовать
+    cached=False: каждое чтение идёт в базу данных, а каждое изменение сразу записывается в неё.
+    """
+
+    def __init__(self, ttl: float, flush_interval: float, purge_interval: float, cache_size: int, cached: bool):
+        """
+        :param ttl: Время, через которое неизменявшееся состояние сбрасывается, секунды.
+        :type ttl: float
+        :param flush_interval: Интервал записи изменений в базу данных, секунды.
+        :type flush_interval: float
+        :param purge_interval: Интервал удаления устаревших состояний из таблицы, секунды.
+        :type purge_interval: float
+        :param cache_size: Количество состояний, хранящихся в памяти для чтения без обращения к базе данных.
+        :type cache_size: int
+        :param cached: Кэшировать ли состояния в памяти и записывать ли изменения пачками.
+        :type cached: bool
+        """
+        self.ttl = timedelta(seconds=ttl)
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        self.cached = cached
+        self.cache = LRUCache(cache_size)
+        self._dirty = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """
+        Запускает фоновую задачу записи изменений и удаления устаревших состояний.
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """
+        Останавливает фоновую задачу и записывает в базу данных все накопленные изменения.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    def __len__(self) -> int:
+        return len(self.cache) + len(self._dirty)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_purge = loop.time() + self.purge_interval
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if loop.time() >= next_purge:
+                next_purge = loop.time() + self.purge_interval
+                try:
+                    await self.purge()
+                except Exception:
+                    logger.exception("Не удалось удалить устаревшие состояния FSM")
+
+    async def flush(self):
+        """
+        Записывает накопленные изменения состояний в базу данных.
+
+        Пустые состояния удаляются из таблицы, остальные вставляются или обновляются одним запросом.
+        Если запись не удалась, изменения остаются в очереди до следующей попытки.
+        """
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await self._write(dirty)
+        except Exception:
+            logger.exception("Не удалось записать %d состояний FSM", len(dirty))
+            # Более новые изменения, сделанные во время записи, важнее неудачно записанных
+            self._dirty = {**dirty, **self._dirty}
+
+    @staticmethod
+    async def _write(records: dict):
+        """
+        Записывает состояния в базу данных: пустые удаляет, остальные вставляет или обновляет одним запросом.
+        """
+        rows = []
+        removed = []
+        for (chat, user), record in records.items():
+            if record["state"] is None and not record["data"] and not record["bucket"]:
+                removed.append((chat, user))
+            else:
+                rows.append({"chat": chat, "user": user, "state": record["state"], "data": record["data"],
+                             "bucket": record["bucket"], "updated_at": record["updated_at"]})
+        async with Session() as session:
+            if rows:
+                query = pg_insert(FSMRecord)
+                query = query.on_conflict_do_update(
+                    index_elements=[FSMRecord.chat, FSMRecord.user],
+                    set_={"state": query.excluded.state, "data": query.excluded.data,
+                          "bucket": query.excluded.bucket, "updated_at": query.excluded.updated_at}
+                )
+                await session.execute(query, rows)
+            if removed:
+                await session.execute(delete(FSMRecord).where(tuple_(FSMRecord.chat, FSMRecord.user).in_(removed)))
+            await session.commit()
+
+    async def purge(self):
+        """
+        Удаляет из таблицы состояния, не менявшиеся дольше ttl.
+        """
+        async with Session() as session:
+            await session.execute(delete(FSMRecord).where(FSMRecord.updated_at < datetime.now() - self.ttl))
+            await session.commit()
+
+    def _is_expired(self, record: dict) -> bool:
+        return record["updated_at"] is not None and record["updated_at"] < datetime.now() - self.ttl
+
+    async def _load(self, chat: Union[str, int, None], user: Union[str, int, None]) -> tuple[tuple, dict]:
+        """
+        Возвращает ключ и запись состояния: из очереди изменений, из кэша или из базы данных.
+        """
+        chat, user = map(int, self.check_address(chat=chat, user=user))
+        key = (chat, user)
+        record = (self._dirty.get(key) or self.cache.get(key)) if self.cached else None
+        if record is None:
+            async with Session() as session:
+                row = await session.get(FSMRecord, key)
+            record = _empty()
+            if row is not None:
+                record = {"state": row.state, "data": row.data or {}, "bucket": row.bucket or {},
+                          "updated_at": row.updated_at}
+            if self.cached:
+                self.cache.set(key, record)
+        if self._is_expired(record):
+            record = _empty()
+            if self.cached:
+                self.cache.set(key, record)
+        return key, record
+
+    async def _save(self, key: tuple, record: dict):
+        record["updated_at"] = datetime.now()
+        if not self.cached:
+            await self._write({key: record})
+            return
+        self._dirty[key] = record
+        self.cache.set(key, record)
+
+    async def get_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                        default: Optional[str] = None) -> Optional[str]:
+        _, record = await self._load(chat, user)
+        return record["state"] or self.resolve_state(default)
+
+    async def get_data(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                       default: Optional[dict] = None) -> Dict:
+        _, record = await self._load(chat, user)
+        return copy.deepcopy(record["data"] or default or {})
+
+    async def set_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                        state: Optional[str] = None):
+        key, record = await self._load(chat, user)
+        await self._save(key, {**record, "state": self.resolve_state(state)})
+
+    async def set_data(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                       data: Dict = None):
+        key, record = await self._load(chat, user)
+        await self._save(key, {**record, "data": copy.deepcopy(data or {})})
+
+    async def update_data(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                          data: Dict = None, **kwargs):
+        key, record = await self._load(chat, user)
+        await self._save(key, {**record, "data": {**record["data"], **copy.deepcopy(data or {}), **kwargs}})
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                         default: Optional[dict] = None) -> Dict:
+        _, record = await self._load(chat, user)
+        return copy.deepcopy(record["bucket"] or default or {})
+
+    async def set_bucket(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                         bucket: Dict = None):
+        key, record = await self._load(chat, user)
+        await self._save(key, {**record, "bucket": copy.deepcopy(bucket or {})})
+
+    async def update_bucket(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                            bucket: Dict = None, **kwargs):
+        key, record = await self._load(chat, user)
+        await self._save(key, {**record, "bucket": {**record["bucket"], **copy.deepcopy(bucket or {}), **kwargs}})
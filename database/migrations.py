@@ -0,0 +1,176 @@
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Номер блокировки PostgreSQL, под которой выполняются миграции, чтобы несколько процессов бота
+# не применяли их одновременно
+LOCK_ID = 74201
+
+# Версионированные миграции схемы: (версия, описание, шаги, concurrent).
+# Шаг - SQL-запрос или функция, принимающая синхронное соединение.
+# Шаги обычной миграции выполняются в одной транзакции вместе с записью её версии.
+# Шаги миграции с concurrent=True выполняются вне транзакции, чтобы индексы строились через CONCURRENTLY
+# без блокировки записи в таблицы.
+# Шаги записаны явным SQL и не зависят от текущих моделей, поэтому изменение моделей не меняет уже выпущенные
+# миграции: каждое изменение схемы - новая миграция. Шаги идемпотентны (IF NOT EXISTS), потому что базы,
+# созданные до появления миграций, уже содержат часть таблиц и столбцов.
+MIGRATIONS = [
+    (1, "Исходная схема", [
+        """
+        CREATE TABLE IF NOT EXISTS "Users" (
+            id SERIAL PRIMARY KEY,
+            tg_id BIGINT NOT NULL,
+            city VARCHAR,
+            connection_date TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS "WeatherReports" (
+            id SERIAL PRIMARY KEY,
+            owner INTEGER NOT NULL REFERENCES "Users" (id),
+            date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            temp INTEGER NOT NULL,
+            feels_like INTEGER NOT NULL,
+            wind_speed INTEGER NOT NULL,
+            pressure_mm INTEGER NOT NULL,
+            city VARCHAR NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS "CityCoords" (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR NOT NULL UNIQUE,
+            pos VARCHAR NOT NULL
+        )
+        """,
+    ], False),
+    (2, "Объединение пользователей с одинаковым tg_id", [
+        """
+        UPDATE "WeatherReports" r SET owner = d.keep
+        FROM (SELECT id, min(id) OVER (PARTITION BY tg_id) AS keep FROM "Users") d
+        WHERE r.owner = d.id AND d.id <> d.keep
+        """,
+        'DELETE FROM "Users" u USING "Users" k WHERE u.tg_id = k.tg_id AND u.id > k.id',
+    ], False),
+    (3, "Счётчик отчётов пользователей", [
+        'ALTER TABLE "Users" ADD COLUMN IF NOT EXISTS reports_count INTEGER NOT NULL DEFAULT 0',
+        # Пока счётчики заполняются, новые отчёты не записываются: иначе увеличение счётчика
+        # одновременной записью отчёта может потеряться или учесться дважды
+        'LOCK TABLE "WeatherReports" IN SHARE MODE',
+        """
+        UPDATE "Users" u SET reports_count = coalesce(c.count, 0)
+        FROM "Users" a LEFT JOIN (SELECT owner, count(*) AS count FROM "WeatherReports" GROUP BY owner) c
+            ON c.owner = a.id
+        WHERE u.id = a.id AND u.reports_count IS DISTINCT FROM coalesce(c.count, 0)
+        """,
+    ], False),
+    (4, "Индексы по tg_id и истории запросов", [
+        # Недостроенный индекс от прерванной миграции удаляется и строится заново
+        'DROP INDEX CONCURRENTLY IF EXISTS "ix_Users_tg_id"',
+        'CREATE UNIQUE INDEX CONCURRENTLY "ix_Users_tg_id" ON "Users" (tg_id)',
+        'DROP INDEX CONCURRENTLY IF EXISTS "ix_WeatherReports_owner_date"',
+        'CREATE INDEX CONCURRENTLY "ix_WeatherReports_owner_date" ON "WeatherReports" (owner, date DESC, id DESC)',
+    ], True),
+    (5, "Хранилище состояний FSM", [
+        """
+        CREATE TABLE IF NOT EXISTS "FSMStates" (
+            chat BIGINT NOT NULL,
+            "user" BIGINT NOT NULL,
+            state VARCHAR,
+            data JSON NOT NULL,
+            bucket JSON NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (chat, "user")
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS "ix_FSMStates_updated_at" ON "FSMStates" (updated_at)',
+    ], False),
+    (6, "Время ежедневного прогноза", [
+        'ALTER TABLE "Users" ADD COLUMN IF NOT EXISTS notify_minute INTEGER',
+    ], False),
+    (7, "Индекс по времени ежедневного прогноза", [
+        'DROP INDEX CONCURRENTLY IF EXISTS "ix_Users_notify_minute"',
+        'CREATE INDEX CONCURRENTLY "ix_Users_notify_minute" ON "Users" (notify_minute)',
+    ], True),
+    (8, "Дневные сводки старых отчётов", [
+        """
+        CREATE TABLE IF NOT EXISTS "WeatherReportRollups" (
+            owner INTEGER NOT NULL REFERENCES "Users" (id),
+            city VARCHAR NOT NULL,
+            day DATE NOT NULL,
+            count INTEGER NOT NULL,
+            temp_min INTEGER NOT NULL,
+            temp_max INTEGER NOT NULL,
+            temp_sum INTEGER NOT NULL,
+            PRIMARY KEY (owner, city, day)
+        )
+        """,
+    ], False),
+    (9, "Координаты отчётов о погоде по геопозиции", [
+        'ALTER TABLE "WeatherReports" ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION',
+        'ALTER TABLE "WeatherReports" ADD COLUMN IF NOT EXISTS lon DOUBLE PRECISION',
+    ], False),
+]
+
+
+async def migrate(engine: AsyncEngine):
+    """
+    Применяет к базе данных миграции, которые ещё не были применены.
+
+    Применённые версии записываются в таблицу SchemaVersions.
+    Пока выполняются миграции, другие процессы бота ждут их завершения на блокировке.
+
+    :param engine: Движок базы данных.
+    :type engine: AsyncEngine
+    """
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": LOCK_ID})
+        try:
+            await lock_conn.execute(text(
+                'CREATE TABLE IF NOT EXISTS "SchemaVersions" ('
+                'version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, '
+                'applied_at TIMESTAMP NOT NULL DEFAULT now())'
+            ))
+            applied = set(await lock_conn.scalars(text('SELECT version FROM "SchemaVersions"')))
+
+            for version, description, steps, concurrent in MIGRATIONS:
+                if version in applied:
+                    continue
+                if concurrent:
+                    async with engine.connect() as conn:
+                        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                        for step in steps:
+                            await _run_step(conn, step)
+                        await _record(conn, version, description)
+                else:
+                    async with engine.begin() as conn:
+                        for step in steps:
+                            await _run_step(conn, step)
+                        await _record(conn, version, description)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": LOCK_ID})
+
+
+async def _run_step(conn, step):
+    if callable(step):
+        await conn.run_sync(step)
+    else:
+        await conn.execute(text(step))
+
+
+async def _record(conn, version: int, description: str):
+    await conn.execute(text('INSERT INTO "SchemaVersions" (version, description) VALUES (:version, :description)'),
+                       {"version": version, "description": description})
+
+
+if __name__ == "__main__":
+    # Применение миграций отдельно от запуска бота: python -m database.migrations
+    from .orm import engine
+
+    async def main():
+        await migrate(engine)
+        await engine.dispose()
+
+    asyncio.run(main())
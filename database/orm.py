@@ -1,35 +1,55 @@
-from typing import Optional, Type
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Integer, Row, bindparam, cast, delete, extract, func, insert, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import selectinload
 
 from settings import db_config
-from .models import Base, User, WeatherReport
+from . import migrations
+from .models import User, WeatherReport, CityCoord
 
-engine = create_engine(db_config.url, echo=True)
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
+engine = create_async_engine(db_config.url, echo=db_config.echo, pool_size=db_config.pool_size,
+                             max_overflow=db_config.max_overflow, pool_pre_ping=True)
+Session = async_sessionmaker(bind=engine, expire_on_commit=False)
 
 
-def add_user(tg_id: int):
+async def init_db():
+    """
+    Применяет к базе данных миграции схемы, которые ещё не были применены.
+
+    Вызывается при запуске бота.
+    """
+    await migrations.migrate(engine)
+
+
+async def close_db():
+    """
+    Закрывает все соединения пула базы данных.
+
+    Вызывается при остановке бота.
+    """
+    await engine.dispose()
+
+
+async def add_user(tg_id: int):
     """
     Добавляет нового пользователя в базу данных, если пользователь с таким tg_id не существует.
 
-    Функция проверяет наличие пользователя с указанным tg_id в базе данных.
-    Если пользователь не найден, создаётся новый объект User с указанным tg_id и добавляется в базу данных.
+    Пользователь добавляется одним запросом INSERT ... ON CONFLICT DO NOTHING по уникальному индексу на tg_id,
+    поэтому одновременные вызовы не создают дубликатов.
 
     :param tg_id: Идентификатор пользователя Telegram.
     :type tg_id: int
     """
-    session = Session()
-    user = session.query(User).filter(User.tg_id == tg_id).first()
-    if user is None:
-        new_user = User(tg_id=tg_id)
-        session.add(new_user)
-        session.commit()
+    async with Session() as session:
+        await session.execute(pg_insert(User).values(tg_id=tg_id).on_conflict_do_nothing(index_elements=[User.tg_id]))
+        await session.commit()
 
 
-def set_user_city(tg_id: int, city: str):
+async def set_user_city(tg_id: int, city: str):
     """
     Устанавливает город проживания для пользователя с указанным tg_id.
 
@@ -42,13 +62,54 @@ def set_user_city(tg_id: int, city: str):
     :param city: Название города, который нужно установить для пользователя.
     :type tg_id: str
     """
-    session = Session()
-    user = session.query(User).filter(User.tg_id == tg_id).first()
-    user.city = city
-    session.commit()
+    async with Session() as session:
+        user = await session.scalar(select(User).where(User.tg_id == tg_id).limit(1))
+        user.city = city
+        await session.commit()
+
+
+async def set_user_notify(tg_id: int, minute: Optional[int]):
+    """
+    Подписывает пользователя на ежедневный прогноз погоды или отписывает от него.
 
+    :param tg_id: Идентификатор пользователя Telegram.
+    :type tg_id: int
+    :param minute: Минута суток по UTC, в которую отправляется прогноз, или None, чтобы отписаться.
+    :type minute: Optional[int]
+    """
+    async with Session() as session:
+        await session.execute(update(User).where(User.tg_id == tg_id).values(notify_minute=minute))
+        await session.commit()
+
+
+async def get_subscribers_page(minute: int, limit: int, after: Optional[tuple[str, int]] = None) -> list[Row]:
+    """
+    Возвращает порцию подписчиков ежедневного прогноза, которым прогноз отправляется в указанную минуту.
+
+    Подписчики упорядочены по городу и идентификатору, чтобы подписчики одного города шли подряд.
+    Следующая порция выбирается по ключу (город, идентификатор) последнего подписчика предыдущей,
+    поэтому между порциями соединение с базой данных не удерживается и транзакция не остаётся открытой.
 
-def create_report(tg_id: int, temp: int, feels_like: int, wind_speed: int, pressure_mm: int, city: str):
+    :param minute: Минута суток по UTC.
+    :type minute: int
+    :param limit: Максимальное количество подписчиков в порции.
+    :type limit: int
+    :param after: Город и идентификатор последнего подписчика предыдущей порции.
+    :type after: Optional[tuple[str, int]]
+    :return: Строки с tg_id, city и id подписчиков.
+    :rtype: list[Row]
+    """
+    query = (select(User.tg_id, User.city, User.id)
+             .where(User.notify_minute == minute, User.city.is_not(None))
+             .order_by(User.city, User.id)
+             .limit(limit))
+    if after is not None:
+        query = query.where(tuple_(User.city, User.id) > tuple_(*after))
+    async with Session() as session:
+        return list(await session.execute(query))
+
+
+async def create_report(tg_id: int, temp: int, feels_like: int, wind_speed: int, pressure_mm: int, city: str):
     """
     Создаёт отчёт о погоде для указанного пользователя с заданными данными.
 
@@ -69,15 +130,53 @@ def create_report(tg_id: int, temp: int, feels_like: int, wind_speed: int, press
     :param city: Название города, для которого создаётся отчёт о погоде.
     :type tg_id: str
     """
-    session = Session()
-    user = session.query(User).filter(User.tg_id == tg_id).first()
-    new_report = WeatherReport(temp=temp, feels_like=feels_like, wind_speed=wind_speed, pressure_mm=pressure_mm,
-                               city=city, owner=user.id)
-    session.add(new_report)
-    session.commit()
+    async with Session() as session:
+        user_id = await session.scalar(select(User.id).where(User.tg_id == tg_id).limit(1))
+        session.add(WeatherReport(temp=temp, feels_like=feels_like, wind_speed=wind_speed, pressure_mm=pressure_mm,
+                                  city=city, owner=user_id))
+        await session.execute(update(User).where(User.id == user_id).values(reports_count=User.reports_count + 1))
+        await session.commit()
+
+
+async def create_reports(reports: list[dict]):
+    """
+    Записывает несколько отчётов о погоде одним INSERT.
 
+    Счётчики отчётов владельцев увеличиваются в той же транзакции.
 
-def get_user_city(tg_id: int) -> Optional[str]:
+    :param reports: Словари с полями WeatherReport, включая owner и date.
+    :type reports: list[dict]
+    """
+    counts = {}
+    for report in reports:
+        counts[report["owner"]] = counts.get(report["owner"], 0) + 1
+
+    users = User.__table__
+    async with Session() as session:
+        await session.execute(insert(WeatherReport), reports)
+        await session.execute(
+            update(users).where(users.c.id == bindparam("user_id"))
+            .values(reports_count=users.c.reports_count + bindparam("added")),
+            [{"user_id": owner, "added": added} for owner, added in counts.items()]
+        )
+        await session.commit()
+
+
+async def get_user_ids(tg_ids: set[int]) -> dict[int, int]:
+    """
+    Возвращает идентификаторы пользователей в базе данных по их tg_id.
+
+    :param tg_ids: Идентификаторы пользователей Telegram.
+    :type tg_ids: set[int]
+    :return: Словарь tg_id -> User.id для найденных пользователей.
+    :rtype: dict[int, int]
+    """
+    async with Session() as session:
+        rows = await session.execute(select(User.tg_id, User.id).where(User.tg_id.in_(tg_ids)))
+        return {tg_id: user_id for tg_id, user_id in rows}
+
+
+async def get_user_city(tg_id: int) -> Optional[str]:
     """
     Возвращает город проживания пользователя с указанным tg_id.
 
@@ -90,12 +189,11 @@ def get_user_city(tg_id: int) -> Optional[str]:
     :return: Название города проживания пользователя или None, если пользователь не найден или город не установлен.
     :rtype: Optional[str]
     """
-    session = Session()
-    user = session.query(User).filter(User.tg_id == tg_id).first()
-    return user.city
+    async with Session() as session:
+        return await session.scalar(select(User.city).where(User.tg_id == tg_id).limit(1))
 
 
-def get_reports(tg_id: int) -> list[WeatherReport]:
+async def get_reports(tg_id: int) -> list[WeatherReport]:
     """
     Возвращает список отчётов о погоде для пользователя с указанным tg_id.
 
@@ -108,39 +206,308 @@ def get_reports(tg_id: int) -> list[WeatherReport]:
     :return: Список отчётов о погоде для пользователя или пустой список, если пользователь не найден или отчётов нет.
     :rtype: list[WeatherReport]
     """
-    session = Session()
-    user = session.query(User).filter(User.tg_id == tg_id).first()
-    reports = user.reports
-    return reports
+    async with Session() as session:
+        reports = await session.scalars(
+            select(WeatherReport).join(User, WeatherReport.owner == User.id).where(User.tg_id == tg_id)
+            .order_by(WeatherReport.id)
+        )
+        return list(reports)
+
+
+async def get_reports_page(tg_id: int, per_page: int, after: Optional[tuple[datetime, int]] = None,
+                           before: Optional[tuple[datetime, int]] = None) -> tuple[list[WeatherReport], int]:
+    """
+    Возвращает одну страницу истории запросов пользователя и общее количество его отчётов.
+
+    Отчёты упорядочены по дате и идентификатору.
+    Страница выбирается по ключу (дата, идентификатор) соседнего отчёта, а не через OFFSET,
+    а количество отчётов берётся из счётчика User.reports_count, поэтому стоимость запроса
+    не зависит от номера страницы и размера истории.
+    Без after и before возвращается первая страница.
+
+    :param tg_id: Идентификатор пользователя Telegram.
+    :type tg_id: int
+    :param per_page: Количество отчётов на странице.
+    :type per_page: int
+    :param after: Дата и идентификатор последнего отчёта предыдущей страницы.
+    :type after: Optional[tuple[datetime, int]]
+    :param before: Дата и идентификатор первого отчёта следующей страницы.
+    :type before: Optional[tuple[datetime, int]]
+    :return: Список отчётов страницы и общее количество отчётов пользователя.
+    :rtype: tuple[list[WeatherReport], int]
+    """
+    owner = select(User.id).where(User.tg_id == tg_id).limit(1).scalar_subquery()
+    key = tuple_(WeatherReport.date, WeatherReport.id)
+    query = select(WeatherReport).where(WeatherReport.owner == owner).limit(per_page)
+    if before is not None:
+        query = query.where(key < tuple_(*before)).order_by(WeatherReport.date.desc(), WeatherReport.id.desc())
+    else:
+        if after is not None:
+            query = query.where(key > tuple_(*after))
+        query = query.order_by(WeatherReport.date, WeatherReport.id)
+
+    async with Session() as session:
+        reports = list(await session.scalars(query))
+        total = await session.scalar(select(User.reports_count).where(User.tg_id == tg_id).limit(1)) or 0
+    if before is not None:
+        reports.reverse()
+    return reports, total
+
+
+# Столбцы выгрузки истории запросов
+REPORT_COLUMNS = (WeatherReport.date, WeatherReport.city, WeatherReport.lat, WeatherReport.lon, WeatherReport.temp,
+                  WeatherReport.feels_like, WeatherReport.wind_speed, WeatherReport.pressure_mm)
+
+
+async def stream_user_reports(tg_id: int, chunk_size: int) -> AsyncIterator[Row]:
+    """
+    Возвращает все отчёты о погоде пользователя в порядке даты для выгрузки.
+
+    Отчёты читаются курсором на стороне базы данных порциями по chunk_size строк,
+    поэтому в памяти не оказывается вся история пользователя.
+
+    :param tg_id: Идентификатор пользователя Telegram.
+    :type tg_id: int
+    :param chunk_size: Количество строк, читаемых из базы данных за одно обращение.
+    :type chunk_size: int
+    :return: Асинхронный итератор строк с датой, городом, температурой, ощущаемой температурой,
+        скоростью ветра и давлением.
+    :rtype: AsyncIterator[Row]
+    """
+    owner = select(User.id).where(User.tg_id == tg_id).limit(1).scalar_subquery()
+    query = (select(*REPORT_COLUMNS)
+             .where(WeatherReport.owner == owner)
+             .order_by(WeatherReport.date, WeatherReport.id)
+             .execution_options(yield_per=chunk_size))
+    async with Session() as session:
+        result = await session.stream(query)
+        async for row in result:
+            yield row
+
+
+async def stream_all_reports(chunk_size: int) -> AsyncIterator[Row]:
+    """
+    Возвращает всех пользователей и их отчёты о погоде для выгрузки администратором.
+
+    Для каждого отчёта возвращается строка с данными пользователя и отчёта, для пользователя без отчётов -
+    одна строка с пустыми полями отчёта. Строки читаются курсором на стороне базы данных порциями по chunk_size.
+
+    :param chunk_size: Количество строк, читаемых из базы данных за одно обращение.
+    :type chunk_size: int
+    :return: Асинхронный итератор строк с tg_id, городом и датой подключения пользователя и полями отчёта.
+    :rtype: AsyncIterator[Row]
+    """
+    query = (select(User.tg_id, User.city.label("user_city"), User.connection_date, *REPORT_COLUMNS)
+             .outerjoin(WeatherReport, WeatherReport.owner == User.id)
+             .order_by(User.id, WeatherReport.date, WeatherReport.id)
+             .execution_options(yield_per=chunk_size))
+    async with Session() as session:
+        result = await session.stream(query)
+        async for row in result:
+            yield row
+
+
+async def get_report(tg_id: int, report_id: int) -> Optional[WeatherReport]:
+    """
+    Возвращает отчёт о погоде с указанным report_id, если он принадлежит пользователю с указанным tg_id.
+
+    :param tg_id: Идентификатор пользователя Telegram.
+    :type tg_id: int
+    :param report_id: Идентификатор отчёта о погоде.
+    :type report_id: int
+    :return: Отчёт о погоде или None, если отчёт не найден.
+    :rtype: Optional[WeatherReport]
+    """
+    async with Session() as session:
+        return await session.scalar(
+            select(WeatherReport).join(User, WeatherReport.owner == User.id)
+            .where(WeatherReport.id == report_id, User.tg_id == tg_id)
+        )
 
 
-def delete_user_report(report_id: int):
+async def delete_user_report(tg_id: int, report_id: int):
     """
-    Удаляет отчёт о погоде с указанным report_id.
+    Удаляет отчёт о погоде с указанным report_id, если он принадлежит пользователю с указанным tg_id.
 
-    Функция ищет отчёт о погоде с указанным report_id в базе данных.
-    Если отчёт найден, он удаляется из базы данных и изменения сохраняются.
-    Если отчёт не найден, функция не выполняет никаких действий.
+    Отчёт удаляется одним запросом DELETE ... RETURNING с условием на владельца, поэтому чужой отчёт
+    не удаляется, а счётчик отчётов владельца уменьшается, только если отчёт действительно был удалён.
+    Если отчёт не найден или принадлежит другому пользователю, функция не выполняет никаких действий.
 
+    :param tg_id: Идентификатор пользователя Telegram, удаляющего отчёт.
+    :type tg_id: int
     :param report_id: Идентификатор отчёта о погоде.
     :type report_id: int
     """
-    session = Session()
-    report = session.get(WeatherReport, report_id)
-    session.delete(report)
-    session.commit()
+    owner = select(User.id).where(User.tg_id == tg_id).limit(1).scalar_subquery()
+    async with Session() as session:
+        deleted = await session.scalar(
+            delete(WeatherReport).where(WeatherReport.id == report_id, WeatherReport.owner == owner)
+            .returning(WeatherReport.owner)
+        )
+        if deleted is not None:
+            await session.execute(
+                update(User).where(User.id == deleted).values(reports_count=User.reports_count - 1)
+            )
+            await session.commit()
 
 
-def get_all_users() -> list[Type[User]]:
+async def compact_reports(before: datetime, limit: int) -> int:
+    """
+    Сворачивает в дневные сводки и удаляет до limit отчётов о погоде, созданных раньше before.
+
+    Удаление отчётов, обновление сводок WeatherReportRollups и счётчиков отчётов пользователей выполняются
+    одним запросом в короткой транзакции, которая блокирует только удаляемые строки.
+    Строки, заблокированные другими транзакциями, пропускаются и сворачиваются при следующем вызове.
+
+    :param before: Отчёты, созданные раньше этого времени, сворачиваются.
+    :type before: datetime
+    :param limit: Максимальное количество отчётов, сворачиваемых за один вызов.
+    :type limit: int
+    :return: Количество свёрнутых отчётов.
+    :rtype: int
+    """
+    query = text("""
+        WITH batch AS (
+            DELETE FROM "WeatherReports" WHERE id IN (
+                SELECT id FROM "WeatherReports" WHERE date < :before ORDER BY id LIMIT :limit FOR UPDATE SKIP LOCKED
+            )
+            RETURNING owner, city, date, temp
+        ),
+        rollup AS (
+            INSERT INTO "WeatherReportRollups" AS r (owner, city, day, count, temp_min, temp_max, temp_sum)
+            SELECT owner, city, date::date, count(*), min(temp), max(temp), sum(temp)
+            FROM batch GROUP BY owner, city, date::date
+            ON CONFLICT (owner, city, day) DO UPDATE SET
+                count = r.count + excluded.count,
+                temp_min = least(r.temp_min, excluded.temp_min),
+                temp_max = greatest(r.temp_max, excluded.temp_max),
+                temp_sum = r.temp_sum + excluded.temp_sum
+        ),
+        counts AS (
+            UPDATE "Users" u SET reports_count = u.reports_count - c.count
+            FROM (SELECT owner, count(*) AS count FROM batch GROUP BY owner) c
+            WHERE u.id = c.owner
+        )
+        SELECT count(*) FROM batch
+    """)
+    async with Session() as session:
+        compacted = await session.scalar(query, {"before": before, "limit": limit})
+        await session.commit()
+    return compacted
+
+
+async def get_popular_cities(days: int, limit: int) -> dict[int, list[tuple[str, int]]]:
+    """
+    Возвращает самые запрашиваемые города для каждого часа суток.
+
+    Популярность города считается по количеству отчётов о погоде за последние days дней,
+    созданных в этот час суток.
+
+    :param days: Количество последних дней истории, по которым считается популярность.
+    :type days: int
+    :param limit: Максимальное количество городов для одного часа.
+    :type limit: int
+    :return: Словарь, в котором часу суток соответствует список пар (город, количество запросов),
+        упорядоченный по убыванию количества запросов.
+    :rtype: dict[int, list[tuple[str, int]]]
+    """
+    hour = cast(extract("hour", WeatherReport.date), Integer).label("hour")
+    counts = (select(hour, WeatherReport.city, func.count().label("count"))
+              .where(WeatherReport.date >= datetime.now() - timedelta(days=days))
+              .group_by(hour, WeatherReport.city)
+              .subquery())
+    rank = func.row_number().over(partition_by=counts.c.hour, order_by=counts.c.count.desc()).label("rank")
+    ranked = select(counts, rank).subquery()
+    query = (select(ranked.c.hour, ranked.c.city, ranked.c.count)
+             .where(ranked.c.rank <= limit)
+             .order_by(ranked.c.hour, ranked.c.rank))
+
+    async with Session() as session:
+        rows = await session.execute(query)
+        popular = {}
+        for row in rows:
+            popular.setdefault(row.hour, []).append((row.city, row.count))
+        return popular
+
+
+async def get_all_users() -> list[User]:
     """
     Возвращает список всех зарегистрированных пользователей.
 
     Функция запрашивает все записи о пользователях из базы данных и возвращает их в виде списка.
+    Отчёты пользователей загружаются тем же обращением к базе данных, а не при первом доступе к User.reports.
     Если нет зарегистрированных пользователей, функция возвращает пустой список.
 
     :return: Список объектов пользователей или пустой список, если пользователи не найдены.
     :rtype: list[User]
     """
-    session = Session()
-    users = session.query(User).all()
-    return users
+    async with Session() as session:
+        users = await session.scalars(select(User).options(selectinload(User.reports)).order_by(User.id))
+        return list(users)
+
+
+async def get_users_page(per_page: int, after: Optional[int] = None,
+                         before: Optional[int] = None) -> tuple[list[Row], int]:
+    """
+    Возвращает одну страницу списка пользователей для админ-панели и общее количество пользователей.
+
+    Для каждого пользователя возвращаются id, tg_id, connection_date и reports_count.
+    Количество отчётов берётся из счётчика User.reports_count, поэтому отчёты пользователей не загружаются.
+    Страница выбирается по идентификатору соседнего пользователя, а не через OFFSET.
+    Без after и before возвращается первая страница.
+
+    :param per_page: Количество пользователей на странице.
+    :type per_page: int
+    :param after: Идентификатор последнего пользователя предыдущей страницы.
+    :type after: Optional[int]
+    :param before: Идентификатор первого пользователя следующей страницы.
+    :type before: Optional[int]
+    :return: Строки с данными пользователей страницы и общее количество пользователей.
+    :rtype: tuple[list[Row], int]
+    """
+    query = select(User.id, User.tg_id, User.connection_date, User.reports_count).limit(per_page)
+    if before is not None:
+        query = query.where(User.id < before).order_by(User.id.desc())
+    else:
+        if after is not None:
+            query = query.where(User.id > after)
+        query = query.order_by(User.id)
+
+    async with Session() as session:
+        users = list(await session.execute(query))
+        total = await session.scalar(select(func.count(User.id)))
+    if before is not None:
+        users.reverse()
+    return users, total
+
+
+async def get_city_pos(name: str) -> Optional[str]:
+    """
+    Возвращает сохранённые координаты города.
+
+    :param name: Нормализованное название города.
+    :type name: str
+    :return: Координаты в формате "долгота широта" или None, если город ещё не сохранялся.
+    :rtype: Optional[str]
+    """
+    async with Session() as session:
+        return await session.scalar(select(CityCoord.pos).where(CityCoord.name == name))
+
+
+async def save_city_pos(name: str, pos: str):
+    """
+    Сохраняет координаты города в базу данных.
+
+    Если координаты города уже сохранены другим запросом, функция ничего не делает.
+
+    :param name: Нормализованное название города.
+    :type name: str
+    :param pos: Координаты в формате "долгота широта".
+    :type pos: str
+    """
+    async with Session() as session:
+        session.add(CityCoord(name=name, pos=pos))
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
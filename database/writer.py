@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from api_requests.cache import LRUCache
+from . import orm
+
+logger = logging.getLogger(__name__)
+
+
+class ReportWriter:
+    """
+    Фоновая запись отчётов о погоде в базу данных.
+
+    Отчёты складываются в ограниченную очередь в памяти и записываются пачками одним INSERT,
+    когда набирается batch_size отчётов или проходит flush_interval секунд с первого отчёта пачки.
+    Идентификаторы недавно активных пользователей по tg_id запоминаются, чтобы не искать их в базе
+    для каждого отчёта.
+    Если пачку записать не удалось, её отчёты записываются по одному, и отбрасываются только те,
+    которые не удалось записать.
+    """
+
+    def __init__(self, max_queue: int, batch_size: int, flush_interval: float, user_cache_size: int):
+        """
+        :param max_queue: Максимальное количество отчётов в очереди. При заполнении очереди put ждёт освобождения места.
+        :type max_queue: int
+        :param batch_size: Максимальное количество отчётов в одном INSERT.
+        :type batch_size: int
+        :param flush_interval: Максимальное время ожидания перед записью неполной пачки, секунды.
+        :type flush_interval: float
+        :param user_cache_size: Количество пользователей, идентификаторы которых хранятся в памяти.
+        :type user_cache_size: int
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.retried = 0
+        self._queue = asyncio.Queue(max_queue)
+        self._user_ids = LRUCache(user_cache_size)
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    async def put(self, tg_id: int, temp: int, feels_like: int, wind_speed: int, pressure_mm: int, city: str,
+                  lat: Optional[float] = None, lon: Optional[float] = None):
+        """
+        Ставит отчёт о погоде в очередь на запись.
+
+        Дата отчёта фиксируется в момент постановки в очередь.
+
+        :param tg_id: Идентификатор пользователя Telegram.
+        :type tg_id: int
+        :param temp: Температура в градусах Цельсия.
+        :type temp: int
+        :param feels_like: Ощущаемая температура в градусах Цельсия.
+        :type feels_like: int
+        :param wind_speed: Скорость ветра в м/с.
+        :type wind_speed: int
+        :param pressure_mm: Давление в мм рт. ст.
+        :type pressure_mm: int
+        :param city: Название города, для которого создаётся отчёт о погоде.
+        :type city: str
+        :param lat: Широта узла сетки, если погода запрошена по геопозиции.
+        :type lat: Optional[float]
+        :param lon: Долгота узла сетки, если погода запрошена по геопозиции.
+        :type lon: Optional[float]
+        """
+        await self._queue.put((tg_id, {"date": datetime.now(), "temp": temp, "feels_like": feels_like,
+                                       "wind_speed": wind_speed, "pressure_mm": pressure_mm, "city": city,
+                                       "lat": lat, "lon": lon}))
+
+    def start(self):
+        """
+        Запускает фоновую задачу записи отчётов.
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Останавливает фоновую задачу и записывает все отчёты, оставшиеся в очереди.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self._queue.empty():
+            await self._flush(self._take(self.batch_size))
+
+    def _take(self, limit: int) -> list:
+        """
+        Забирает из очереди до limit отчётов без ожидания.
+        """
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            try:
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                    batch.extend(self._take(self.batch_size - len(batch)))
+            finally:
+                # Пачка записывается и при остановке, чтобы уже забранные из очереди отчёты не потерялись
+                await asyncio.shield(self._flush(batch))
+
+    async def _flush(self, batch: list):
+        """
+        Записывает пачку отчётов одним INSERT.
+
+        Отчёты пользователей, которых нет в базе данных, отбрасываются.
+        Если INSERT пачки не удался, отчёты записываются по одному.
+        """
+        if not batch:
+            return
+        owners = {tg_id: self._user_ids.get(tg_id) for tg_id, _ in batch}
+        missing = {tg_id for tg_id, owner in owners.items() if owner is None}
+        try:
+            if missing:
+                found = await orm.get_user_ids(missing)
+                for tg_id, owner in found.items():
+                    self._user_ids.set(tg_id, owner)
+                owners.update(found)
+        except Exception:
+            self.dropped += len(batch)
+            logger.exception("Не удалось записать %d отчётов о погоде", len(batch))
+            return
+
+        reports = [{**report, "owner": owners[tg_id]} for tg_id, report in batch if owners[tg_id] is not None]
+        self.dropped += len(batch) - len(reports)
+        if not reports:
+            return
+        try:
+            await orm.create_reports(reports)
+        except Exception:
+            logger.exception("Не удалось записать пачку из %d отчётов о погоде, отчёты записываются по одному",
+                             len(reports))
+            self.retried += 1
+            await self._write_each(reports)
+            return
+        self.written += len(reports)
+        self.batches += 1
+
+    async def _write_each(self, reports: list[dict]):
+        """
+        Записывает отчёты по одному, отбрасывая только те, которые не удалось записать.
+        """
+        for report in reports:
+            try:
+                await orm.create_reports([report])
+            except Exception as e:
+                self.dropped += 1
+                logger.warning("Отброшен отчёт о погоде пользователя %s: %s", report["owner"], e)
+            else:
+                self.written += 1
+
+    def stats(self) -> dict:
+        """
+        Возвращает счётчики записи отчётов.
+
+        :return: Размер очереди, количество записанных и отброшенных отчётов, количество записанных пачек
+            и пачек, записанных по одному отчёту, и количество пользователей в памяти.
+        :rtype: dict
+        """
+        return {"queued": len(self), "written": self.written, "dropped": self.dropped, "batches": self.batches,
+                "retried": self.retried, "users_cached": len(self._user_ids)}
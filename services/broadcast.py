@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from api_requests import request
+from api_requests.errors import ApiError
+from api_requests.limiter import BACKGROUND
+from database import orm
+from settings import api_config
+from .sender import SendQueue
+
+logger = logging.getLogger(__name__)
+
+# Максимальное количество пропущенных минут, за которые рассылка выполняется после задержки;
+# при отставании больше чем на сутки одна и та же минута суток обрабатывалась бы дважды
+MAX_CATCH_UP = 1440
+
+
+def minute_of_day(hour: int, minute: int, offset: int) -> int:
+    """
+    Переводит местное время в минуту суток по UTC.
+
+    :param hour: Час по местному времени.
+    :type hour: int
+    :param minute: Минута по местному времени.
+    :type minute: int
+    :param offset: Смещение часового пояса от UTC, секунды.
+    :type offset: int
+    :return: Минута суток по UTC, от 0 до 1439.
+    :rtype: int
+    """
+    return (hour * 60 + minute - offset // 60) % 1440
+
+
+class DailyForecast:
+    """
+    Ежедневная рассылка прогноза погоды подписчикам.
+
+    Раз в минуту из базы данных порциями читаются подписчики, которым прогноз отправляется в эту минуту.
+    Если рассылка длится дольше минуты, следующие минуты обрабатываются по очереди после неё.
+    Подписчики упорядочены по городу, поэтому погода для каждого города запрашивается один раз,
+    сколько бы подписчиков в нём ни было. Сообщения отправляются через очередь исходящих сообщений
+    с приоритетом BACKGROUND, чтобы рассылка не задерживала ответы пользователям.
+    """
+
+    def __init__(self, sender: SendQueue, chunk_size: int, max_pending: int):
+        """
+        :param sender: Очередь исходящих сообщений бота.
+        :type sender: SendQueue
+        :param chunk_size: Количество подписчиков, читаемых из базы данных за одно обращение.
+        :type chunk_size: int
+        :param max_pending: Максимальное количество сообщений, ожидающих отправки в очереди.
+        :type max_pending: int
+        """
+        self.sender = sender
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self.sent = 0
+        self.cities = 0
+        self.failed_cities = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """
+        Запускает фоновую задачу рассылки.
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Останавливает фоновую задачу рассылки.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        last = int(time.time() // 60)  # последняя минута, рассылка за которую уже выполнена
+        while True:
+            now = int(time.time() // 60)
+            if now <= last:
+                # Сон до начала следующей минуты
+                await asyncio.sleep(60 - time.time() % 60)
+                continue
+            if now - last > MAX_CATCH_UP:
+                logger.warning("Рассылка прогноза пропущена за %d минут", now - last - MAX_CATCH_UP)
+                last = now - MAX_CATCH_UP
+            # Рассылка за популярную минуту может занять несколько минут, поэтому минуты, наступившие
+            # за это время, обрабатываются по очереди, а не пропускаются
+            minute = last + 1
+            try:
+                await self.send(minute % 1440)
+            except Exception:
+                logger.exception("Не удалось выполнить рассылку прогноза за минуту %d", minute % 1440)
+            last = minute
+
+    async def send(self, minute: int):
+        """
+        Отправляет прогноз погоды подписчикам, которым он отправляется в указанную минуту суток по UTC.
+
+        :param minute: Минута суток по UTC.
+        :type minute: int
+        """
+        city, text = None, None
+        after = None
+        while True:
+            # Порция подписчиков читается целиком, и соединение с базой данных освобождается до того,
+            # как начнутся запросы прогнозов и ожидание места в очереди отправки
+            subscribers = await orm.get_subscribers_page(minute, self.chunk_size, after)
+            for tg_id, user_city, _ in subscribers:
+                if user_city != city:
+                    city = user_city
+                    text = await self._forecast_text(city)
+                if text is None:
+                    continue
+                # Если очередь отправки переполнена, чтение подписчиков приостанавливается
+                while len(self.sender) >= self.max_pending:
+                    await asyncio.sleep(0.1)
+                self.sender.submit(tg_id, self.sender.bot.send_message, priority=BACKGROUND, chat_id=tg_id,
+                                   text=text)
+                self.sent += 1
+            if len(subscribers) < self.chunk_size:
+                break
+            after = subscribers[-1].city, subscribers[-1].id
+
+    async def _forecast_text(self, city: str) -> Optional[str]:
+        self.cities += 1
+        try:
+            pos = await request.get_city_coord(city, BACKGROUND)
+            forecast = await request.get_forecast(pos, BACKGROUND)
+        except ApiError as e:
+            self.failed_cities += 1
+            logger.warning("Не удалось получить погоду для рассылки в %s: %s", city, e)
+            return None
+        data = forecast.fact
+        text = f"Ежедневный прогноз\nПогода в {city}\nТемпература: {data.temp} C\nОщущается как: {data.feels_like} C\nСкорость ветра: {data.wind_speed} м/с\nДавление: {data.pressure_mm} мм"
+        # Прогноз на день есть в том же ответе API, что и текущая погода
+        today = forecast.day(0, time.time())
+        if today is not None:
+            text += f"\nСегодня: от {today.temp_min} до {today.temp_max} C, {today.condition_text}"
+        # Если сервис погоды недоступен, рассылается последний полученный прогноз с пометкой о его времени
+        note = forecast.stale_note(api_config.weather_cache_ttl, time.time())
+        if note:
+            text += f"\n\n{note}"
+        return text
+
+    def stats(self) -> dict:
+        """
+        Возвращает счётчики рассылки.
+
+        :return: Количество отправленных прогнозов, городов и городов, для которых не удалось получить погоду.
+        :rtype: dict
+        """
+        return {"sent": self.sent, "cities": self.cities, "failed_cities": self.failed_cities}
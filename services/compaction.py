@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import orm
+
+logger = logging.getLogger(__name__)
+
+
+class ReportCompactor:
+    """
+    Фоновое сворачивание старых отчётов о погоде в дневные сводки.
+
+    Раз в interval секунд отчёты старше retention_days дней сворачиваются в таблицу WeatherReportRollups
+    и удаляются. Отчёты обрабатываются пачками по batch_size строк в отдельных коротких транзакциях
+    с паузой pause секунд между пачками, поэтому сворачивание не держит долгих блокировок
+    и не мешает запросам пользователей. Размер таблицы отчётов определяется количеством запросов
+    за последние retention_days дней, а не за всё время работы бота.
+    """
+
+    def __init__(self, retention_days: int, batch_size: int, interval: float, pause: float):
+        """
+        :param retention_days: Сколько дней хранятся отчёты до сворачивания.
+        :type retention_days: int
+        :param batch_size: Количество отчётов, сворачиваемых в одной транзакции.
+        :type batch_size: int
+        :param interval: Интервал запуска сворачивания, секунды.
+        :type interval: float
+        :param pause: Пауза между пачками, секунды.
+        :type pause: float
+        """
+        self.retention = timedelta(days=retention_days)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pause = pause
+        self.compacted = 0
+        self.batches = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """
+        Запускает фоновую задачу сворачивания.
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Останавливает фоновую задачу сворачивания. Начатая пачка дописывается.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.compact()
+            except Exception:
+                logger.exception("Не удалось свернуть старые отчёты о погоде")
+            await asyncio.sleep(self.interval)
+
+    async def compact(self) -> int:
+        """
+        Сворачивает все отчёты старше срока хранения.
+
+        :return: Количество свёрнутых отчётов.
+        :rtype: int
+        """
+        before = datetime.now() - self.retention
+        total = 0
+        while True:
+            compacted = await asyncio.shield(orm.compact_reports(before, self.batch_size))
+            total += compacted
+            self.compacted += compacted
+            if compacted:
+                self.batches += 1
+            if compacted < self.batch_size:
+                return total
+            await asyncio.sleep(self.pause)
+
+    def stats(self) -> dict:
+        """
+        Возвращает счётчики сворачивания.
+
+        :return: Количество свёрнутых отчётов и пачек.
+        :rtype: dict
+        """
+        return {"compacted": self.compacted, "batches": self.batches}
@@ -0,0 +1,116 @@
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, BinaryIO
+
+from sqlalchemy import Row
+
+# Форматы выгрузки: название -> расширение файла
+FORMATS = {"csv": "csv", "jsonl": "jsonl.gz"}
+
+
+class _Encoder:
+    """
+    Текстовая обёртка над двоичным файлом для csv.writer: строки кодируются в UTF-8 по мере записи.
+    """
+
+    def __init__(self, target: BinaryIO):
+        self.target = target
+
+    def write(self, text: str):
+        self.target.write(text.encode("utf-8"))
+
+
+class Upload(io.RawIOBase):
+    """
+    Файл выгрузки для одной попытки отправки.
+
+    Читает файл выгрузки с начала и при закрытии не закрывает его. aiohttp закрывает отправленный файл,
+    поэтому для каждой попытки, в том числе для повтора после RetryAfter, создаётся новый Upload.
+    """
+
+    def __init__(self, file: BinaryIO):
+        """
+        :param file: Файл выгрузки.
+        :type file: BinaryIO
+        """
+        super().__init__()
+        self._file = file
+        file.seek(0)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+async def export_rows(rows: AsyncIterator[Row], fmt: str, spool_size: int) -> tuple[SpooledTemporaryFile, int]:
+    """
+    Записывает строки в файл выгрузки по мере их чтения из базы данных.
+
+    Файл хранится в памяти, пока его размер не превысит spool_size байт, а затем переносится на диск,
+    поэтому память процесса не зависит от размера выгрузки.
+    CSV записывается в UTF-8 с BOM, чтобы его правильно открывал Excel, JSON Lines - со сжатием gzip.
+
+    :param rows: Асинхронный итератор строк выгрузки.
+    :type rows: AsyncIterator[Row]
+    :param fmt: Формат выгрузки: "csv" или "jsonl".
+    :type fmt: str
+    :param spool_size: Максимальный размер файла в памяти, байты.
+    :type spool_size: int
+    :return: Файл выгрузки, открытый на чтение с начала, и количество записанных строк.
+    :rtype: tuple[SpooledTemporaryFile, int]
+    """
+    spool = SpooledTemporaryFile(max_size=spool_size)
+    count = 0
+    try:
+        if fmt == "csv":
+            writer = None
+            encoder = _Encoder(spool)
+            encoder.write("\ufeff")
+            async for row in rows:
+                if writer is None:
+                    writer = csv.writer(encoder)
+                    writer.writerow(row._fields)
+                writer.writerow(row)
+                count += 1
+        else:
+            with gzip.GzipFile(fileobj=spool, mode="wb") as archive:
+                async for row in rows:
+                    line = json.dumps({key: _json_value(value) for key, value in row._mapping.items()},
+                                      ensure_ascii=False)
+                    archive.write(line.encode("utf-8") + b"\n")
+                    count += 1
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, count
+
+
+def file_size(file: SpooledTemporaryFile) -> int:
+    """
+    Возвращает размер файла выгрузки.
+
+    :param file: Файл выгрузки.
+    :type file: SpooledTemporaryFile
+    :return: Размер файла, байты.
+    :rtype: int
+    """
+    position = file.tell()
+    file.seek(0, 2)
+    size = file.tell()
+    file.seek(position)
+    return size
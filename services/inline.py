@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from aiogram import types
+
+from api_requests import request
+from api_requests.errors import ApiError
+from api_requests.forecast import Forecast
+from api_requests.gazetteer import Place
+
+logger = logging.getLogger(__name__)
+
+
+class InlineSearch:
+    """
+    Ответы на встроенные запросы (@бот Моск…) со списком подходящих городов и текущей погодой в каждом.
+
+    Telegram отправляет встроенный запрос при каждом нажатии клавиши, поэтому запрос пользователя
+    обрабатывается только через debounce секунд после получения: если за это время пришёл следующий запрос
+    того же пользователя, предыдущий отменяется и остаётся без ответа - Telegram показывает результаты
+    только последнего. Города ищутся по началу названия в справочнике населённых пунктов, погода берётся
+    из кэша прогнозов, а запрашивается у API только для первых max_fetch городов, которых нет в кэше.
+    В ответе указывается cache_time: Telegram повторно использует результаты для того же текста запроса,
+    пока не устареет показанная в них погода.
+    """
+
+    def __init__(self, render: Callable[[str, Forecast], str], debounce: float, max_results: int, max_fetch: int,
+                 cache_time: int):
+        """
+        :param render: Функция, формирующая текст сообщения с погодой в городе по его прогнозу.
+        :type render: Callable[[str, Forecast], str]
+        :param debounce: Время ожидания следующего запроса пользователя перед поиском, секунды.
+        :type debounce: float
+        :param max_results: Максимальное количество городов в ответе.
+        :type max_results: int
+        :param max_fetch: Максимальное количество прогнозов, запрашиваемых у API для одного ответа.
+        :type max_fetch: int
+        :param cache_time: Максимальное время хранения результатов на серверах Telegram, секунды.
+        :type cache_time: int
+        """
+        self.render = render
+        self.debounce = debounce
+        self.max_results = max_results
+        self.max_fetch = max_fetch
+        self.cache_time = cache_time
+        self.queries = 0
+        self.superseded = 0
+        self.answered = 0
+        self.fetched = 0
+        self._pending = {}  # пользователь -> задача обработки его последнего запроса
+
+    async def answer(self, query: types.InlineQuery):
+        """
+        Отвечает на встроенный запрос, если за время ожидания не пришёл следующий запрос того же пользователя.
+
+        :param query: Встроенный запрос.
+        :type query: types.InlineQuery
+        """
+        self.queries += 1
+        user_id = query.from_user.id
+        previous = self._pending.get(user_id)
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.create_task(self._answer(query))
+        self._pending[user_id] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            self.superseded += 1
+        finally:
+            if self._pending.get(user_id) is task:
+                del self._pending[user_id]
+
+    async def _answer(self, query: types.InlineQuery):
+        await asyncio.sleep(self.debounce)
+        places = request.gazetteer.prefix(query.query, self.max_results) if query.query.strip() else []
+        if not places and query.query.strip():
+            places = [place for place, _ in request.gazetteer.search(query.query, self.max_results)]
+
+        forecasts = await self._forecasts(places)
+        results = []
+        cache_time = self.cache_time
+        for place, forecast in zip(places, forecasts):
+            if forecast is None:
+                continue
+            data = forecast.fact
+            results.append(types.InlineQueryResultArticle(
+                id=place.pos, title=place.name, description=f"{data.temp} C, {data.condition_text}",
+                input_message_content=types.InputTextMessageContent(self.render(place.name, forecast))))
+            # Результаты не должны храниться дольше, чем показанная в них погода остаётся актуальной
+            cache_time = min(cache_time, int(request.weather_cache.expires_in(place.pos)))
+        await query.answer(results, cache_time=max(cache_time, 0), is_personal=False)
+        self.answered += 1
+
+    async def _forecasts(self, places: list[Place]) -> list[Optional[Forecast]]:
+        """
+        Возвращает прогнозы для городов: из кэша, а для первых max_fetch городов, которых нет в кэше, - из API.
+
+        Если запрос отменён следующим, уже начатые запросы к API не отменяются и сохраняют прогнозы в кэш,
+        откуда их возьмёт ответ на следующий запрос.
+        """
+        forecasts = [request.weather_cache.get(place.pos) for place in places]
+        missing = [index for index, forecast in enumerate(forecasts) if forecast is None][:self.max_fetch]
+
+        async def fetch(place: Place) -> Optional[Forecast]:
+            try:
+                forecast = await request.get_forecast(place.pos)
+            except ApiError as e:
+                logger.warning("Не удалось получить погоду для встроенного запроса в %s: %s", place.name, e)
+                return None
+            self.fetched += 1
+            return forecast
+
+        for index, forecast in zip(missing, await asyncio.gather(*(fetch(places[index]) for index in missing))):
+            forecasts[index] = forecast
+        return forecasts
+
+    def stats(self) -> dict:
+        """
+        Возвращает счётчики встроенных запросов.
+
+        :return: Количество полученных запросов, запросов, отменённых следующими, ответов
+            и прогнозов, запрошенных у API.
+        :rtype: dict
+        """
+        return {"queries": self.queries, "superseded": self.superseded, "answered": self.answered,
+                "fetched": self.fetched, "pending": len(self._pending)}
@@ -0,0 +1,412 @@
+import bisect
+import logging
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Callable, Optional, Union
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм времени выполнения по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """
+    Базовый класс метрики в текстовом формате Prometheus.
+
+    Подклассы возвращают строки значений метрики из samples().
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        """
+        :param name: Имя метрики.
+        :type name: str
+        :param documentation: Описание метрики.
+        :type documentation: str
+        :param labelnames: Имена меток метрики.
+        :type labelnames: tuple
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self) -> list[str]:
+        """
+        Возвращает строки значений метрики без описания и типа.
+
+        :return: Строки значений в текстовом формате Prometheus.
+        :rtype: list[str]
+        """
+
+    def render(self) -> str:
+        """
+        Возвращает метрику в текстовом формате Prometheus.
+
+        :return: Описание, тип и значения метрики.
+        :rtype: str
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self.samples()]
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """
+    Счётчик, значение которого только увеличивается.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        """
+        Увеличивает значение счётчика.
+
+        :param labels: Значения меток в порядке labelnames.
+        :param amount: Величина увеличения.
+        :type amount: float
+        """
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+                for labels, value in self._values.items()]
+
+
+class Histogram(Metric):
+    """
+    Гистограмма распределения значений, например времени выполнения.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        """
+        :param name: Имя метрики.
+        :type name: str
+        :param documentation: Описание метрики.
+        :type documentation: str
+        :param labelnames: Имена меток метрики.
+        :type labelnames: tuple
+        :param buckets: Верхние границы корзин гистограммы по возрастанию.
+        :type buckets: tuple
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # метки -> [количества по корзинам, сумма, количество]
+
+    def observe(self, value: float, *labels):
+        """
+        Добавляет значение в гистограмму.
+
+        :param value: Наблюдаемое значение.
+        :type value: float
+        :param labels: Значения меток в порядке labelnames.
+        """
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        """
+        Измеряет время выполнения блока with и добавляет его в гистограмму.
+
+        :param labels: Значения меток в порядке labelnames.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        inf = 'le="+Inf"'
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, inf)} {count}')
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Collected(Metric):
+    """
+    Метрика, значения которой вычисляются функцией в момент запроса метрик.
+
+    Используется для значений, которые уже считаются в других местах: размеров очередей, счётчиков кэшей и т. д.
+    """
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], Union[float, dict]],
+                 labelnames: tuple = (), type: str = "gauge"):
+        """
+        :param name: Имя метрики.
+        :type name: str
+        :param documentation: Описание метрики.
+        :type documentation: str
+        :param func: Функция, возвращающая значение метрики или словарь {значения меток: значение}.
+        :type func: Callable[[], Union[float, dict]]
+        :param labelnames: Имена меток метрики.
+        :type labelnames: tuple
+        :param type: Тип метрики: "gauge" или "counter".
+        :type type: str
+        """
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+        self.type = type
+
+    def samples(self) -> list[str]:
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values.items()]
+
+
+class Registry:
+    """
+    Набор метрик, отдаваемых по запросу /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Добавляет метрику в набор. Метрика с тем же именем заменяется.
+
+        :param metric: Метрика.
+        :type metric: Metric
+        :return: Добавленная метрика.
+        :rtype: Metric
+        """
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Возвращает все метрики в текстовом формате Prometheus.
+
+        Если значение одной из метрик не удалось вычислить, она пропускается.
+
+        :return: Текст ответа на запрос /metrics.
+        :rtype: str
+        """
+        parts = []
+        for metric in self._metrics.values():
+            try:
+                parts.append(metric.render())
+            except Exception:
+                logger.exception("Не удалось вычислить метрику %s", metric.name)
+        return "".join(parts)
+
+
+registry = Registry()
+
+handler_latency = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Время выполнения обработчиков сообщений, callback-запросов и встроенных запросов",
+    ("handler",)))
+updates_total = registry.register(Counter(
+    "bot_updates_total", "Количество полученных обновлений Telegram", ("type",)))
+update_lag = registry.register(Histogram(
+    "bot_update_lag_seconds", "Задержка между отправкой сообщения пользователем и началом его обработки",
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 300)))
+api_latency = registry.register(Histogram(
+    "yandex_api_request_duration_seconds", "Время выполнения запросов к API Яндекса", ("endpoint",)))
+api_errors = registry.register(Counter(
+    "yandex_api_errors_total", "Количество неудачных запросов к API Яндекса", ("endpoint", "error")))
+db_latency = registry.register(Histogram(
+    "db_query_duration_seconds", "Время выполнения SQL-запросов", ("statement",)))
+
+
+def handler_label(handler: Any) -> str:
+    """
+    Возвращает метку обработчика для метрик: имя функции и номер строки, на которой она объявлена.
+
+    Номер строки различает обработчики с одинаковыми именами.
+
+    :param handler: Функция-обработчик.
+    :type handler: Any
+    :return: Метка вида "имя:строка" или "unknown", если обработчик неизвестен.
+    :rtype: str
+    """
+    if handler is None:
+        return "unknown"
+    name = getattr(handler, "__qualname__", None) or getattr(handler, "__name__", "unknown")
+    code = getattr(handler, "__code__", None)
+    return f"{name}:{code.co_firstlineno}" if code is not None else name
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Middleware диспетчера, измеряющее время работы обработчиков и задержку обработки обновлений.
+    """
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        update_type = next((key for key in update.values if key != "update_id"), "other")
+        updates_total.inc(update_type)
+        message = update.message or update.edited_message
+        if message is not None and message.date is not None:
+            update_lag.observe(max(time.time() - message.date.timestamp(), 0.0))
+
+    async def _start(self, data: dict):
+        handler = current_handler.get(None)
+        data["_metrics_handler"] = handler_label(handler)
+        data["_metrics_start"] = time.perf_counter()
+
+    async def _finish(self, data: dict):
+        start = data.pop("_metrics_start", None)
+        if start is not None:
+            handler_latency.observe(time.perf_counter() - start, data.pop("_metrics_handler"))
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        await self._start(data)
+
+    async def on_post_process_message(self, message: types.Message, results: list, data: dict):
+        await self._finish(data)
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        await self._start(data)
+
+    async def on_post_process_callback_query(self, call: types.CallbackQuery, results: list, data: dict):
+        await self._finish(data)
+
+    async def on_process_inline_query(self, query: types.InlineQuery, data: dict):
+        await self._start(data)
+
+    async def on_post_process_inline_query(self, query: types.InlineQuery, results: list, data: dict):
+        await self._finish(data)
+
+
+def instrument_engine(engine: AsyncEngine):
+    """
+    Подключает к движку базы данных измерение времени выполнения SQL-запросов и метрики пула соединений.
+
+    :param engine: Движок базы данных.
+    :type engine: AsyncEngine
+    """
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        db_latency.observe(time.perf_counter() - start, statement.lstrip().split(None, 1)[0].upper())
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        # Запрос завершился ошибкой, и after_cursor_execute для него не будет вызван
+        if context.connection is not None and context.connection.info.get("query_start"):
+            context.connection.info["query_start"].pop()
+
+    pool = sync_engine.pool
+
+    def pool_stats() -> dict:
+        if not hasattr(pool, "checkedout"):
+            return {}
+        return {("size",): pool.size(), ("checked_out",): pool.checkedout(), ("overflow",): pool.overflow()}
+
+    registry.register(Collected("db_pool_connections", "Соединения пула базы данных", pool_stats, ("state",)))
+
+
+def collect_stats(name: str, documentation: str, func: Callable[[], dict], labelname: str = "counter"):
+    """
+    Регистрирует метрику из словаря счётчиков, который возвращает метод stats() одного из компонентов бота.
+
+    Каждый числовой счётчик словаря становится отдельным значением метрики с меткой labelname.
+
+    :param name: Имя метрики.
+    :type name: str
+    :param documentation: Описание метрики.
+    :type documentation: str
+    :param func: Функция, возвращающая словарь счётчиков.
+    :type func: Callable[[], dict]
+    :param labelname: Имя метки, в которую записывается название счётчика.
+    :type labelname: str
+    """
+    def values() -> dict:
+        return {(key,): value for key, value in func().items() if isinstance(value, (int, float))}
+
+    registry.register(Collected(name, documentation, values, (labelname,)))
+
+
+def cache_hit_ratio(stats: dict) -> float:
+    """
+    Возвращает долю попаданий в кэш.
+
+    :param stats: Счётчики кэша с ключами "hits" и "misses".
+    :type stats: dict
+    :return: Доля попаданий от 0 до 1 или 0, если к кэшу ещё не обращались.
+    :rtype: float
+    """
+    total = stats["hits"] + stats["misses"]
+    return stats["hits"] / total if total else 0.0
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int, path: str = "/metrics") -> Optional[web.AppRunner]:
+    """
+    Запускает HTTP-сервер, отдающий метрики по пути path.
+
+    :param host: Адрес, на котором слушает сервер.
+    :type host: str
+    :param port: Порт сервера. Если 0, сервер не запускается.
+    :type port: int
+    :param path: Путь, по которому отдаются метрики.
+    :type path: str
+    :return: Запущенный сервер или None.
+    :rtype: Optional[web.AppRunner]
+    """
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get(path, handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
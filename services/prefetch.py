@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from api_requests import request
+from api_requests.errors import CircuitOpen, QuotaExceeded
+from api_requests.limiter import BACKGROUND
+from database import orm
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Заблаговременное обновление кэша прогнозов для популярных городов.
+
+    По истории запросов (таблица WeatherReports) для каждого часа суток определяются top_k самых
+    запрашиваемых городов. Начиная за lead секунд до начала часа и до его конца прогнозы для этих городов
+    обновляются раз в interval секунд, поэтому запросы пользователей обслуживаются из кэша.
+    На прогрев расходуется не больше budget_share доступной фоновым задачам дневной квоты API,
+    и она распределяется между часами пропорционально количеству запросов пользователей в них.
+    """
+
+    def __init__(self, top_k: int, lead: float, interval: float, history_days: int, budget_share: float):
+        """
+        :param top_k: Количество популярных городов одного часа.
+        :type top_k: int
+        :param lead: За сколько секунд до начала часа начинается обновление прогнозов его популярных городов.
+        :type lead: float
+        :param interval: Интервал обновления прогнозов, секунды. Должен быть меньше времени жизни прогноза в кэше.
+        :type interval: float
+        :param history_days: Количество последних дней истории, по которым определяются популярные города.
+        :type history_days: int
+        :param budget_share: Доля доступной фоновым задачам дневной квоты, расходуемая на прогрев.
+        :type budget_share: float
+        """
+        self.top_k = top_k
+        self.lead = lead
+        self.interval = interval
+        self.history_days = history_days
+        self.budget_share = budget_share
+        self.refreshed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.used_today = 0
+        self._day: Optional[date] = None
+        self._popular = {}
+        self._credit = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """
+        Запускает фоновую задачу прогрева кэша.
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Останавливает фоновую задачу прогрева кэша.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Не удалось обновить прогнозы популярных городов")
+            await asyncio.sleep(self.interval)
+
+    def budget_today(self) -> int:
+        """
+        Возвращает количество запросов к API, доступных прогреву в этом процессе в течение суток.
+
+        Бюджет считается от доли квоты процесса (квота ограничителя уже поделена между api_config.api_processes
+        процессами), поэтому прогрев во всех процессах вместе расходует не больше budget_share общей квоты.
+
+        :return: Дневной бюджет прогрева.
+        :rtype: int
+        """
+        limiter = request.weather_limiter
+        return int(limiter.daily_quota * (1 - limiter.reserve) * self.budget_share)
+
+    async def _check_day(self):
+        """
+        Раз в сутки сбрасывает расход бюджета и заново определяет популярные города по истории запросов.
+        """
+        today = date.today()
+        if today != self._day:
+            self._popular = await orm.get_popular_cities(self.history_days, self.top_k)
+            self._day = today
+            self.used_today = 0
+            self._credit = 0.0
+
+    async def tick(self):
+        """
+        Обновляет прогнозы популярных городов ближайшего часа, которые устареют до следующего обновления.
+        """
+        await self._check_day()
+        hour = (datetime.now() + timedelta(seconds=self.lead)).hour
+        cities = self._popular.get(hour)
+        if not cities:
+            return
+
+        # Остаток бюджета делится между оставшимися часами суток пропорционально запросам пользователей в них
+        demand = {h: sum(count for _, count in top) for h, top in self._popular.items()}
+        remaining_demand = sum(count for h, count in demand.items() if h >= hour)
+        budget = min(self.budget_today() - self.used_today, request.weather_limiter.remaining_today(BACKGROUND))
+        if budget <= 0 or not remaining_demand:
+            return
+        ticks_per_hour = 3600 / self.interval
+        self._credit = min(self._credit + budget * demand[hour] / remaining_demand / ticks_per_hour, len(cities))
+
+        for city, _ in cities:
+            if self._credit < 1:
+                break
+            try:
+                pos = await request.get_city_coord(city, BACKGROUND)
+                if request.weather_cache.expires_in(pos) > self.interval:
+                    # Прогноз доживёт до следующего обновления, запрос к API не нужен
+                    self.skipped += 1
+                    continue
+                self._credit -= 1
+                self.used_today += 1
+                await request.refresh_forecast(pos)
+            except (QuotaExceeded, CircuitOpen):
+                break
+            except Exception as e:
+                self.failed += 1
+                logger.warning("Не удалось обновить прогноз для %s: %s", city, e)
+            else:
+                self.refreshed += 1
+
+    def stats(self) -> dict:
+        """
+        Возвращает счётчики прогрева кэша.
+
+        :return: Количество обновлённых, пропущенных и необновлённых из-за ошибки прогнозов и расход бюджета.
+        :rtype: dict
+        """
+        return {"refreshed": self.refreshed, "skipped": self.skipped, "failed": self.failed,
+                "used_today": self.used_today, "budget_today": self.budget_today()}
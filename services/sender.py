@@ -0,0 +1,302 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import Bot, types
+from aiogram.utils.exceptions import RetryAfter
+
+from api_requests.limiter import BACKGROUND, INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "method", "kwargs", "future", "key", "retries")
+
+    def __init__(self, priority: int, seq: int, method: Callable[..., Awaitable[Any]], kwargs: dict,
+                 future: asyncio.Future, key: Optional[tuple]):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+        self.key = key
+        self.retries = 0
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _log_failure(future: asyncio.Future):
+    """
+    Записывает в лог ошибку отправки, чтобы она не терялась, если результат отправки никто не ждёт.
+    """
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Не удалось отправить сообщение: %s", future.exception())
+
+
+class SendQueue:
+    """
+    Очередь исходящих сообщений бота с соблюдением ограничений Telegram.
+
+    Сообщения отправляются не чаще global_rate в секунду в сумме и не чаще одного раза в chat_interval секунд
+    в один чат. Сообщения с приоритетом INTERACTIVE (ответы пользователям) отправляются раньше сообщений
+    с приоритетом BACKGROUND (рассылок). Если Telegram отвечает RetryAfter, отправка приостанавливается
+    на указанное время, и сообщение отправляется повторно. Несколько ожидающих изменений одного и того же
+    сообщения объединяются в одно - отправляется только последнее, с наивысшим из их приоритетов.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float, chat_interval: float, max_retries: int, processes: int = 1):
+        """
+        :param bot: Бот, через который отправляются сообщения.
+        :type bot: Bot
+        :param global_rate: Максимальное количество сообщений в секунду от всех процессов бота.
+        :type global_rate: float
+        :param chat_interval: Минимальный интервал между сообщениями в один чат, секунды.
+        :type chat_interval: float
+        :param max_retries: Максимальное количество повторных отправок сообщения после RetryAfter.
+        :type max_retries: int
+        :param processes: Количество процессов бота с одним токеном; каждый отправляет не больше своей доли global_rate.
+        :type processes: int
+        """
+        self.bot = bot
+        # Ограничение Telegram общее для токена, поэтому процессы бота делят его поровну
+        self.global_rate = global_rate / max(processes, 1)
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.merged = 0
+        self._counter = itertools.count()
+        self._jobs = {}  # чат -> куча ожидающих сообщений чата
+        self._state = {}  # чат -> "ready" или "cooling", если у чата есть ожидающие сообщения
+        self._ready = []  # куча чатов, которым можно отправлять: (приоритет, порядковый номер, чат)
+        self._cooling = []  # куча чатов, ожидающих окончания интервала: (время, чат)
+        self._next_allowed = {}  # чат -> время, раньше которого в чат нельзя отправлять
+        self._global_next = 0.0
+        self._edits = {}  # (чат, сообщение) -> ожидающее изменение сообщения
+        self._wakeup = asyncio.Event()
+        self._running = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return sum(len(jobs) for jobs in self._jobs.values())
+
+    def start(self):
+        """
+        Запускает фоновую задачу отправки сообщений.
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        """
+        Ждёт отправки ожидающих сообщений, но не дольше timeout секунд, и останавливает фоновую задачу.
+
+        :param timeout: Максимальное время ожидания, секунды.
+        :type timeout: float
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self._jobs or self._running) and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def submit(self, chat_id: int, method: Callable[..., Awaitable[Any]], /, priority: int = BACKGROUND,
+               key: Optional[tuple] = None, **kwargs) -> asyncio.Future:
+        """
+        Ставит вызов метода Bot API в очередь отправки.
+
+        :param chat_id: Чат, в который отправляется сообщение.
+        :type chat_id: int
+        :param method: Метод бота, например bot.send_message.
+        :type method: Callable[..., Awaitable[Any]]
+        :param priority: Приоритет отправки: INTERACTIVE или BACKGROUND.
+        :type priority: int
+        :param key: Ключ для объединения повторных вызовов: ожидающий вызов с тем же ключом заменяется новым.
+        :type key: Optional[tuple]
+        :param kwargs: Аргументы метода.
+        :return: Future с результатом вызова метода.
+        :rtype: asyncio.Future
+        """
+        if key is not None and key in self._edits:
+            job = self._edits[key]
+            job.kwargs = kwargs
+            self.merged += 1
+            if priority < job.priority:
+                # Объединённое изменение отправляется с наивысшим приоритетом из объединённых
+                job.priority = priority
+                jobs = self._jobs[chat_id]
+                heapq.heapify(jobs)
+                if self._state.get(chat_id) == "ready":
+                    heapq.heappush(self._ready, (jobs[0].priority, jobs[0].seq, chat_id))
+            return job.future
+
+        job = _Job(priority, next(self._counter), method, kwargs, asyncio.get_running_loop().create_future(), key)
+        job.future.add_done_callback(_log_failure)
+        if key is not None:
+            self._edits[key] = job
+        self._push(chat_id, job)
+        return job.future
+
+    def _push(self, chat_id: int, job: _Job):
+        heapq.heappush(self._jobs.setdefault(chat_id, []), job)
+        now = asyncio.get_running_loop().time()
+        state = self._state.get(chat_id)
+        if state is None:
+            not_before = self._next_allowed.get(chat_id, 0.0)
+            if not_before > now:
+                self._state[chat_id] = "cooling"
+                heapq.heappush(self._cooling, (not_before, chat_id))
+            else:
+                self._state[chat_id] = "ready"
+                heapq.heappush(self._ready, (job.priority, job.seq, chat_id))
+        elif state == "ready":
+            # Сообщение с более высоким приоритетом поднимает чат в очереди; лишние записи отбрасываются в _run
+            heapq.heappush(self._ready, (job.priority, job.seq, chat_id))
+        self._wakeup.set()
+
+    async def send_message(self, chat_id: int, text: str, priority: int = INTERACTIVE, **kwargs) -> types.Message:
+        """
+        Отправляет сообщение через очередь и ждёт результата.
+
+        :param chat_id: Чат, в который отправляется сообщение.
+        :type chat_id: int
+        :param text: Текст сообщения.
+        :type text: str
+        :param priority: Приоритет отправки: INTERACTIVE или BACKGROUND.
+        :type priority: int
+        :return: Отправленное сообщение.
+        :rtype: types.Message
+        """
+        return await self.submit(chat_id, self.bot.send_message, priority=priority, chat_id=chat_id, text=text,
+                                 **kwargs)
+
+    async def answer(self, message: types.Message, text: str, **kwargs) -> types.Message:
+        """
+        Отвечает на сообщение пользователя через очередь с приоритетом INTERACTIVE.
+
+        :param message: Сообщение, на которое отправляется ответ.
+        :type message: types.Message
+        :param text: Текст ответа.
+        :type text: str
+        :return: Отправленное сообщение.
+        :rtype: types.Message
+        """
+        return await self.send_message(message.chat.id, text, INTERACTIVE, **kwargs)
+
+    async def edit_text(self, message: types.Message, text: str, priority: int = INTERACTIVE, **kwargs):
+        """
+        Изменяет текст сообщения через очередь.
+
+        Если предыдущее изменение этого сообщения ещё не отправлено, оно заменяется новым.
+
+        :param message: Изменяемое сообщение.
+        :type message: types.Message
+        :param text: Новый текст сообщения.
+        :type text: str
+        :param priority: Приоритет отправки: INTERACTIVE или BACKGROUND.
+        :type priority: int
+        """
+        chat_id, message_id = message.chat.id, message.message_id
+        return await self.submit(chat_id, self.bot.edit_message_text, priority=priority, key=(chat_id, message_id),
+                                 text=text, chat_id=chat_id, message_id=message_id, **kwargs)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._cooling and self._cooling[0][0] <= now:
+                _, chat_id = heapq.heappop(self._cooling)
+                if self._state.get(chat_id) == "cooling":
+                    self._state[chat_id] = "ready"
+                    job = self._jobs[chat_id][0]
+                    heapq.heappush(self._ready, (job.priority, job.seq, chat_id))
+
+            # Отбрасываем записи чатов, которые уже отправили сообщение или ждут окончания интервала
+            while self._ready and self._state.get(self._ready[0][2]) != "ready":
+                heapq.heappop(self._ready)
+
+            if not self._ready:
+                timeout = self._cooling[0][0] - now if self._cooling else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if now < self._global_next:
+                await asyncio.sleep(self._global_next - now)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            jobs = self._jobs[chat_id]
+            job = heapq.heappop(jobs)
+            self._global_next = max(now, self._global_next) + 1 / self.global_rate
+            self._next_allowed[chat_id] = now + self.chat_interval
+            if jobs:
+                self._state[chat_id] = "cooling"
+                heapq.heappush(self._cooling, (now + self.chat_interval, chat_id))
+            else:
+                del self._state[chat_id]
+                del self._jobs[chat_id]
+            self._forget_expired(now)
+
+            if job.key is not None:
+                self._edits.pop(job.key, None)
+            task = asyncio.create_task(self._execute(chat_id, job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    def _forget_expired(self, now: float):
+        """
+        Удаляет устаревшие времена последней отправки, чтобы словарь не рос с количеством чатов.
+        """
+        if len(self._next_allowed) > 10000:
+            self._next_allowed = {chat: t for chat, t in self._next_allowed.items() if t > now}
+
+    async def _execute(self, chat_id: int, job: _Job):
+        try:
+            result = await job.method(**job.kwargs)
+        except RetryAfter as e:
+            loop = asyncio.get_running_loop()
+            # Telegram просит паузу: приостанавливаем все отправки и повторяем сообщение позже
+            self._global_next = max(self._global_next, loop.time() + e.timeout)
+            self._next_allowed[chat_id] = loop.time() + e.timeout
+            if job.retries < self.max_retries:
+                job.retries += 1
+                self.retried += 1
+                # Изменения, пришедшие во время паузы, объединяются с повторяемым, а не отправляются отдельно
+                if job.key is not None:
+                    self._edits.setdefault(job.key, job)
+                self._push(chat_id, job)
+            else:
+                self.failed += 1
+                job.future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def stats(self) -> dict:
+        """
+        Возвращает счётчики очереди отправки.
+
+        :return: Количество ожидающих, отправленных, неотправленных, повторно отправленных и объединённых сообщений.
+        :rtype: dict
+        """
+        return {"queued": len(self), "sent": self.sent, "failed": self.failed, "retried": self.retried,
+                "merged": self.merged}
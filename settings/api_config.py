@@ -1,2 +1,37 @@
 geo_key = ""  # тут нужно вписать "JavaScript API и HTTP Геокодер"
 weather_key = {"X-Yandex-API-Key": ""}  # тут нужно вписать в качестве значения "API Яндекс.Погоды"
+geo_url = "https://geocode-maps.yandex.ru/1.x"  # адрес геокодера
+weather_url = "https://api.weather.yandex.ru/v2/forecast"  # адрес API Яндекс.Погоды
+replay_mode = ""  # "record" - записывать ответы API Яндекса в replay_path, "replay" - отвечать из replay_path без API
+replay_path = "yandex_api.jsonl.gz"  # файл записанных ответов API Яндекса
+replay_latency = "recorded"  # задержка воспроизведения: "recorded" - как при записи, "zero" - без задержки
+gazetteer_source = "api_requests/cities.tsv"  # справочник населённых пунктов, координаты которых известны без геокодера
+gazetteer_path = "gazetteer.idx"  # файл индекса справочника; строится из gazetteer_source при запуске
+gazetteer_min_similarity = 0.3  # минимальная доля общих триграмм, при которой название предлагается как исправление
+connect_timeout = 3  # таймаут подключения к API Яндекса, секунды
+read_timeout = 10  # таймаут чтения ответа API Яндекса, секунды
+request_timeout = 15  # максимальное время запроса к API Яндекса целиком, секунды
+breaker_window = 20  # количество последних запросов к API, по которым предохранитель считает долю ошибок
+breaker_min_calls = 10  # минимальное количество запросов в окне, при котором предохранитель может разомкнуться
+breaker_failure_rate = 0.5  # доля ошибок API, при которой запросы к нему приостанавливаются
+breaker_open_time = 30  # время, на которое приостанавливаются запросы к API после ошибок, секунды
+breaker_probes = 3  # количество успешных пробных запросов, после которых запросы к API возобновляются
+stale_cache_size = 20000  # количество точек, последний прогноз для которых показывается при недоступности API
+pool_size = 100  # максимальное количество одновременных соединений с API Яндекса
+keepalive_timeout = 30  # время жизни неиспользуемого keep-alive соединения, секунды
+location_grid = 0.05  # шаг сетки, к узлам которой привязываются присланные геопозиции, градусы
+geo_cache_size = 10000  # количество городов, координаты которых хранятся в памяти
+weather_cache_size = 5000  # количество точек, прогноз для которых хранится в памяти
+weather_cache_ttl = 300  # время, в течение которого прогноз считается актуальным, секунды
+geo_rate = 10  # максимальное количество запросов к геокодеру в секунду
+geo_daily_quota = 1000  # дневная квота запросов к геокодеру
+weather_rate = 10  # максимальное количество запросов к API Яндекс.Погоды в секунду
+weather_daily_quota = 50  # дневная квота запросов к API Яндекс.Погоды
+api_processes = 1  # количество процессов бота, между которыми поровну делятся квоты и частота запросов к API Яндекса
+limiter_queue_size = 100  # максимальное количество запросов к API, ожидающих своей очереди
+interactive_reserve = 0.2  # доля дневной квоты, которую фоновые задачи оставляют для запросов пользователей
+prefetch_top_k = 20  # количество самых популярных городов часа, прогноз для которых обновляется заранее
+prefetch_lead = 300  # за сколько секунд до начала часа начинается обновление прогнозов его популярных городов
+prefetch_interval = 240  # интервал обновления прогнозов популярных городов, секунды; меньше weather_cache_ttl
+prefetch_history_days = 14  # количество последних дней истории запросов, по которым определяются популярные города
+prefetch_budget_share = 0.5  # доля доступной фоновым задачам дневной квоты API Яндекс.Погоды, расходуемая на прогрев
@@ -1,2 +1,26 @@
 bot_token = ""  # тут нужно вписать токен бота
 tg_bot_admin = []  # тут нужно добавлять ID администраторов бота (тип int)
+mode = "polling"  # способ получения обновлений: "polling" (long polling) или "webhook"
+api_server = ""  # адрес сервера Bot API; если пусто, используется https://api.telegram.org
+webhook_url = ""  # внешний адрес бота для вебхука, например "https://example.com"; если пусто, вебхук не регистрируется
+webhook_path = "/webhook"  # путь, по которому сервер принимает обновления Telegram
+webhook_secret = ""  # секретный токен, которым Telegram подписывает запросы к вебхуку
+webapp_host = "0.0.0.0"  # адрес, на котором слушает сервер вебхука
+webapp_port = 8080  # порт, на котором слушает сервер вебхука
+workers = 4  # количество рабочих процессов при запуске через supervisor.py
+worker_queue_size = 1000  # максимальное количество обновлений, ожидающих обработки в одном рабочем процессе
+worker_concurrency = 100  # максимальное количество обновлений, одновременно обрабатываемых одним рабочим процессом
+send_rate = 30  # максимальное количество исходящих сообщений бота в секунду
+send_processes = 1  # количество процессов бота, между которыми поровну делится send_rate (один токен - один лимит)
+chat_send_interval = 1  # минимальный интервал между сообщениями в один чат, секунды
+send_retries = 3  # количество повторных попыток отправки сообщения после ответа Telegram RetryAfter
+background_jobs = True  # запускать ли фоновые задания: рассылку и сворачивание отчётов (в супервизоре - в процессе 0)
+broadcast_chunk_size = 1000  # количество подписчиков, читаемых из базы данных за одно обращение при рассылке прогнозов
+broadcast_max_pending = 5000  # максимальное количество сообщений рассылки, ожидающих отправки в очереди
+metrics_host = "0.0.0.0"  # адрес, на котором слушает сервер метрик
+metrics_port = 9100  # порт сервера метрик /metrics (0 - не запускать); в супервизоре процесс N слушает metrics_port + N
+export_concurrency = 2  # максимальное количество одновременно формируемых выгрузок истории
+inline_debounce = 0.3  # время ожидания следующего встроенного запроса пользователя перед поиском городов, секунды
+inline_results = 10  # максимальное количество городов в ответе на встроенный запрос
+inline_fetch = 3  # максимальное количество прогнозов, запрашиваемых у API для одного ответа на встроенный запрос
+inline_cache_time = 60  # максимальное время хранения ответа на встроенный запрос на серверах Telegram, секунды
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.bot import api
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+
+from settings import api_config, bot_config
+
+logger = logging.getLogger(__name__)
+
+
+def user_id_of(update: dict) -> int:
+    """
+    Возвращает идентификатор пользователя, от которого пришло обновление Telegram.
+
+    Пользователь берётся из поля "from" объекта обновления (сообщения, callback-запроса и т. д.),
+    а если его нет - из идентификатора чата.
+
+    :param update: Обновление Telegram в виде словаря.
+    :type update: dict
+    :return: Идентификатор пользователя или 0, если его не удалось определить.
+    :rtype: int
+    """
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        if "from" in value:
+            return value["from"]["id"]
+        if "chat" in value:
+            return value["chat"]["id"]
+    return 0
+
+
+def shard_of(user_id: int, workers: int) -> int:
+    """
+    Возвращает номер рабочего процесса, который обрабатывает обновления пользователя.
+
+    :param user_id: Идентификатор пользователя Telegram.
+    :type user_id: int
+    :param workers: Количество рабочих процессов.
+    :type workers: int
+    :return: Номер рабочего процесса.
+    :rtype: int
+    """
+    return user_id % workers
+
+
+def configure_worker(index: int):
+    """
+    Изменяет настройки бота для рабочего процесса с номером index.
+
+    Фоновые задания, например рассылку ежедневного прогноза, выполняет только первый рабочий процесс.
+    Квоты и частота запросов к API Яндекса и частота отправки сообщений делятся поровну между рабочими процессами.
+    Каждый процесс отдаёт свои метрики на порту bot_config.metrics_port + index.
+
+    :param index: Номер рабочего процесса.
+    :type index: int
+    """
+    bot_config.background_jobs = bot_config.background_jobs and index == 0
+    # Обновления получает супервизор, а обновления одного пользователя всегда попадают в один процесс,
+    # поэтому рабочий процесс работает как при long polling: не регистрирует вебхук и кэширует состояния FSM
+    bot_config.mode = "polling"
+    # Каждый процесс расходует свою долю квот API Яндекса и общего для токена ограничения Telegram
+    api_config.api_processes = bot_config.workers
+    bot_config.send_processes = bot_config.workers
+    if bot_config.metrics_port:
+        bot_config.metrics_port += index
+
+
+async def _worker_main(index: int, queue: multiprocessing.Queue):
+    """
+    Обрабатывает обновления из очереди рабочего процесса диспетчером бота.
+
+    Обновления разных пользователей обрабатываются параллельно, а обновления одного пользователя - строго по порядку,
+    кроме встроенных запросов, которые обрабатываются сразу.
+    Одновременно обрабатывается не больше bot_config.worker_concurrency обновлений: следующее обновление
+    забирается из очереди только после завершения одного из них, поэтому при перегрузке очередь процесса
+    заполняется и супервизор приостанавливает опрос Telegram.
+    """
+    configure_worker(index)
+
+    # Модуль бота импортируется в рабочем процессе, чтобы у каждого процесса были свои пул соединений
+    # с базой данных, HTTP-сессия и кэши
+    import bot
+    from aiogram import Dispatcher, types
+
+    Bot.set_current(bot.bot)
+    Dispatcher.set_current(bot.dp)
+    await bot.on_startup(bot.dp)
+
+    loop = asyncio.get_running_loop()
+    locks = {}
+    pending = {}
+    tasks = set()
+    slots = asyncio.Semaphore(bot_config.worker_concurrency)
+
+    async def process(data: dict):
+        try:
+            await bot.dp.process_updates([types.Update(**data)])
+        except Exception:
+            logger.exception("Ошибка обработки обновления %s", data.get("update_id"))
+
+    async def handle(data: dict):
+        try:
+            if "inline_query" in data:
+                # Встроенные запросы не меняют состояние диалога и обрабатываются без очереди пользователя:
+                # иначе каждый следующий запрос ждал бы предыдущего, и InlineSearch не мог бы отменить устаревшие
+                await process(data)
+                return
+
+            user_id = user_id_of(data)
+            lock = locks.setdefault(user_id, asyncio.Lock())
+            pending[user_id] = pending.get(user_id, 0) + 1
+            try:
+                async with lock:
+                    await process(data)
+            finally:
+                pending[user_id] -= 1
+                if not pending[user_id]:
+                    del pending[user_id]
+                    del locks[user_id]
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            task = asyncio.create_task(handle(data))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+    finally:
+        await bot.on_shutdown(bot.dp)
+        await (await bot.bot.get_session()).close()
+
+
+def run_worker(index: int, queue: multiprocessing.Queue):
+    """
+    Точка входа рабочего процесса.
+
+    :param index: Номер рабочего процесса.
+    :type index: int
+    :param queue: Очередь обновлений рабочего процесса. None в очереди означает завершение работы.
+    :type queue: multiprocessing.Queue
+    """
+    # Рабочий процесс завершается по команде супервизора, после обработки уже полученных обновлений
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_main(index, queue))
+
+
+async def poll(bot: Bot, queues: list[multiprocessing.Queue]):
+    """
+    Получает обновления Telegram через long polling и распределяет их по рабочим процессам.
+
+    Обновления одного пользователя всегда попадают в один и тот же процесс,
+    поэтому порядок их обработки и состояние диалога сохраняются.
+
+    :param bot: Бот, через который запрашиваются обновления.
+    :type bot: Bot
+    :param queues: Очереди обновлений рабочих процессов.
+    :type queues: list[multiprocessing.Queue]
+    """
+    loop = asyncio.get_running_loop()
+    await bot.delete_webhook()
+
+    # Пропуск обновлений, накопившихся, пока бот не работал
+    offset: Optional[int] = None
+    skipped = await bot.request(api.Methods.GET_UPDATES, {"offset": -1, "timeout": 0})
+    if skipped:
+        offset = skipped[-1]["update_id"] + 1
+
+    while True:
+        try:
+            updates = await bot.request(api.Methods.GET_UPDATES, {"offset": offset, "timeout": 20})
+        except Exception:
+            logger.exception("Не удалось получить обновления")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update["update_id"] + 1
+            queue = queues[shard_of(user_id_of(update), len(queues))]
+            # Если рабочий процесс не успевает, очередь заполняется и опрос Telegram приостанавливается
+            await loop.run_in_executor(None, queue.put, update)
+
+
+def main():
+    """
+    Запускает bot_config.workers рабочих процессов и распределяет между ними обновления Telegram.
+    """
+    logging.basicConfig(level=logging.INFO)
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(bot_config.worker_queue_size) for _ in range(bot_config.workers)]
+    processes = [context.Process(target=run_worker, args=(index, queue), daemon=True)
+                 for index, queue in enumerate(queues)]
+    for process in processes:
+        process.start()
+
+    async def supervise():
+        server = TelegramAPIServer.from_base(bot_config.api_server) if bot_config.api_server else TELEGRAM_PRODUCTION
+        bot = Bot(token=bot_config.bot_token, server=server)
+        try:
+            await poll(bot, queues)
+        finally:
+            await (await bot.get_session()).close()
+
+    try:
+        asyncio.run(supervise())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
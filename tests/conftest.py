@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database import fsm_storage, orm
+from database.models import Base
+
+
+async def _create_schema(engine: AsyncEngine):
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch) -> AsyncEngine:
+    """
+    Подменяет базу данных бота временной базой SQLite со схемой из моделей.
+
+    Соединения не переиспользуются (NullPool), поэтому базу можно использовать из разных вызовов asyncio.run.
+    """
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'bot.db'}", poolclass=NullPool)
+    asyncio.run(_create_schema(engine))
+    session = async_sessionmaker(bind=engine, expire_on_commit=False)
+    monkeypatch.setattr(orm, "engine", engine)
+    monkeypatch.setattr(orm, "Session", session)
+    monkeypatch.setattr(fsm_storage, "Session", session)
+    return engine
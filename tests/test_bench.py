@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import aiohttp
+from aiogram import types
+
+from api_requests import request
+from api_requests.forecast import parse_forecast
+from bench import run
+from bench.fake_servers import FakeServers, city_pos, forecast_payload
+
+
+def test_city_coordinates_are_stable():
+    assert city_pos("Москва") == city_pos("москва")
+    lon, lat = map(float, city_pos("Казань").split())
+    assert 30 <= lon <= 130 and 45 <= lat <= 70
+
+
+def test_fake_forecast_matches_the_bot_parser():
+    forecast = parse_forecast(forecast_payload(37.6, 55.7))
+    assert len(forecast.days) == 7
+    assert forecast.day(0, time.time()) is not None
+    assert forecast_payload(37.6, 55.7)["fact"] == forecast_payload(37.6, 55.7)["fact"]
+
+
+def test_synthetic_updates_are_valid():
+    message = run.message_update(1, "Погода в моём городе")
+    updates = [message, run.location_update(1, 55.7, 37.6), run.inline_update(1, "Каз"),
+               run.callback_update(1, "reports", message["message"])]
+    parsed = [types.Update(**update) for update in updates]
+    assert parsed[0].message.text == "Погода в моём городе"
+    assert parsed[1].message.location.latitude == 55.7
+    assert parsed[2].inline_query.query == "Каз"
+    assert parsed[3].callback_query.data == "reports"
+    assert len({update["update_id"] for update in updates}) == 4
+
+
+def test_find_button():
+    message = {"reply_markup": {"inline_keyboard": [[{"text": "Удалить", "callback_data": "delete_report_5"}],
+                                                    [{"text": "Далее", "callback_data": "next_2_x_7"}]]}}
+    assert run.find_button(message, "next") == "next_2_x_7"
+    assert run.find_button(message, "prev") is None
+    assert run.find_button(None, "next") is None
+
+
+def test_fake_servers_answer_like_the_real_apis():
+    async def main():
+        servers = FakeServers()
+        await servers.start("127.0.0.1", 0)
+        host, port = servers._runner.addresses[0][:2]
+        base = f"http://{host}:{port}"
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{base}/1.x", params={"geocode": "Казань"}) as r:
+                    pos = request._parse_geocoder(await r.json())
+                async with session.post(f"{base}/bot1:token/sendMessage", data={"chat_id": "5", "text": "hi"}) as r:
+                    sent = (await r.json())["result"]
+        finally:
+            await servers.stop()
+        return servers, pos, sent
+
+    servers, pos, sent = asyncio.run(main())
+    assert pos == city_pos("Казань")
+    assert servers.messages[5] == sent
+    assert servers.calls == {"geocoder": 1, "telegram.sendMessage": 1}
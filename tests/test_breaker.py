@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from api_requests import breaker, request
+from api_requests.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from api_requests.errors import CircuitOpen, UpstreamError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+def call(circuit: CircuitBreaker, error: Exception = None):
+    with circuit.guard():
+        if error is not None:
+            raise error
+
+
+def fail(circuit: CircuitBreaker, times: int = 1):
+    for _ in range(times):
+        with pytest.raises(UpstreamError):
+            call(circuit, UpstreamError("503"))
+
+
+def new_breaker() -> CircuitBreaker:
+    return CircuitBreaker(window=10, min_calls=4, failure_rate=0.5, open_time=30, probes=2)
+
+
+def test_opens_when_failure_rate_reached(clock):
+    circuit = new_breaker()
+    call(circuit)
+    call(circuit)
+    fail(circuit)
+    assert circuit.state == CLOSED
+    fail(circuit)
+
+    assert circuit.state == OPEN
+    assert circuit.stats() == {"open": 1, "opened": 1, "rejected": 0, "failures": 2}
+
+
+def test_needs_min_calls_before_opening(clock):
+    circuit = new_breaker()
+    fail(circuit, 3)
+    assert circuit.state == CLOSED
+
+
+def test_open_breaker_rejects_without_calling(clock):
+    circuit = new_breaker()
+    fail(circuit, 4)
+
+    with pytest.raises(CircuitOpen):
+        circuit.check()
+    with pytest.raises(CircuitOpen):
+        call(circuit)
+    assert circuit.rejected == 2
+
+
+def test_closes_after_successful_probes(clock):
+    circuit = new_breaker()
+    fail(circuit, 4)
+    clock[0] += 30
+
+    call(circuit)
+    assert circuit.state == HALF_OPEN
+    call(circuit)
+    assert circuit.state == CLOSED
+    # После замыкания прошлые ошибки не учитываются
+    fail(circuit, 3)
+    assert circuit.state == CLOSED
+
+
+def test_failed_probe_reopens(clock):
+    circuit = new_breaker()
+    fail(circuit, 4)
+    clock[0] += 30
+
+    fail(circuit)
+    assert circuit.state == OPEN
+    assert circuit.opened == 2
+    with pytest.raises(CircuitOpen):
+        circuit.check()
+
+
+def test_probe_count_is_limited(clock):
+    circuit = new_breaker()
+    fail(circuit, 4)
+    clock[0] += 30
+
+    with circuit.guard(), circuit.guard():
+        with pytest.raises(CircuitOpen):
+            with circuit.guard():
+                pass
+    assert circuit.state == CLOSED
+
+
+def test_other_exceptions_are_not_failures(clock):
+    circuit = new_breaker()
+    for _ in range(4):
+        with pytest.raises(KeyError):
+            call(circuit, KeyError("city"))
+    assert circuit.state == CLOSED
+    assert circuit.failures == 0
+
+
+def test_get_forecast_falls_back_to_last_known_forecast(monkeypatch):
+    async def unavailable(pos: str, priority: int):
+        raise CircuitOpen("open")
+
+    monkeypatch.setattr(request, "_fetch_forecast", unavailable)
+    monkeypatch.setattr(request, "stale_forecasts", request.LRUCache(10))
+    monkeypatch.setattr(request, "stale_served", 0)
+    request.stale_forecasts.set("37.6 55.7", "old forecast")
+
+    assert asyncio.run(request.get_forecast("37.6 55.7")) == "old forecast"
+    assert request.stale_served == 1
+    with pytest.raises(CircuitOpen):
+        asyncio.run(request.get_forecast("30.3 59.9"))
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from database import orm
+from services import broadcast
+from services.broadcast import DailyForecast
+
+
+class FakeSender:
+    """
+    Очередь отправки, которая только запоминает поставленные в неё сообщения.
+    """
+
+    def __init__(self):
+        self.bot = SimpleNamespace(send_message=None)
+        self.messages = []
+
+    def __len__(self) -> int:
+        return 0
+
+    def submit(self, chat_id: int, method, /, priority: int, **kwargs):
+        self.messages.append((chat_id, kwargs["text"]))
+
+
+def daily_forecast(chunk_size: int = 1000) -> DailyForecast:
+    forecast = DailyForecast(FakeSender(), chunk_size, max_pending=100)
+    forecast.fetched = []
+
+    async def forecast_text(city: str) -> str:
+        forecast.fetched.append(city)
+        return f"Погода в {city}"
+
+    forecast._forecast_text = forecast_text
+    return forecast
+
+
+async def subscribe(tg_id: int, city: str, minute: int):
+    await orm.add_user(tg_id)
+    await orm.set_user_city(tg_id, city)
+    await orm.set_user_notify(tg_id, minute)
+
+
+def test_minute_of_day_converts_local_time_to_utc():
+    assert broadcast.minute_of_day(8, 0, 3 * 3600) == 5 * 60
+    assert broadcast.minute_of_day(1, 30, 3 * 3600) == 1440 - 90
+
+
+def test_forecast_is_fetched_once_per_city_across_chunks(db):
+    async def main():
+        for tg_id, city in enumerate(["Москва", "Казань", "Москва", "Казань", "Москва"], 1):
+            await subscribe(tg_id, city, 480)
+        await subscribe(10, "Москва", 481)
+        forecast = daily_forecast(chunk_size=2)
+        await forecast.send(480)
+        return forecast
+
+    forecast = asyncio.run(main())
+    assert forecast.fetched == ["Казань", "Москва"]
+    assert sorted(forecast.sender.messages) == [(1, "Погода в Москва"), (2, "Погода в Казань"),
+                                                (3, "Погода в Москва"), (4, "Погода в Казань"),
+                                                (5, "Погода в Москва")]
+    assert forecast.stats()["sent"] == 5
+
+
+def test_minutes_passed_during_long_broadcast_are_not_skipped(monkeypatch):
+    start = time.monotonic()
+    offset = [480 * 60 - 0.01 - start]
+    sent = []
+
+    async def send(minute: int):
+        sent.append(minute)
+        if minute == 480:
+            # Рассылка за популярную минуту длится 7 минут
+            offset[0] += 7 * 60
+
+    monkeypatch.setattr(broadcast.time, "time", lambda: time.monotonic() + offset[0])
+
+    async def main():
+        forecast = DailyForecast(FakeSender(), 1000, 100)
+        forecast.send = send
+        forecast.start()
+        for _ in range(100):
+            if len(sent) == 8:
+                break
+            await asyncio.sleep(0.01)
+        await forecast.stop()
+
+    asyncio.run(main())
+    assert sent == list(range(480, 488))
@@ -0,0 +1,85 @@
+import asyncio
+
+from api_requests import cache
+from api_requests.cache import LRUCache, SingleFlight, TTLCache
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+
+    assert lru.get("b") is None
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+    assert lru.stats() == {"size": 2, "hits": 3, "misses": 1, "evictions": 1}
+
+
+def test_ttl_entry_expires(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    ttl = TTLCache(10, 5)
+    ttl.set("a", 1)
+
+    assert ttl.get("a") == 1
+    assert ttl.expires_in("a") == 5
+    now[0] += 5
+    assert ttl.expires_in("a") == 0
+    assert ttl.get("a") is None
+    assert len(ttl) == 0
+    assert ttl.stats() == {"size": 0, "hits": 1, "misses": 1, "evictions": 0, "expirations": 1}
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        return flight, results
+
+    flight, results = asyncio.run(main())
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert flight.coalesced == 4
+    assert len(flight) == 0
+
+
+def test_single_flight_survives_cancelled_waiter():
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("key", fetch))
+        second = asyncio.create_task(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "result"
+
+
+def test_single_flight_propagates_errors_and_forgets_key():
+    async def fail():
+        raise ValueError("boom")
+
+    async def main():
+        flight = SingleFlight()
+        try:
+            await flight.do("key", fail)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("ошибка вызова не передана вызывающему")
+        return flight
+
+    assert len(asyncio.run(main())) == 0
@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import orm
+from services.compaction import ReportCompactor
+
+
+@pytest.fixture
+def old_reports(monkeypatch):
+    """
+    Подменяет сворачивание в базе данных: 12 старых отчётов, которые сворачиваются пачками до limit.
+    """
+    calls = []
+    left = [12]
+
+    async def compact_reports(before: datetime, limit: int) -> int:
+        calls.append((before, limit))
+        compacted = min(left[0], limit)
+        left[0] -= compacted
+        return compacted
+
+    monkeypatch.setattr(orm, "compact_reports", compact_reports)
+    return calls
+
+
+def test_old_reports_are_compacted_in_batches(old_reports):
+    compactor = ReportCompactor(retention_days=90, batch_size=5, interval=3600, pause=0)
+    assert asyncio.run(compactor.compact()) == 12
+    assert [limit for _, limit in old_reports] == [5, 5, 5]
+    assert compactor.stats() == {"compacted": 12, "batches": 3}
+
+    # Все пачки сворачивают отчёты старше одного и того же момента
+    before = {before for before, _ in old_reports}
+    assert len(before) == 1
+    assert abs(datetime.now() - timedelta(days=90) - before.pop()) < timedelta(seconds=5)
+
+
+def test_nothing_to_compact(old_reports):
+    compactor = ReportCompactor(retention_days=90, batch_size=20, interval=3600, pause=0)
+    asyncio.run(compactor.compact())
+    assert asyncio.run(compactor.compact()) == 0
+    assert compactor.stats() == {"compacted": 12, "batches": 1}
+
+
+def test_started_batch_finishes_on_stop(monkeypatch):
+    finished = []
+
+    async def compact_reports(before: datetime, limit: int) -> int:
+        await asyncio.sleep(0.05)
+        finished.append(limit)
+        return 0
+
+    monkeypatch.setattr(orm, "compact_reports", compact_reports)
+
+    async def main():
+        compactor = ReportCompactor(retention_days=90, batch_size=5, interval=3600, pause=0)
+        compactor.start()
+        await asyncio.sleep(0.01)
+        await compactor.stop()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert finished == [5]
@@ -0,0 +1,81 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+
+from database import orm
+from services import export
+
+
+async def reports(tg_id: int, count: int):
+    await orm.add_user(tg_id)
+    for temp in range(count):
+        await orm.create_report(tg_id, temp, temp - 2, 3, 750, "Москва")
+
+
+async def export_user(tg_id: int, fmt: str, spool_size: int = 1024 * 1024):
+    return await export.export_rows(orm.stream_user_reports(tg_id, chunk_size=2), fmt, spool_size)
+
+
+def test_csv_export(db):
+    async def main():
+        await reports(1, 3)
+        await reports(2, 1)
+        return await export_user(1, "csv")
+
+    file, count = asyncio.run(main())
+    text = file.read().decode("utf-8")
+    rows = list(csv.reader(io.StringIO(text.lstrip("\ufeff"))))
+    assert text.startswith("\ufeff")
+    assert count == 3
+    assert rows[0] == ["date", "city", "lat", "lon", "temp", "feels_like", "wind_speed", "pressure_mm"]
+    assert [row[4] for row in rows[1:]] == ["0", "1", "2"]
+
+
+def test_jsonl_export_is_gzipped(db):
+    async def main():
+        await reports(1, 2)
+        return await export_user(1, "jsonl")
+
+    file, count = asyncio.run(main())
+    lines = [json.loads(line) for line in gzip.decompress(file.read()).splitlines()]
+    assert count == 2
+    assert [line["feels_like"] for line in lines] == [-2, -1]
+    assert lines[0]["lat"] is None
+    assert "T" in lines[0]["date"]
+
+
+def test_large_export_moves_to_disk(db):
+    async def main():
+        await reports(1, 50)
+        return await export_user(1, "csv", spool_size=256)
+
+    file, count = asyncio.run(main())
+    assert count == 50
+    assert file._rolled
+    assert export.file_size(file) > 256
+    assert file.tell() == 0
+
+
+def test_all_users_export_includes_users_without_reports(db):
+    async def main():
+        await reports(1, 2)
+        await orm.add_user(2)
+        return await export.export_rows(orm.stream_all_reports(chunk_size=10), "jsonl", 1024)
+
+    file, count = asyncio.run(main())
+    lines = [json.loads(line) for line in gzip.decompress(file.read()).splitlines()]
+    assert count == 3
+    assert [(line["tg_id"], line["temp"]) for line in lines] == [(1, 0), (1, 1), (2, None)]
+
+
+def test_upload_can_be_sent_again():
+    file = io.BytesIO(b"date,city\n")
+    file.read()
+    for _ in range(2):
+        upload = export.Upload(file)
+        assert upload.read() == b"date,city\n"
+        # aiohttp закрывает отправленный файл, но файл выгрузки остаётся открытым для повтора
+        upload.close()
+    assert not file.closed
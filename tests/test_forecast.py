@@ -0,0 +1,91 @@
+import pytest
+
+from api_requests.forecast import Forecast, parse_forecast
+
+NOW = 1_700_000_000 - 1_700_000_000 % 86400  # полночь по UTC
+OFFSET = 3 * 3600
+
+
+def weather(temp: int, condition: str = "clear", **extra) -> dict:
+    return {"temp": temp, "feels_like": temp - 2, "wind_speed": 3.5, "pressure_mm": 750, "humidity": 60,
+            "condition": condition, **extra}
+
+
+def part(temp: int, condition: str = "cloudy") -> dict:
+    data = weather(temp, condition)
+    data["temp_avg"] = data.pop("temp")
+    return {**data, "temp_min": temp - 1, "temp_max": temp + 1}
+
+
+def payload() -> dict:
+    return {
+        "now": NOW,
+        "info": {"tzinfo": {"offset": OFFSET}},
+        "fact": weather(5, "overcast"),
+        "forecasts": [
+            {"date": "2023-11-14", "parts": {"night": part(0), "day": part(8, "rain")},
+             "hours": [{"hour_ts": NOW + 3600, **weather(4)}, {"hour_ts": NOW, **weather(3)}]},
+            {"date": "2023-11-15", "parts": {"morning": part(2), "evening": part(4)}, "hours": []},
+        ],
+    }
+
+
+def test_parse_forecast_keeps_displayed_fields():
+    forecast = parse_forecast(payload())
+
+    assert isinstance(forecast, Forecast)
+    assert forecast.now == NOW
+    assert forecast.offset == OFFSET
+    assert forecast.fact.temp == 5
+    assert forecast.fact.feels_like == 3
+    assert forecast.fact.condition_text == "пасмурно"
+    assert [hour.ts for hour in forecast.hours] == [NOW, NOW + 3600]
+    assert [day.date for day in forecast.days] == ["2023-11-14", "2023-11-15"]
+
+
+def test_day_temperatures_and_condition_come_from_parts():
+    today, tomorrow = parse_forecast(payload()).days
+
+    assert (today.temp_min, today.temp_max) == (-1, 9)
+    assert today.parts[1].temp == 8
+    assert today.condition_text == "дождь"
+    # Без дневной части погода дня описывается последней из известных
+    assert tomorrow.condition_text == "облачно с прояснениями"
+
+
+def test_day_and_next_hours_use_local_time():
+    forecast = parse_forecast(payload())
+
+    assert forecast.local_time(NOW).hour == 3
+    assert forecast.day(0).date == "2023-11-14"
+    assert forecast.day(1).date == "2023-11-15"
+    assert forecast.day(2) is None
+    assert [hour.ts for hour in forecast.next_hours(1, NOW + 1800)] == [NOW]
+
+
+def test_stale_note_only_for_old_forecasts():
+    forecast = parse_forecast(payload())
+
+    assert forecast.stale_note(300, NOW + 300) == ""
+    assert forecast.stale_note(300, NOW + 1200) == "Сервис погоды недоступен, данные на 03:00 (20 мин назад)"
+
+
+@pytest.mark.parametrize("field", ["temp", "feels_like", "wind_speed", "pressure_mm"])
+def test_missing_fact_field_is_an_error(field):
+    data = payload()
+    del data["fact"][field]
+
+    with pytest.raises(KeyError):
+        parse_forecast(data)
+
+
+def test_optional_fields_may_be_missing():
+    data = payload()
+    for key in ("humidity", "condition"):
+        del data["fact"][key]
+    data["forecasts"] = []
+
+    forecast = parse_forecast(data)
+    assert forecast.fact.humidity is None
+    assert forecast.fact.prec_prob is None
+    assert forecast.days == ()
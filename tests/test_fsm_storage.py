@@ -0,0 +1,81 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from database import orm
+from database.fsm_storage import SQLStorage
+from database.models import FSMRecord
+
+
+def storage(cached: bool, ttl: float = 3600) -> SQLStorage:
+    return SQLStorage(ttl, flush_interval=3600, purge_interval=3600, cache_size=100, cached=cached)
+
+
+async def rows() -> int:
+    async with orm.Session() as session:
+        return await session.scalar(select(func.count()).select_from(FSMRecord))
+
+
+def test_cached_changes_are_written_on_flush(db):
+    async def main():
+        first = storage(cached=True)
+        await first.set_state(chat=1, user=1, state="Form:city")
+        await first.update_data(chat=1, user=1, page=2)
+        before = await rows(), await storage(cached=False).get_state(chat=1, user=1)
+        await first.close()
+        # Новый процесс бота читает состояние из базы данных
+        restarted = storage(cached=True)
+        after = await restarted.get_state(chat=1, user=1), await restarted.get_data(chat=1, user=1)
+        return before, after
+
+    before, after = asyncio.run(main())
+    assert before == (0, None)
+    assert after == ("Form:city", {"page": 2})
+
+
+def test_uncached_storage_writes_through(db):
+    async def main():
+        first, second = storage(cached=False), storage(cached=False)
+        await first.set_state(chat=1, user=1, state="Form:city")
+        seen = await second.get_state(chat=1, user=1)
+        await second.set_state(chat=1, user=1, state=None)
+        return seen, await first.get_state(chat=1, user=1), await rows()
+
+    assert asyncio.run(main()) == ("Form:city", None, 0)
+
+
+def test_finished_state_is_deleted_on_flush(db):
+    async def main():
+        cached = storage(cached=True)
+        await cached.set_state(chat=1, user=1, state="Form:city")
+        await cached.flush()
+        stored = await rows()
+        await cached.reset_state(chat=1, user=1, with_data=True)
+        await cached.flush()
+        return stored, await rows()
+
+    assert asyncio.run(main()) == (1, 0)
+
+
+def test_stale_states_expire_and_are_purged(db):
+    async def main():
+        cached = storage(cached=True, ttl=0.05)
+        await cached.set_state(chat=1, user=1, state="Form:city")
+        await cached.set_data(chat=1, user=1, data={"page": 3})
+        await cached.flush()
+        await asyncio.sleep(0.1)
+        expired = await cached.get_state(chat=1, user=1), await cached.get_data(chat=1, user=1)
+        await cached.purge()
+        return expired, await rows()
+
+    assert asyncio.run(main()) == ((None, {}), 0)
+
+
+def test_bucket_is_stored(db):
+    async def main():
+        uncached = storage(cached=False)
+        await uncached.update_bucket(chat=1, user=2, calls=1)
+        await uncached.update_bucket(chat=1, user=2, last="now")
+        return await storage(cached=True).get_bucket(chat=1, user=2)
+
+    assert asyncio.run(main()) == {"calls": 1, "last": "now"}
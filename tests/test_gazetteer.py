@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from api_requests.gazetteer import Gazetteer, edit_distance, normalize_name
+
+CITIES = """# название, долгота, широта, население, другие написания
+Москва\t37.617635\t55.755814\t13010112\tMoscow,Moskva
+Орёл\t36.07\t52.97\t300000\t
+Омск\t73.37\t54.98\t1100000\t
+Томск\t84.95\t56.48\t570000\t
+Орск\t58.57\t51.23\t200000\t
+Новосибирск\t82.92\t55.03\t1600000\t
+Новокузнецк\t87.1\t53.75\t540000\t
+"""
+
+
+@pytest.fixture
+def gazetteer(tmp_path):
+    source = tmp_path / "cities.tsv"
+    source.write_text(CITIES, encoding="utf-8")
+    places = Gazetteer(str(tmp_path / "gazetteer.idx"), str(source))
+    places.open()
+    yield places
+    places.close()
+
+
+def test_normalize_name():
+    assert normalize_name("  Орёл ") == "орел"
+    assert normalize_name("Санкт-Петербург") == "санкт петербург"
+    assert normalize_name("MOSKVA") == normalize_name("Москва")
+
+
+def test_edit_distance():
+    assert edit_distance("омск", "омск") == 0
+    assert edit_distance("омск", "орск") == 1
+    assert edit_distance("томск", "омск") == 1
+    assert edit_distance("", "омск") == 4
+
+
+def test_index_is_built_from_source(gazetteer, tmp_path):
+    assert os.path.exists(tmp_path / "gazetteer.idx")
+    # Каждое написание - отдельная запись индекса; "Moskva" совпадает с ключом "москва"
+    assert len(gazetteer) == 8
+
+
+@pytest.mark.parametrize("text", ["Москва", "москва", "МОСКВА", "Moskva", "Moscow"])
+def test_exact_matches_spellings_and_aliases(gazetteer, text):
+    place = gazetteer.exact(text)
+    assert place is not None
+    assert place.name == "Москва"
+    assert place.pos == "37.617635 55.755814"
+
+
+def test_exact_ignores_yo(gazetteer):
+    assert gazetteer.exact("Орел").name == "Орёл"
+
+
+def test_exact_does_not_guess(gazetteer):
+    assert gazetteer.exact("Омскк") is None
+    assert gazetteer.exact("Мухосранск") is None
+
+
+def test_prefix_orders_by_population(gazetteer):
+    assert [place.name for place in gazetteer.prefix("о")] == ["Омск", "Орёл", "Орск"]
+    assert [place.name for place in gazetteer.prefix("Ново", limit=1)] == ["Новосибирск"]
+
+
+def test_resolve_corrects_unambiguous_typo(gazetteer):
+    place, suggestions = gazetteer.resolve("Новосибирсккк")
+    assert place.name == "Новосибирск"
+    assert suggestions == []
+    assert gazetteer.stats()["corrected"] == 1
+
+
+def test_resolve_suggests_similar_names(gazetteer):
+    place, suggestions = gazetteer.resolve("Ново")
+    assert place is None
+    assert set(suggestions) == {"Новосибирск", "Новокузнецк"}
+    assert gazetteer.stats()["suggested"] == 1
+
+
+def test_resolve_leaves_unknown_names_to_geocoder(gazetteer):
+    assert gazetteer.resolve("Мухосранск") == (None, [])
+    assert gazetteer.stats()["misses"] == 1
@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from api_requests import request
+from api_requests.cache import TTLCache
+from api_requests.forecast import parse_forecast
+from api_requests.gazetteer import Place
+from services.inline import InlineSearch
+from tests.test_forecast import payload
+
+PLACES = [Place("Москва", "москва", "37.6 55.7", 13000000), Place("Мурманск", "мурманск", "33.1 68.9", 270000),
+          Place("Муром", "муром", "42.0 55.6", 100000)]
+
+
+class FakeGazetteer:
+    def prefix(self, text: str, limit: int) -> list[Place]:
+        return [place for place in PLACES if place.key.startswith(text.lower())][:limit]
+
+    def search(self, text: str, limit: int) -> list:
+        return []
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """
+    Подменяет справочник и API прогнозов; возвращает список координат, прогноз для которых запрошен у API.
+    """
+    fetched = []
+
+    async def get_forecast(pos: str):
+        fetched.append(pos)
+        forecast = parse_forecast(payload())
+        request.weather_cache.set(pos, forecast)
+        return forecast
+
+    monkeypatch.setattr(request, "gazetteer", FakeGazetteer())
+    monkeypatch.setattr(request, "weather_cache", TTLCache(100, 300))
+    monkeypatch.setattr(request, "get_forecast", get_forecast)
+    return fetched
+
+
+def query(text: str, user_id: int = 1) -> SimpleNamespace:
+    answers = []
+
+    async def answer(results, cache_time: int, is_personal: bool):
+        answers.append(([result.title for result in results], cache_time))
+
+    return SimpleNamespace(query=text, from_user=SimpleNamespace(id=user_id), answer=answer, answers=answers)
+
+
+def search(max_fetch: int = 3, cache_time: int = 60) -> InlineSearch:
+    return InlineSearch(lambda name, forecast: f"Погода в {name}", debounce=0.02, max_results=10,
+                        max_fetch=max_fetch, cache_time=cache_time)
+
+
+def test_only_last_query_of_user_is_answered(api):
+    queries = [query("м"), query("му"), query("мур"), query("м", user_id=2)]
+
+    async def main():
+        inline = search()
+        tasks = []
+        for q in queries:
+            tasks.append(asyncio.create_task(inline.answer(q)))
+            await asyncio.sleep(0.001)
+        await asyncio.gather(*tasks)
+        return inline
+
+    inline = asyncio.run(main())
+    assert [q.answers for q in queries] == [[], [], [(["Мурманск", "Муром"], 60)],
+                                            [(["Москва", "Мурманск", "Муром"], 60)]]
+    stats = inline.stats()
+    assert (stats["queries"], stats["superseded"], stats["answered"], stats["pending"]) == (4, 2, 2, 0)
+
+
+def test_only_max_fetch_forecasts_are_requested(api):
+    asyncio.run(request.get_forecast("33.1 68.9"))
+    api.clear()
+    q = query("м")
+
+    asyncio.run(search(max_fetch=1).answer(q))
+    # Прогноз Мурманска есть в кэше, из остальных у API запрашивается только первый
+    assert api == ["37.6 55.7"]
+    assert q.answers[0][0] == ["Москва", "Мурманск"]
+
+
+def test_cache_time_does_not_outlive_forecasts(api, monkeypatch):
+    monkeypatch.setattr(request, "weather_cache", TTLCache(100, 30))
+    q = query("москва")
+    asyncio.run(search(cache_time=60).answer(q))
+    assert 0 < q.answers[0][1] <= 30
+
+
+def test_empty_query_gets_empty_answer(api):
+    q = query("  ")
+    asyncio.run(search().answer(q))
+    assert q.answers == [([], 60)]
+    assert api == []
@@ -0,0 +1,103 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+from api_requests.errors import QuotaExceeded
+from api_requests.limiter import BACKGROUND, INTERACTIVE, RateLimiter
+
+
+def test_burst_is_served_without_waiting():
+    async def main():
+        limiter = RateLimiter(rate=1, burst=3, daily_quota=100, max_queue=10)
+        for _ in range(3):
+            await asyncio.wait_for(limiter.acquire(), 0.05)
+        return limiter
+
+    limiter = asyncio.run(main())
+    assert limiter.stats()["consumed"] == 3
+    assert limiter.stats()["wait_time_max"] == 0
+
+
+def test_interactive_waiters_are_served_before_background():
+    order = []
+
+    async def request(limiter: RateLimiter, name: str, priority: int):
+        await limiter.acquire(priority)
+        order.append(name)
+
+    async def main():
+        limiter = RateLimiter(rate=50, burst=1, daily_quota=100, max_queue=10)
+        await limiter.acquire()
+        background = asyncio.create_task(request(limiter, "background", BACKGROUND))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(request(limiter, "interactive", INTERACTIVE))
+        await asyncio.gather(background, interactive)
+
+    asyncio.run(main())
+    assert order == ["interactive", "background"]
+
+
+def test_background_requests_leave_reserve_for_users():
+    async def main():
+        limiter = RateLimiter(rate=1000, burst=10, daily_quota=10, max_queue=10, reserve=0.2)
+        for _ in range(8):
+            await limiter.acquire(BACKGROUND)
+        with pytest.raises(QuotaExceeded):
+            await limiter.acquire(BACKGROUND)
+        assert limiter.remaining_today(BACKGROUND) == 0
+        assert limiter.remaining_today(INTERACTIVE) == 2
+        await limiter.acquire(INTERACTIVE)
+        await limiter.acquire(INTERACTIVE)
+        with pytest.raises(QuotaExceeded):
+            await limiter.acquire(INTERACTIVE)
+        return limiter
+
+    assert asyncio.run(main()).rejected == 2
+
+
+def test_quota_resets_on_next_day():
+    async def main():
+        limiter = RateLimiter(rate=1000, burst=10, daily_quota=1, max_queue=10)
+        await limiter.acquire()
+        with pytest.raises(QuotaExceeded):
+            await limiter.acquire()
+        limiter._day = date.today() - timedelta(days=1)
+        await limiter.acquire()
+        return limiter
+
+    assert asyncio.run(main()).used_today == 1
+
+
+def test_full_queue_rejects_requests():
+    async def main():
+        limiter = RateLimiter(rate=1, burst=1, daily_quota=100, max_queue=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(QuotaExceeded):
+            await limiter.acquire()
+        waiter.cancel()
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiters_free_queue_and_quota():
+    async def main():
+        limiter = RateLimiter(rate=1, burst=1, daily_quota=2, max_queue=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert len(limiter) == 0
+
+        # Место в очереди и в квоте, которое занимал отменённый запрос, достаётся следующему
+        request = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not request.done()
+        request.cancel()
+        return limiter
+
+    assert asyncio.run(main()).rejected == 0
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from api_requests import request
+from settings import api_config
+
+
+@pytest.fixture(autouse=True)
+def grid(monkeypatch):
+    monkeypatch.setattr(api_config, "location_grid", 0.05)
+
+
+def test_nearby_locations_share_a_grid_node():
+    assert request.snap_location(55.7512, 37.6184) == (55.75, 37.6)
+    assert request.snap_location(55.7699, 37.6049) == (55.75, 37.6)
+    assert request.snap_location(55.7751, 37.6) == (55.8, 37.6)
+
+
+def test_snap_location_handles_negative_coordinates():
+    assert request.snap_location(-33.8688, 151.2093) == (-33.85, 151.2)
+    assert request.snap_location(40.7128, -74.006) == (40.7, -74.0)
+
+
+def test_location_name_uses_grid_precision(monkeypatch):
+    assert request.location_name(55.75, 37.6) == "55.75, 37.60"
+    monkeypatch.setattr(api_config, "location_grid", 0.1)
+    assert request.location_name(55.1, 83.0) == "55.1, 83.0"
+
+
+def test_location_pos_round_trips_location_name():
+    lat, lon = request.snap_location(-33.8688, 151.2093)
+    assert request.location_pos(request.location_name(lat, lon)) == "151.200000 -33.850000"
+
+
+@pytest.mark.parametrize("name", ["Москва", "55.75,37.60", "55.75, 37.60 ", "95.00, 37.60", "55.75, 181.00"])
+def test_location_pos_rejects_city_names_and_invalid_coordinates(name):
+    assert request.location_pos(name) is None
+
+
+def test_get_city_coord_takes_location_from_name():
+    # Координаты места по геопозиции берутся из названия без обращения к справочнику, базе данных и геокодеру
+    assert asyncio.run(request.get_city_coord("55.75, 37.60")) == "37.600000 55.750000"
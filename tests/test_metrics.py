@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from aiogram.dispatcher.handler import current_handler
+from sqlalchemy import text
+
+from services import metrics
+from services.metrics import Collected, Counter, Histogram, Metric, Registry
+
+
+def test_metric_requires_samples():
+    with pytest.raises(TypeError):
+        Metric("bot_metric", "Метрика")
+
+
+def test_counter_renders_labels():
+    counter = Counter("bot_updates_total", "Обновления", ("type",))
+    counter.inc("message")
+    counter.inc("message", amount=2)
+    counter.inc('callback"query')
+    assert counter.render() == ('# HELP bot_updates_total Обновления\n'
+                                '# TYPE bot_updates_total counter\n'
+                                'bot_updates_total{type="message"} 3\n'
+                                'bot_updates_total{type="callback\\"query"} 1\n')
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("bot_duration_seconds", "Время", ("handler",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 5):
+        histogram.observe(value, "start")
+    assert histogram.samples() == ['bot_duration_seconds_bucket{handler="start",le="0.1"} 1',
+                                   'bot_duration_seconds_bucket{handler="start",le="1.0"} 3',
+                                   'bot_duration_seconds_bucket{handler="start",le="+Inf"} 4',
+                                   'bot_duration_seconds_sum{handler="start"} 6.25',
+                                   'bot_duration_seconds_count{handler="start"} 4']
+
+
+def test_registry_skips_failing_metric():
+    registry = Registry()
+    registry.register(Collected("bot_broken", "Ошибка", lambda: 1 / 0))
+    registry.register(Collected("bot_queue", "Очередь", lambda: 5))
+    assert registry.render() == "# HELP bot_queue Очередь\n# TYPE bot_queue gauge\nbot_queue 5\n"
+
+
+def test_collect_stats_keeps_numeric_counters(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(metrics, "registry", registry)
+    metrics.collect_stats("bot_cache", "Кэш", lambda: {"hits": 3, "misses": 1, "state": "closed"})
+    assert registry.render().splitlines()[2:] == ['bot_cache{counter="hits"} 3', 'bot_cache{counter="misses"} 1']
+
+
+def test_cache_hit_ratio():
+    assert metrics.cache_hit_ratio({"hits": 3, "misses": 1}) == 0.75
+    assert metrics.cache_hit_ratio({"hits": 0, "misses": 0}) == 0
+
+
+def test_handler_label_tells_same_named_handlers_apart():
+    def make():
+        async def handler():
+            pass
+        return handler
+
+    def make_other():
+        async def handler():
+            pass
+        return handler
+
+    first, second = metrics.handler_label(make()), metrics.handler_label(make_other())
+    assert first.startswith("test_handler_label_tells_same_named_handlers_apart.<locals>.make.<locals>.handler:")
+    assert first != second
+    assert metrics.handler_label(None) == "unknown"
+
+
+def test_middleware_times_inline_queries(monkeypatch):
+    histogram = Histogram("bot_handler_duration_seconds", "Время", ("handler",))
+    monkeypatch.setattr(metrics, "handler_latency", histogram)
+
+    async def inline_query(query):
+        pass
+
+    async def main():
+        middleware = metrics.MetricsMiddleware()
+        data = {}
+        current_handler.set(inline_query)
+        await middleware.on_process_inline_query(None, data)
+        await middleware.on_post_process_inline_query(None, [], data)
+        return data
+
+    assert asyncio.run(main()) == {}
+    assert list(histogram._values) == [(metrics.handler_label(inline_query),)]
+
+
+def test_engine_queries_are_timed(db, monkeypatch):
+    monkeypatch.setattr(metrics, "registry", Registry())
+
+    async def main():
+        async with db.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    metrics.instrument_engine(db)
+    before = metrics.db_latency._values.get(("SELECT",), [None, 0, 0])[2]
+    asyncio.run(main())
+    assert metrics.db_latency._values[("SELECT",)][2] == before + 1
@@ -0,0 +1,92 @@
+import asyncio
+import re
+from contextlib import asynccontextmanager
+
+from database import migrations
+from database.models import Base
+
+
+def test_versions_are_consecutive():
+    versions = [version for version, _, _, _ in migrations.MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1))
+
+
+def migrated_schema() -> tuple[dict, set]:
+    """
+    Возвращает столбцы таблиц и имена индексов, которые создают миграции.
+    """
+    tables, indexes = {}, set()
+    for _, _, steps, _ in migrations.MIGRATIONS:
+        for step in steps:
+            create = re.search(r'CREATE TABLE IF NOT EXISTS "(\w+)" \((.*)\)', step, re.S)
+            if create:
+                columns = [line.split()[0].strip('"') for line in create[2].strip().splitlines()]
+                tables[create[1]] = {column for column in columns if column != "PRIMARY"}
+            for table, column in re.findall(r'ALTER TABLE "(\w+)" ADD COLUMN IF NOT EXISTS (\w+)', step):
+                tables[table].add(column)
+            indexes.update(re.findall(r'CREATE (?:UNIQUE )?INDEX (?:CONCURRENTLY )?(?:IF NOT EXISTS )?"(\w+)"', step))
+    return tables, indexes
+
+
+def test_migrations_build_the_model_schema():
+    tables, indexes = migrated_schema()
+    assert tables == {table.name: {column.name for column in table.columns}
+                      for table in Base.metadata.sorted_tables}
+    assert indexes == {index.name for table in Base.metadata.sorted_tables for index in table.indexes}
+
+
+class FakeConnection:
+    def __init__(self, log: list, applied: set, transaction: bool):
+        self.log = log
+        self.applied = applied
+        self.transaction = transaction
+
+    async def execution_options(self, isolation_level: str):
+        self.transaction = isolation_level != "AUTOCOMMIT"
+        return self
+
+    async def execute(self, statement, parameters=None):
+        sql = " ".join(str(statement).split())
+        self.log.append((sql, self.transaction))
+        if sql.startswith('INSERT INTO "SchemaVersions"'):
+            self.applied.add(parameters["version"])
+
+    async def scalars(self, statement):
+        return list(self.applied)
+
+
+class FakeEngine:
+    """
+    Движок, который записывает выполняемые запросы и признак того, выполняются ли они в транзакции.
+    """
+
+    def __init__(self, applied: set):
+        self.log = []
+        self.applied = applied
+
+    @asynccontextmanager
+    async def connect(self):
+        yield FakeConnection(self.log, self.applied, False)
+
+    @asynccontextmanager
+    async def begin(self):
+        yield FakeConnection(self.log, self.applied, True)
+
+
+def test_only_pending_migrations_are_applied():
+    engine = FakeEngine({1, 2, 3})
+    asyncio.run(migrations.migrate(engine))
+
+    assert engine.log[0][0].startswith("SELECT pg_advisory_lock")
+    assert engine.log[-1][0].startswith("SELECT pg_advisory_unlock")
+    assert engine.applied == {version for version, _, _, _ in migrations.MIGRATIONS}
+    assert not any('CREATE TABLE IF NOT EXISTS "Users"' in sql for sql, _ in engine.log)
+    # Индексы строятся через CONCURRENTLY вне транзакции, остальные миграции выполняются в транзакции
+    for sql, transaction in engine.log[2:-1]:
+        if not sql.startswith("INSERT"):
+            assert transaction != ("CONCURRENTLY" in sql), sql
+
+    engine.log.clear()
+    asyncio.run(migrations.migrate(engine))
+    # Повторный запуск только берёт блокировку и проверяет таблицу версий
+    assert len(engine.log) == 3
@@ -0,0 +1,127 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from database import orm
+
+
+async def add_reports(tg_id: int, count: int, city: str = "Москва"):
+    await orm.add_user(tg_id)
+    for temp in range(count):
+        await orm.create_report(tg_id, temp, temp, 1, 750, city)
+
+
+async def report_ids(tg_id: int) -> list[int]:
+    return [report.id for report in await orm.get_reports(tg_id)]
+
+
+def test_user_deletes_own_report(db):
+    async def main():
+        await add_reports(1, 3)
+        first = (await report_ids(1))[0]
+        await orm.delete_user_report(1, first)
+        return await report_ids(1), await orm.get_reports_page(1, 10)
+
+    ids, (page, total) = asyncio.run(main())
+    assert len(ids) == 2
+    assert total == 2
+    assert [report.id for report in page] == ids
+
+
+def test_user_cannot_delete_foreign_report(db):
+    async def main():
+        await add_reports(1, 2)
+        await add_reports(2, 1)
+        foreign = (await report_ids(2))[0]
+        await orm.delete_user_report(1, foreign)
+        return await report_ids(2), await orm.get_reports_page(1, 10), await orm.get_reports_page(2, 10)
+
+    ids, (_, own_total), (_, foreign_total) = asyncio.run(main())
+    assert len(ids) == 1
+    assert own_total == 2
+    assert foreign_total == 1
+
+
+def test_deleting_missing_report_keeps_counter(db):
+    async def main():
+        await add_reports(1, 1)
+        report_id = (await report_ids(1))[0]
+        await orm.delete_user_report(1, report_id)
+        await orm.delete_user_report(1, report_id)
+        return await orm.get_reports_page(1, 10)
+
+    assert asyncio.run(main()) == ([], 0)
+
+
+def test_add_user_is_idempotent(db):
+    async def main():
+        await orm.add_user(1)
+        await orm.add_user(1)
+        await orm.set_user_city(1, "Казань")
+        return await orm.get_all_users(), await orm.get_user_city(1), await orm.get_user_city(2)
+
+    users, city, missing = asyncio.run(main())
+    assert [user.tg_id for user in users] == [1]
+    assert city == "Казань"
+    assert missing is None
+
+
+def test_reports_are_returned_with_their_owner(db):
+    async def main():
+        await add_reports(1, 2, "Казань")
+        await add_reports(2, 1)
+        return await orm.get_reports(1), await orm.get_report(1, 3), await orm.get_all_users()
+
+    reports, foreign, users = asyncio.run(main())
+    assert [(report.temp, report.city) for report in reports] == [(0, "Казань"), (1, "Казань")]
+    assert foreign is None
+    # Отчёты пользователей загружаются вместе с пользователями и доступны после закрытия сессии
+    assert [len(user.reports) for user in users] == [2, 1]
+
+
+def key(report) -> tuple:
+    return report.date, report.id
+
+
+def test_history_pages_by_date_and_id(db):
+    async def main():
+        await orm.add_user(1)
+        owner = (await orm.get_user_ids({1}))[1]
+        date = datetime(2024, 5, 1, 12, 0)
+        # Половина отчётов записана в одну и ту же секунду: порядок между ними задаёт идентификатор
+        await orm.create_reports([dict(owner=owner, date=date + timedelta(minutes=i // 2), temp=i, feels_like=i,
+                                       wind_speed=1, pressure_mm=750, city="Москва") for i in range(10)])
+        first, total = await orm.get_reports_page(1, 4)
+        second, _ = await orm.get_reports_page(1, 4, after=key(first[-1]))
+        third, _ = await orm.get_reports_page(1, 4, after=key(second[-1]))
+        back, _ = await orm.get_reports_page(1, 4, before=key(third[0]))
+        return total, [[report.temp for report in page] for page in (first, second, third, back)]
+
+    total, pages = asyncio.run(main())
+    assert total == 10
+    assert pages == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9], [4, 5, 6, 7]]
+
+
+def test_history_total_comes_from_report_counter(db):
+    async def main():
+        await add_reports(1, 3)
+        await add_reports(2, 1)
+        return await orm.get_reports_page(1, 2), await orm.get_reports_page(3, 2)
+
+    (page, total), missing = asyncio.run(main())
+    assert len(page) == 2
+    assert total == 3
+    assert missing == ([], 0)
+
+
+def test_users_page_carries_report_counters(db):
+    async def main():
+        for tg_id in range(1, 6):
+            await add_reports(tg_id, tg_id - 1)
+        first, total = await orm.get_users_page(2)
+        second, _ = await orm.get_users_page(2, after=first[-1].id)
+        back, _ = await orm.get_users_page(2, before=second[0].id)
+        return total, [[(user.tg_id, user.reports_count) for user in page] for page in (first, second, back)]
+
+    total, pages = asyncio.run(main())
+    assert total == 5
+    assert pages == [[(1, 0), (2, 1)], [(3, 2), (4, 3)], [(1, 0), (2, 1)]]
@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from api_requests import request
+from api_requests.cache import TTLCache
+from api_requests.limiter import RateLimiter
+from database import orm
+from services.prefetch import Prefetcher
+
+INTERVAL = 3600
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """
+    Подменяет запросы прогнозов: координаты города - его название, обновлённые прогнозы запоминаются.
+    """
+    refreshed = []
+
+    async def get_city_coord(city: str, priority: int) -> str:
+        return city
+
+    async def refresh_forecast(pos: str):
+        refreshed.append(pos)
+        request.weather_cache.set(pos, {})
+
+    monkeypatch.setattr(request, "get_city_coord", get_city_coord)
+    monkeypatch.setattr(request, "refresh_forecast", refresh_forecast)
+    monkeypatch.setattr(request, "weather_cache", TTLCache(100, 2 * INTERVAL))
+    return refreshed
+
+
+def quota(monkeypatch, daily_quota: int, processes: int = 1):
+    monkeypatch.setattr(request, "weather_limiter", RateLimiter(rate=1000, burst=10, max_queue=10, reserve=0.2,
+                                                                daily_quota=daily_quota // processes))
+
+
+def prefetcher(monkeypatch, popular: list) -> Prefetcher:
+    hour = (datetime.now() + timedelta(seconds=60)).hour
+
+    async def get_popular_cities(days: int, limit: int) -> dict:
+        return {hour: popular}
+
+    monkeypatch.setattr(orm, "get_popular_cities", get_popular_cities)
+    return Prefetcher(top_k=3, lead=60, interval=INTERVAL, history_days=14, budget_share=0.5)
+
+
+def test_budget_is_share_of_process_quota(monkeypatch):
+    quota(monkeypatch, 1000)
+    assert Prefetcher(3, 60, INTERVAL, 14, 0.5).budget_today() == 400
+    # Каждый из четырёх процессов тратит на прогрев четверть общего бюджета
+    quota(monkeypatch, 1000, processes=4)
+    assert Prefetcher(3, 60, INTERVAL, 14, 0.5).budget_today() == 100
+
+
+def test_popular_cities_of_coming_hour_are_refreshed(monkeypatch, api):
+    quota(monkeypatch, 1000)
+    warmer = prefetcher(monkeypatch, [("Москва", 30), ("Казань", 10)])
+    asyncio.run(warmer.tick())
+    assert api == ["Москва", "Казань"]
+
+    # Прогнозы доживут до следующего обновления, повторно они не запрашиваются
+    asyncio.run(warmer.tick())
+    assert api == ["Москва", "Казань"]
+    assert warmer.stats()["skipped"] == 2
+
+
+def test_refreshing_stops_when_budget_is_spent(monkeypatch, api):
+    # Бюджет прогрева - 1 запрос в сутки
+    quota(monkeypatch, 3)
+    warmer = prefetcher(monkeypatch, [("Москва", 30), ("Казань", 10)])
+    asyncio.run(warmer.tick())
+    # Прогнозы устарели, но бюджет на сегодня уже израсходован
+    monkeypatch.setattr(request, "weather_cache", TTLCache(100, 2 * INTERVAL))
+    asyncio.run(warmer.tick())
+
+    assert warmer.budget_today() == 1
+    assert api == ["Москва"]
+    assert warmer.stats()["used_today"] == 1
+
+
+def test_popular_cities_are_counted_per_hour(db):
+    async def main():
+        await orm.add_user(1)
+        owner = (await orm.get_user_ids({1}))[1]
+        morning = datetime.now().replace(hour=8, minute=10) - timedelta(days=1)
+        cities = ["Москва", "Москва", "Казань", "Сочи", "Сочи", "Сочи"]
+        await orm.create_reports([dict(owner=owner, date=morning + timedelta(hours=i // 3), city=city, temp=1,
+                                       feels_like=1, wind_speed=1, pressure_mm=750) for i, city in enumerate(cities)])
+        return await orm.get_popular_cities(days=7, limit=1)
+
+    assert asyncio.run(main()) == {8: [("Москва", 2)], 9: [("Сочи", 3)]}
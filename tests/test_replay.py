@@ -0,0 +1,102 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from api_requests import request
+from api_requests.errors import UpstreamError
+from api_requests.replay import Corpus, request_key
+from settings import api_config
+
+PARAMS = {"lat": "55.75", "lon": "37.61", "apikey": "secret"}
+
+
+def record(path, *bodies: dict) -> Corpus:
+    corpus = Corpus(str(path))
+    for body in bodies:
+        corpus.record("forecast", PARAMS, 0.1, body)
+    corpus.close()
+    return corpus
+
+
+def replay(corpus: Corpus, params: dict = PARAMS) -> dict:
+    return asyncio.run(corpus.replay("forecast", params))
+
+
+def loaded(path) -> Corpus:
+    corpus = Corpus(str(path), latency="zero")
+    corpus.load()
+    return corpus
+
+
+def test_request_key_hides_api_key():
+    assert "secret" not in request_key("geocoder", {"geocode": "Москва", "apikey": "secret"})
+    assert request_key("geocoder", {"b": 1, "a": 2}) == request_key("geocoder", {"a": "2", "b": "1"})
+
+
+def test_body_is_written_only_when_it_changes(tmp_path):
+    path = tmp_path / "api.jsonl.gz"
+    record(path, {"now": 1, "fact": {"temp": 5}}, {"now": 2, "fact": {"temp": 5}}, {"now": 3, "fact": {"temp": 6}})
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert ["b" in entry for entry in entries] == [True, False, True]
+    assert replay(loaded(path)) == {"now": 3, "fact": {"temp": 6}}
+
+
+def test_missing_response_raises_upstream_error(tmp_path):
+    path = tmp_path / "api.jsonl.gz"
+    record(path, {"fact": {}})
+    corpus = loaded(path)
+    with pytest.raises(UpstreamError):
+        replay(corpus, {"lat": "0", "lon": "0"})
+    assert corpus.stats()["missed"] == 1
+
+
+def test_truncated_gzip_member_is_skipped(tmp_path):
+    path = tmp_path / "api.jsonl.gz"
+    record(path, {"fact": {"temp": 1}})
+    intact = path.read_bytes()
+    # Второй член gzip оборвался на середине, как при завершении процесса во время записи
+    record(path, {"fact": {"temp": 2}})
+    path.write_bytes(path.read_bytes()[:len(intact) + 20])
+
+    assert replay(loaded(path)) == {"fact": {"temp": 1}}
+
+
+def test_recording_after_truncation_keeps_file_readable(tmp_path):
+    path = tmp_path / "api.jsonl.gz"
+    record(path, {"fact": {"temp": 1}})
+    with open(path, "ab") as f:
+        f.write(gzip.compress(b'{"e":"forecast","k":"cut'))
+    record(path, {"fact": {"temp": 2}})
+
+    corpus = loaded(path)
+    assert replay(corpus) == {"fact": {"temp": 2}}
+    assert corpus.stats()["keys"] == 1
+
+
+def test_damaged_record_raises_upstream_error(tmp_path):
+    path = tmp_path / "api.jsonl.gz"
+    path.write_bytes(gzip.compress(b'{"e":"forecast"}\n'))
+    with pytest.raises(UpstreamError):
+        loaded(path)
+    path.write_bytes(b"not gzip")
+    with pytest.raises(UpstreamError):
+        loaded(path)
+
+
+def test_unexpected_recorded_response_raises_upstream_error(tmp_path, monkeypatch):
+    path = tmp_path / "api.jsonl.gz"
+    corpus = Corpus(str(path))
+    corpus.record("geocoder", {"geocode": "Москва"}, 0.1, {"response": {}})
+    corpus.close()
+    monkeypatch.setattr(api_config, "replay_mode", "replay")
+    monkeypatch.setattr(api_config, "replay_path", str(path))
+    monkeypatch.setattr(api_config, "replay_latency", "zero")
+    monkeypatch.setattr(request, "_corpus", None)
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(request._get_json("geocoder", "", {"geocode": "Москва"}, parse=request._parse_geocoder))
+    with pytest.raises(UpstreamError):
+        asyncio.run(request._get_json("geocoder", "", {"geocode": "Казань"}))
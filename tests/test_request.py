@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from api_requests import request
+from api_requests.cache import LRUCache
+from api_requests.errors import CityNotFound
+from api_requests.limiter import RateLimiter
+from database import orm
+
+
+@pytest.fixture
+def geocoder(db, monkeypatch):
+    """
+    Подменяет геокодер функцией, которая запоминает запрошенные города и отвечает координатами из словаря.
+    """
+    places = {"Урюпинск": "42.0 50.8"}
+    calls = []
+
+    async def get_json(endpoint, url, params, headers=None, parse=None):
+        calls.append(params["geocode"])
+        return places.get(params["geocode"])
+
+    monkeypatch.setattr(request, "_get_json", get_json)
+    monkeypatch.setattr(request, "gazetteer", SimpleNamespace(exact=lambda name: None))
+    monkeypatch.setattr(request, "geo_cache", LRUCache(10))
+    monkeypatch.setattr(request, "geo_limiter", RateLimiter(rate=1000, burst=10, daily_quota=100, max_queue=10))
+    return calls
+
+
+def test_normalize_city():
+    assert request.normalize_city("  Нижний   Новгород ") == "нижний новгород"
+    assert request.normalize_city("Орёл") == "орел"
+
+
+def test_city_is_geocoded_once(geocoder):
+    async def main():
+        first = await request.get_city_coord("Урюпинск")
+        second = await request.get_city_coord("урюпинск ")
+        return first, second
+
+    assert asyncio.run(main()) == ("42.0 50.8", "42.0 50.8")
+    assert geocoder == ["Урюпинск"]
+
+
+def test_coordinates_survive_restart_in_database(geocoder, monkeypatch):
+    asyncio.run(request.get_city_coord("Урюпинск"))
+    # Новый процесс бота начинает с пустым кэшем в памяти
+    monkeypatch.setattr(request, "geo_cache", LRUCache(10))
+    db_hits = request.geo_db_hits
+
+    assert asyncio.run(request.get_city_coord("Урюпинск")) == "42.0 50.8"
+    assert geocoder == ["Урюпинск"]
+    assert request.geo_db_hits == db_hits + 1
+    assert asyncio.run(orm.get_city_pos("урюпинск")) == "42.0 50.8"
+
+
+def test_unknown_city_is_not_cached(geocoder):
+    for _ in range(2):
+        with pytest.raises(CityNotFound):
+            asyncio.run(request.get_city_coord("Нигдеград"))
+    assert geocoder == ["Нигдеград", "Нигдеград"]
+
+
+def test_saving_known_city_again_is_ignored(db):
+    async def main():
+        await orm.save_city_pos("москва", "37.6 55.7")
+        await orm.save_city_pos("москва", "0 0")
+        return await orm.get_city_pos("москва")
+
+    assert asyncio.run(main()) == "37.6 55.7"
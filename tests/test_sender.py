@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter
+
+import supervisor
+from api_requests.limiter import BACKGROUND, INTERACTIVE
+from services.sender import SendQueue
+from settings import api_config, bot_config
+
+
+def flaky(failures: int, result: str = "sent"):
+    """
+    Возвращает метод Bot API, который первые failures вызовов отвечает RetryAfter, а затем - result.
+    """
+    calls = []
+
+    async def method(**kwargs):
+        calls.append(kwargs)
+        if len(calls) <= failures:
+            raise RetryAfter(0)
+        return result
+
+    method.calls = calls
+    return method
+
+
+async def run(queue: SendQueue, coro):
+    queue.start()
+    try:
+        return await asyncio.wait_for(coro, 1)
+    finally:
+        await queue.stop()
+
+
+async def submit(queue: SendQueue, method, **kwargs):
+    return await run(queue, queue.submit(1, method, **kwargs))
+
+
+def test_retry_after_is_retried():
+    method = flaky(2)
+    queue = SendQueue(None, global_rate=1000, chat_interval=0, max_retries=3)
+
+    result = asyncio.run(submit(queue, method, priority=INTERACTIVE, text="hi"))
+    assert result == "sent"
+    assert method.calls == [{"text": "hi"}] * 3
+    assert queue.stats()["retried"] == 2
+    assert queue.stats()["sent"] == 1
+    assert queue.stats()["failed"] == 0
+
+
+def test_retry_after_gives_up_after_max_retries():
+    method = flaky(5)
+    queue = SendQueue(None, global_rate=1000, chat_interval=0, max_retries=2)
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(submit(queue, method, text="hi"))
+    assert len(method.calls) == 3
+    assert queue.stats()["failed"] == 1
+
+
+def test_interactive_messages_go_first():
+    sent = []
+
+    async def method(text: str):
+        sent.append(text)
+
+    async def main():
+        queue = SendQueue(None, global_rate=1000, chat_interval=0, max_retries=0)
+        futures = [queue.submit(1, method, priority=BACKGROUND, text="broadcast"),
+                   queue.submit(2, method, priority=INTERACTIVE, text="reply")]
+        await run(queue, asyncio.gather(*futures))
+
+    asyncio.run(main())
+    assert sent == ["reply", "broadcast"]
+
+
+def test_pending_edits_of_one_message_are_merged():
+    sent = []
+
+    async def method(text: str):
+        sent.append(text)
+
+    async def main():
+        queue = SendQueue(None, global_rate=1000, chat_interval=0, max_retries=0)
+        futures = [queue.submit(1, method, key=(1, 10), text=text) for text in ("a", "b", "c")]
+        await run(queue, asyncio.gather(*futures))
+        return queue
+
+    assert asyncio.run(main()).stats()["merged"] == 2
+    assert sent == ["c"]
+
+
+def test_edits_during_retry_after_are_merged():
+    calls = []
+
+    async def main():
+        queue = SendQueue(None, global_rate=1000, chat_interval=0, max_retries=1)
+        futures = []
+
+        async def method(text: str):
+            calls.append(text)
+            if len(calls) == 1:
+                # Новое изменение приходит, пока первое ждёт повторной отправки
+                asyncio.get_running_loop().call_soon(
+                    lambda: futures.append(queue.submit(1, method, key=(1, 10), text="b")))
+                raise RetryAfter(0)
+
+        futures.append(queue.submit(1, method, key=(1, 10), text="a"))
+        await run(queue, asyncio.sleep(0.05))
+        assert futures[0] is futures[1]
+        return queue
+
+    assert asyncio.run(main()).stats()["merged"] == 1
+    assert calls == ["a", "b"]
+
+
+def test_merged_edit_keeps_highest_priority():
+    sent = []
+
+    async def method(text: str):
+        sent.append(text)
+
+    async def main():
+        queue = SendQueue(None, global_rate=1000, chat_interval=0, max_retries=0)
+        futures = [queue.submit(2, method, priority=BACKGROUND, text="broadcast"),
+                   queue.submit(1, method, priority=BACKGROUND, key=(1, 10), text="old"),
+                   queue.submit(1, method, priority=INTERACTIVE, key=(1, 10), text="edit")]
+        await run(queue, asyncio.gather(*futures))
+
+    asyncio.run(main())
+    assert sent == ["edit", "broadcast"]
+
+
+def test_worker_processes_share_send_rate(monkeypatch):
+    for name in ("workers", "send_rate", "send_processes", "mode", "background_jobs", "metrics_port"):
+        monkeypatch.setattr(bot_config, name, getattr(bot_config, name))
+    monkeypatch.setattr(api_config, "api_processes", api_config.api_processes)
+    bot_config.workers = 4
+    bot_config.send_rate = 30
+
+    supervisor.configure_worker(1)
+    queue = SendQueue(None, bot_config.send_rate, bot_config.chat_send_interval, bot_config.send_retries,
+                      bot_config.send_processes)
+    assert queue.global_rate * bot_config.workers == pytest.approx(30)
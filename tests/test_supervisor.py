@@ -0,0 +1,59 @@
+import asyncio
+import queue
+
+import pytest
+
+import supervisor
+from settings import api_config, bot_config
+
+
+def message(update_id: int, user_id: int) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": user_id}, "from": {"id": user_id}, "text": "hi"}}
+
+
+def test_user_id_of_update():
+    assert supervisor.user_id_of(message(1, 42)) == 42
+    assert supervisor.user_id_of({"update_id": 1, "callback_query": {"from": {"id": 7}}}) == 7
+    assert supervisor.user_id_of({"update_id": 1, "channel_post": {"chat": {"id": -100}}}) == -100
+    assert supervisor.user_id_of({"update_id": 1}) == 0
+
+
+class FakeBot:
+    """
+    Бот, который отдаёт одну пачку обновлений, а затем останавливает опрос.
+    """
+
+    def __init__(self, updates: list):
+        self.batches = [[message(0, 1)], updates]
+
+    async def delete_webhook(self):
+        pass
+
+    async def request(self, method: str, data: dict):
+        if not self.batches:
+            raise asyncio.CancelledError
+        return self.batches.pop(0)
+
+
+def test_updates_of_one_user_go_to_one_worker():
+    updates = [message(update_id, user_id) for update_id, user_id in enumerate([1, 2, 3, 1, 2, 1], 1)]
+    queues = [queue.Queue(), queue.Queue()]
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(supervisor.poll(FakeBot(updates), queues))
+    received = [[update["update_id"] for update in q.queue] for q in queues]
+    # Пользователи 1 и 3 попадают в процесс 1, пользователь 2 - в процесс 0, порядок обновлений сохраняется
+    assert received == [[2, 5], [1, 3, 4, 6]]
+
+
+def test_only_first_worker_runs_background_jobs(monkeypatch):
+    for name in ("background_jobs", "mode", "metrics_port", "send_processes", "workers"):
+        monkeypatch.setattr(bot_config, name, getattr(bot_config, name))
+    monkeypatch.setattr(api_config, "api_processes", api_config.api_processes)
+    bot_config.workers, bot_config.metrics_port, bot_config.mode = 3, 9100, "webhook"
+
+    supervisor.configure_worker(2)
+    assert bot_config.background_jobs is False
+    assert bot_config.mode == "polling"
+    assert bot_config.metrics_port == 9102
+    assert api_config.api_processes == bot_config.send_processes == 3
@@ -0,0 +1,87 @@
+import asyncio
+
+import aiohttp
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY
+from aiohttp import web
+
+import webhook
+from settings import bot_config
+
+
+async def serve(dispatcher: Dispatcher, coro):
+    """
+    Поднимает сервер вебхука на свободном порту и выполняет coro(адрес вебхука).
+    """
+    app = web.Application()
+    app[BOT_DISPATCHER_KEY] = dispatcher
+    app.router.add_route("*", bot_config.webhook_path, webhook.SecretTokenRequestHandler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        return await coro(f"http://{host}:{port}{bot_config.webhook_path}")
+    finally:
+        await runner.cleanup()
+
+
+def dispatcher_with_log() -> tuple[Dispatcher, list]:
+    dispatcher = Dispatcher(Bot("123456:webhook"))
+    received = []
+
+    @dispatcher.message_handler()
+    async def handler(message: types.Message):
+        received.append((message.from_user.id, message.text))
+
+    return dispatcher, received
+
+
+def test_webhook_passes_updates_to_dispatcher(monkeypatch):
+    monkeypatch.setattr(bot_config, "webhook_secret", "s3cret")
+    dispatcher, received = dispatcher_with_log()
+
+    async def send(url: str):
+        await webhook.send_fake_update(url, 42, "Погода в моём городе")
+        await asyncio.sleep(0.05)
+
+    asyncio.run(serve(dispatcher, send))
+    assert received == [(42, "Погода в моём городе")]
+
+
+def test_webhook_rejects_wrong_secret(monkeypatch):
+    monkeypatch.setattr(bot_config, "webhook_secret", "s3cret")
+    dispatcher, received = dispatcher_with_log()
+
+    async def send(url: str) -> list[int]:
+        statuses = []
+        async with aiohttp.ClientSession() as session:
+            for headers in ({}, {webhook.SECRET_HEADER: "wrong"}):
+                async with session.post(url, json={"update_id": 1}, headers=headers) as r:
+                    statuses.append(r.status)
+        return statuses
+
+    assert asyncio.run(serve(dispatcher, send)) == [401, 401]
+    assert received == []
+
+
+class FakeBot:
+    def __init__(self):
+        self.webhooks = []
+
+    async def set_webhook(self, url: str, secret_token=None):
+        self.webhooks.append((url, secret_token))
+
+
+def test_webhook_is_registered_only_with_external_url(monkeypatch):
+    bot = FakeBot()
+    dispatcher = type("FakeDispatcher", (), {"bot": bot})()
+    monkeypatch.setattr(bot_config, "webhook_url", "")
+    asyncio.run(webhook.register_webhook(dispatcher))
+    assert bot.webhooks == []
+
+    monkeypatch.setattr(bot_config, "webhook_url", "https://example.com")
+    monkeypatch.setattr(bot_config, "webhook_secret", "")
+    asyncio.run(webhook.register_webhook(dispatcher))
+    assert bot.webhooks == [("https://example.com/webhook", None)]
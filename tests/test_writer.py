@@ -0,0 +1,78 @@
+import asyncio
+
+from database import orm
+from database.writer import ReportWriter
+
+
+async def put(writer: ReportWriter, tg_id: int, temp=1):
+    await writer.put(tg_id, temp, temp, 2, 750, "Москва")
+
+
+async def counts(*tg_ids: int) -> list[int]:
+    return [(await orm.get_reports_page(tg_id, 1))[1] for tg_id in tg_ids]
+
+
+def test_reports_are_written_in_batches(db):
+    async def main():
+        for tg_id in (1, 2):
+            await orm.add_user(tg_id)
+        writer = ReportWriter(max_queue=100, batch_size=2, flush_interval=0.05, user_cache_size=10)
+        writer.start()
+        for tg_id in (1, 1, 2, 1, 2):
+            await put(writer, tg_id)
+        while len(writer):
+            await asyncio.sleep(0.01)
+        await writer.stop()
+        return writer, await counts(1, 2)
+
+    writer, written = asyncio.run(main())
+    assert written == [3, 2]
+    assert writer.stats()["written"] == 5
+    assert writer.stats()["batches"] == 3
+
+
+def test_reports_of_unknown_users_are_dropped(db):
+    async def main():
+        await orm.add_user(1)
+        writer = ReportWriter(max_queue=100, batch_size=10, flush_interval=1, user_cache_size=10)
+        await put(writer, 1)
+        await put(writer, 2)
+        await writer.stop()
+        return writer, await counts(1)
+
+    writer, written = asyncio.run(main())
+    assert written == [1]
+    assert writer.stats()["dropped"] == 1
+
+
+def test_failed_batch_is_retried_row_by_row(db):
+    async def main():
+        for tg_id in (1, 2):
+            await orm.add_user(tg_id)
+        writer = ReportWriter(max_queue=100, batch_size=10, flush_interval=1, user_cache_size=10)
+        await put(writer, 1)
+        # Отчёт без температуры нарушает ограничение NOT NULL, и INSERT всей пачки не выполняется
+        await put(writer, 2, temp=None)
+        await put(writer, 2)
+        await writer.stop()
+        return writer, await counts(1, 2)
+
+    writer, written = asyncio.run(main())
+    assert written == [1, 1]
+    assert writer.stats()["written"] == 2
+    assert writer.stats()["dropped"] == 1
+    assert writer.stats()["retried"] == 1
+
+
+def test_user_cache_is_bounded(db):
+    async def main():
+        writer = ReportWriter(max_queue=100, batch_size=10, flush_interval=1, user_cache_size=2)
+        for tg_id in range(1, 6):
+            await orm.add_user(tg_id)
+            await put(writer, tg_id)
+        await writer.stop()
+        return writer
+
+    stats = asyncio.run(main()).stats()
+    assert stats["written"] == 5
+    assert stats["users_cached"] == 2
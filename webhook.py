@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import time
+
+import aiohttp
+from aiogram import Dispatcher
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.utils import executor
+from aiohttp import web
+
+from settings import bot_config
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class SecretTokenRequestHandler(WebhookRequestHandler):
+    """
+    Обработчик запросов вебхука, принимающий только запросы с секретным токеном из bot_config.webhook_secret.
+
+    Telegram передаёт токен, указанный при регистрации вебхука, в заголовке X-Telegram-Bot-Api-Secret-Token.
+    Если токен не задан, принимаются все запросы.
+    """
+
+    async def post(self):
+        if bot_config.webhook_secret and self.request.headers.get(SECRET_HEADER) != bot_config.webhook_secret:
+            raise web.HTTPUnauthorized()
+        return await super().post()
+
+
+def start_webhook(dispatcher: Dispatcher, on_startup, on_shutdown):
+    """
+    Запускает бота в режиме вебхука.
+
+    Поднимает HTTP-сервер aiohttp на bot_config.webapp_host:bot_config.webapp_port,
+    который принимает обновления Telegram по пути bot_config.webhook_path и передаёт их диспетчеру.
+    Несколько таких серверов можно запустить за балансировщиком нагрузки.
+
+    :param dispatcher: Диспетчер бота.
+    :type dispatcher: Dispatcher
+    :param on_startup: Функция, вызываемая при запуске сервера.
+    :param on_shutdown: Функция, вызываемая при остановке сервера.
+    """
+    runner = executor.Executor(dispatcher, skip_updates=False)
+    runner.on_startup(on_startup)
+    runner.on_shutdown(on_shutdown)
+    runner.set_webhook(bot_config.webhook_path, request_handler=SecretTokenRequestHandler, web_app=web.Application())
+    runner.run_app(host=bot_config.webapp_host, port=bot_config.webapp_port)
+
+
+async def register_webhook(dispatcher: Dispatcher):
+    """
+    Регистрирует вебхук в Telegram, если задан внешний адрес bot_config.webhook_url.
+
+    Без внешнего адреса вебхук не регистрируется, и обновления можно отправлять на локальный сервер вручную,
+    например с помощью send_fake_update.
+
+    :param dispatcher: Диспетчер бота.
+    :type dispatcher: Dispatcher
+    """
+    if bot_config.webhook_url:
+        await dispatcher.bot.set_webhook(bot_config.webhook_url + bot_config.webhook_path,
+                                         secret_token=bot_config.webhook_secret or None)
+
+
+async def send_fake_update(url: str, user_id: int, text: str) -> str:
+    """
+    Отправляет на вебхук обновление с текстовым сообщением так же, как это делает Telegram.
+
+    :param url: Адрес вебхука.
+    :type url: str
+    :param user_id: Идентификатор пользователя, от имени которого отправляется сообщение.
+    :type user_id: int
+    :param text: Текст сообщения.
+    :type text: str
+    :return: Тело ответа вебхука.
+    :rtype: str
+    """
+    now = int(time.time())
+    update = {
+        "update_id": now,
+        "message": {
+            "message_id": now,
+            "date": now,
+            "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+    headers = {SECRET_HEADER: bot_config.webhook_secret} if bot_config.webhook_secret else None
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=update, headers=headers) as r:
+            r.raise_for_status()
+            return await r.text()
+
+
+if __name__ == "__main__":
+    # Отправка тестового сообщения на локальный вебхук: python webhook.py 12345 "Погода в моём городе"
+    parser = argparse.ArgumentParser(description="Отправка тестового обновления на вебхук бота")
+    parser.add_argument("user_id", type=int)
+    parser.add_argument("text")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{bot_config.webapp_port}{bot_config.webhook_path}")
+    args = parser.parse_args()
+    print(asyncio.run(send_fake_update(args.url, args.user_id, args.text)))